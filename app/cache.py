@@ -0,0 +1,69 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from .config import settings
+from .models import DataVersion
+
+
+def get_data_version(db: Session) -> int:
+    version = db.scalar(select(DataVersion.version).where(DataVersion.id == 1))
+    return version or 0
+
+
+def bump_data_version(db: Session):
+    """Invalidate cached reports. Does not commit; call inside the write."""
+    stmt = insert(DataVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DataVersion.id], set_={"version": DataVersion.version + 1}
+    )
+    db.execute(stmt)
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class LRUCache:
+    """Small thread-safe LRU; keys should include the data version."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Rendered report fragments keyed by (data version, filters)
+report_cache = LRUCache(settings.REPORT_CACHE_SIZE)
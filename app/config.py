@@ -9,6 +9,28 @@ class Settings:
     ALLOWED_USERS: List[str] = os.getenv("ALLOWED_USERS", "").split(",")
     AUTH_BYPASS: str = os.getenv("AUTH_BYPASS", "")
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./revolut.db")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # Parse processes per web worker (uvicorn --workers / WEB_CONCURRENCY)
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "2"))
+    # How long a write waits for SQLite's lock before "database is locked";
+    # ingestions queue on a file lock instead, so this only covers short writes
+    # waiting behind one ingestion's commit
+    DB_BUSY_TIMEOUT_MS: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "30000"))
+    REPORT_CACHE_SIZE: int = int(os.getenv("REPORT_CACHE_SIZE", "64"))
+    # Off when `python -m app.manage migrate` runs as a separate deploy step
+    MIGRATE_ON_STARTUP: bool = os.getenv("MIGRATE_ON_STARTUP", "true") != "false"
+    # Request bodies larger than this are refused with 413 while streaming
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+    # Uploads waiting for a person are evicted after this long, or oldest
+    # first once together they exceed the quota
+    TEMP_UPLOAD_TTL_SECONDS: int = int(os.getenv("TEMP_UPLOAD_TTL_SECONDS", "3600"))
+    TEMP_UPLOAD_QUOTA_BYTES: int = int(
+        os.getenv("TEMP_UPLOAD_QUOTA_BYTES", str(512 * 1024 * 1024))
+    )
+    TEMP_UPLOAD_SWEEP_SECONDS: int = int(os.getenv("TEMP_UPLOAD_SWEEP_SECONDS", "300"))
+    # Currency reports are totalled in; changing it needs `manage fx --apply`
+    REPORTING_CURRENCY: str = os.getenv("REPORTING_CURRENCY", "GBP")
     TRUSTED_HOSTS: List[str] = os.getenv("TRUSTED_HOSTS", "*").split(",")
 
 
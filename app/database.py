@@ -1,16 +1,118 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from typing import Optional, Union
+from fastapi import Depends
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Connection, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from starlette.concurrency import run_in_threadpool
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
+# Applied to every new SQLite connection. WAL lets readers carry on while an
+# ingestion is writing; NORMAL sync is durable enough under WAL. The page
+# cache and memory map are kept small, and temp tables (the ingestion's
+# staging table, sort spills) stay on disk, so ingestion memory does not grow
+# with the size of the file; `benchmarks.run --max-rss-growth-mib` checks it.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 32 * 1024 * 1024,
+    "cache_size": -8 * 1024,  # KiB, i.e. 8 MiB
+    "busy_timeout": settings.DB_BUSY_TIMEOUT_MS,
+}
+
+ASYNC_SQLITE_DRIVER = "sqlite+aiosqlite"
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def _is_file_db(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def _engine_kwargs(url: URL) -> dict:
+    kwargs: dict = {}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if _is_file_db(url):
+        kwargs["pool_size"] = settings.DB_POOL_SIZE
+        kwargs["max_overflow"] = settings.DB_MAX_OVERFLOW
+        kwargs["pool_pre_ping"] = True
+    return kwargs
+
+
+def make_engine(database_url: Union[str, URL]):
+    url = make_url(database_url)
+    engine = create_engine(url, **_engine_kwargs(url))
+    if _is_file_db(url):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+def make_async_engine(database_url: Union[str, URL]):
+    url = make_url(database_url)
+    kwargs = _engine_kwargs(url)
+    kwargs.pop("connect_args", None)
+    engine = create_async_engine(url, **kwargs)
+    if _is_file_db(url):
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+# DATABASE_URL=sqlite+aiosqlite:///... turns on async sessions for the read
+# paths; ingestion always writes through a plain synchronous engine.
+_url = make_url(settings.DATABASE_URL)
+AsyncSessionLocal: Optional[async_sessionmaker[AsyncSession]]
+if _url.drivername == ASYNC_SQLITE_DRIVER:
+    engine = make_engine(_url.set(drivername="sqlite"))
+    async_engine = make_async_engine(settings.DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+else:
+    engine = make_engine(settings.DATABASE_URL)
+    async_engine = None
+    AsyncSessionLocal = None
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
+def session_engine(db: Session) -> Engine:
+    """The engine behind db, for work that opens its own sessions later."""
+    bind = db.get_bind()
+    return bind.engine if isinstance(bind, Connection) else bind
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_read_db(db: Session = Depends(get_db)):
+    """Session for read-only handlers: async when configured, else the sync one."""
+    if AsyncSessionLocal is None:
+        yield db
+        return
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+async def run_read(db, fn, *args):
+    """
+    Call fn(session, *args) without blocking the event loop: through
+    AsyncSession.run_sync in async mode, on the threadpool otherwise.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
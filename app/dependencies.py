@@ -1,4 +1,8 @@
 from fastapi.templating import Jinja2Templates
 
+from .config import settings
+
 # Assuming run from root of project
 templates = Jinja2Templates(directory="app/templates")
+# Shown next to the upload field; larger bodies are refused with 413
+templates.env.globals["max_upload"] = f"{settings.MAX_UPLOAD_BYTES / 2**20:g}MB"
@@ -0,0 +1,110 @@
+"""
+Streaming exports of monthly_summaries.
+
+Rows are read through a yield_per cursor and encoded a batch at a time, so an
+export of any length holds one batch in memory. CSV and NDJSON bytes go out
+as each batch is encoded. XLSX is a zip archive that cannot be sent before it
+is complete: rows are written to openpyxl's write-only workbook, which keeps
+them in a temporary file, and the finished file is streamed back from disk.
+"""
+
+import csv
+import io
+import json
+import tempfile
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import MonthlySummary
+from .reporting import _filter
+
+# Rows fetched from the cursor, and encoded, at a time
+EXPORT_BATCH_ROWS = 2_000
+# Bytes per chunk when streaming a finished XLSX file
+FILE_CHUNK_BYTES = 64 * 1024
+
+COLUMNS = [
+    "person_name",
+    "month_year",
+    "description",
+    "currency",
+    "total_amount",
+    "reporting_amount",
+]
+
+
+def iter_summary_batches(
+    db: Session,
+    person: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+) -> Iterator[list[tuple]]:
+    """Matching summaries as lists of tuples in COLUMNS order, oldest month first."""
+    stmt = _filter(
+        select(*(getattr(MonthlySummary, c) for c in COLUMNS)),
+        person=person,
+        month_from=month_from,
+        month_to=month_to,
+    ).order_by(
+        MonthlySummary.person_name,
+        MonthlySummary.month_year,
+        MonthlySummary.description,
+        MonthlySummary.currency,
+    )
+    result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    for batch in result.partitions():
+        yield [tuple(row) for row in batch]
+
+
+def _csv(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, row))) + "\n" for row in batch
+        ).encode()
+
+
+def _xlsx(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    # Imported here to keep openpyxl off the startup path
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Summaries")
+    sheet.append(COLUMNS)
+    for batch in batches:
+        for row in batch:
+            sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while chunk := f.read(FILE_CHUNK_BYTES):
+            yield chunk
+
+
+class ExportFormat(NamedTuple):
+    media_type: str
+    encode: Callable[[Iterator[list[tuple]]], Iterator[bytes]]
+
+
+FORMATS = {
+    "csv": ExportFormat("text/csv; charset=utf-8", _csv),
+    "ndjson": ExportFormat("application/x-ndjson", _ndjson),
+    "xlsx": ExportFormat(
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", _xlsx
+    ),
+}
@@ -0,0 +1,150 @@
+"""
+Foreign exchange rates.
+
+Rates live in fx_rates, loaded from a local CSV with date,currency,rate
+columns, where rate is the value of one unit of `currency` in the reporting
+currency. Nothing is fetched over the network.
+
+Amounts are converted once, at ingestion, with an as-of join on the
+transaction date: a transaction uses the latest rate on or before its day,
+or the earliest known rate if it predates the table. The reporting currency
+converts at 1, and currencies with no rates at all stay NULL.
+"""
+
+from typing import Optional, cast
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import CursorResult
+from sqlalchemy.orm import Session
+
+from .cache import bump_data_version
+from .config import settings
+from .models import FxRate, Transaction
+
+RATE_COLUMNS = ["date", "currency", "rate"]
+
+
+def load_rates_file(db: Session, path: str) -> int:
+    """Upsert the rates in a CSV file into fx_rates and commit. Returns rows read."""
+    try:
+        rates = pd.read_csv(
+            path, usecols=RATE_COLUMNS, dtype={"currency": "str", "rate": "float64"}
+        )
+        rates["date"] = pd.to_datetime(rates["date"], format="%Y-%m-%d").dt.date
+    except Exception as e:
+        raise ValueError(f"Failed to read rates file: {e}")
+    rates = rates.dropna()
+    if (rates["rate"] <= 0).any():
+        raise ValueError("Failed to read rates file: rates must be positive")
+
+    records = [
+        {"currency": currency.upper(), "date": date, "rate": rate}
+        for date, currency, rate in zip(
+            rates["date"].tolist(), rates["currency"].tolist(), rates["rate"].tolist()
+        )
+    ]
+    upsert = sqlite_insert(FxRate)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=["currency", "date"], set_={"rate": upsert.excluded.rate}
+    )
+    if records:
+        db.execute(upsert, records)
+    db.commit()
+    return len(records)
+
+
+def load_rates(db: Session) -> pd.DataFrame:
+    """All rates as a frame sorted by date, ready for merge_asof."""
+    rows = db.execute(
+        select(FxRate.date, FxRate.currency, FxRate.rate).order_by(FxRate.date)
+    ).all()
+    rates = pd.DataFrame(rows, columns=RATE_COLUMNS)
+    rates["date"] = pd.to_datetime(rates["date"]).astype("datetime64[ns]")
+    rates["currency"] = rates["currency"].astype(object)
+    return rates
+
+
+def to_reporting(
+    chunk: pd.DataFrame, rates: pd.DataFrame, reporting_currency: Optional[str] = None
+) -> pd.Series:
+    """amount + fee of each prepared row in the reporting currency, NaN if no rate."""
+    reporting_currency = reporting_currency or settings.REPORTING_CURRENCY
+    currency = chunk["currency"].astype(object).to_numpy()
+    rate = np.where(currency == reporting_currency, 1.0, np.nan)
+
+    foreign = np.flatnonzero(currency != reporting_currency)
+    if len(foreign) and not rates.empty:
+        left = pd.DataFrame(
+            {
+                "date": chunk["completed_at"]
+                .to_numpy()[foreign]
+                .astype("datetime64[ns]"),
+                "currency": currency[foreign],
+                "pos": foreign,
+            }
+        ).sort_values("date", kind="stable")
+        found = pd.merge_asof(
+            left, rates, on="date", by="currency", direction="backward"
+        )
+        missing = found["rate"].isna().to_numpy()
+        if missing.any():
+            # Older than the first rate for the currency: use that first rate
+            earliest = pd.merge_asof(
+                left[missing], rates, on="date", by="currency", direction="forward"
+            )
+            found.loc[missing, "rate"] = earliest["rate"].to_numpy()
+        rate[found["pos"].to_numpy()] = found["rate"].to_numpy()
+
+    return (chunk["amount"] + chunk["fee"]) * rate
+
+
+def _rate_as_of(on_or_before: bool):
+    day = func.date(Transaction.completed_at)
+    stmt = select(FxRate.rate).where(FxRate.currency == Transaction.currency)
+    if on_or_before:
+        stmt = stmt.where(FxRate.date <= day).order_by(FxRate.date.desc())
+    else:
+        stmt = stmt.where(FxRate.date > day).order_by(FxRate.date)
+    return stmt.limit(1).scalar_subquery()
+
+
+def reconvert(db: Session) -> int:
+    """
+    Recompute every stored transaction's reporting amount from the current
+    rates, with the same as-of rule as ingestion, and rebuild the summaries
+    in one transaction. Returns the number of transactions updated.
+    """
+    # processor imports this module for to_reporting
+    from .processor import _aggregate_transactions, write_summaries
+
+    rate = case(
+        (Transaction.currency == settings.REPORTING_CURRENCY, 1.0),
+        else_=func.coalesce(_rate_as_of(True), _rate_as_of(False)),
+    )
+    try:
+        # One UPDATE; each row's rate is an index seek on fx_rates' primary key
+        result = db.execute(
+            update(Transaction)
+            .values(reporting_amount=(Transaction.amount + Transaction.fee) * rate)
+            .execution_options(synchronize_session=False)
+        )
+        updated = cast(CursorResult, result).rowcount
+
+        months = db.execute(
+            select(Transaction.person_name, Transaction.month_year).distinct()
+        ).all()
+        by_person: dict[str, list[str]] = {}
+        for person_name, month in months:
+            by_person.setdefault(person_name, []).append(month)
+        for person_name, person_months in by_person.items():
+            agg_df = _aggregate_transactions(db, person_name, person_months)
+            write_summaries(agg_df, person_name, db)
+        bump_data_version(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return updated
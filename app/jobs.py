@@ -0,0 +1,524 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Callable, Optional, Sequence, TypeVar, cast
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .ledger import find_upload, fingerprint
+from .locks import locked_commit, try_lock, write_lock
+from .metrics import IngestStats, record_ingest, record_stages
+from .models import IngestionJob
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+UPLOAD_DIR = "temp_uploads"
+
+# Ordered stages every job goes through; `IngestionJob.stage` holds the current one.
+STAGES = ("parse", "write")
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Threads for the jobs' own database work, including the wait for the write
+# lock, apart from the threadpool requests are served on: a queue of uploads
+# waiting their turn to write must not leave /health or the reports waiting.
+_job_threads: Optional[ThreadPoolExecutor] = None
+
+# Parses started before their file was handed to a job, e.g. while the user
+# picks a person, by file path. Jobs take them over instead of re-parsing.
+_parses: dict[str, Future] = {}
+_parses_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn rather than fork: the parent runs an event loop and DB threads
+        _executor = ProcessPoolExecutor(
+            max_workers=max(settings.INGEST_WORKERS, 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor, _job_threads
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _job_threads is not None:
+        _job_threads.shutdown(wait=False, cancel_futures=True)
+        _job_threads = None
+
+
+async def _in_job_thread(fn: Callable[..., T], *args: Any) -> T:
+    global _job_threads
+    if _job_threads is None:
+        # Writes take turns on the write lock, so more threads than parse
+        # processes would only add waiters
+        _job_threads = ThreadPoolExecutor(
+            max_workers=max(settings.INGEST_WORKERS, 1), thread_name_prefix="ingest"
+        )
+    return await asyncio.get_running_loop().run_in_executor(_job_threads, fn, *args)
+
+
+def stash_path(file_id: str) -> str:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return os.path.join(UPLOAD_DIR, f"{file_id}.xls")
+
+
+def create_job(
+    db: Session, person_name: str, file_path: str, filename: Optional[str]
+) -> IngestionJob:
+    job = IngestionJob(
+        id=str(uuid.uuid4()),
+        person_name=person_name,
+        filename=filename,
+        file_path=file_path,
+        status="queued",
+        stage=STAGES[0],
+    )
+    db.add(job)
+    locked_commit(db)
+    return job
+
+
+def _parse_file(file_path: str) -> IngestStats:
+    # Runs in a worker process; the prepared chunks go to disk rather than
+    # being pickled back through the pool in one piece. Metrics recorded here
+    # would stay in the worker, so the timings travel back to the parent.
+    from .processor import iter_transaction_chunks, save_chunks
+
+    stats = IngestStats()
+    # Written aside and renamed into place: a parse started ahead of time by
+    # another web worker may be writing the same output
+    partial = f"{file_path}.parsed.{os.getpid()}"
+    try:
+        with open(file_path, "rb") as f:
+            save_chunks(iter_transaction_chunks(f, stats), partial)
+    except Exception:
+        _remove(partial)
+        raise
+    os.replace(partial, f"{file_path}.parsed")
+    stats.worker_rss_growth = stats.rss_growth()
+    return stats
+
+
+def start_parse(file_path: str) -> Future:
+    """Parse the file in the pool ahead of time; see _take_parse."""
+    with _parses_lock:
+        if file_path not in _parses:
+            _parses[file_path] = get_executor().submit(_parse_file, file_path)
+        return _parses[file_path]
+
+
+def _take_parse(file_path: str) -> Future:
+    with _parses_lock:
+        future = _parses.pop(file_path, None)
+    return future or get_executor().submit(_parse_file, file_path)
+
+
+def prune_parses():
+    """
+    Forget finished parses of files that are gone: with several web workers,
+    the upload may have been finalized, and parsed again, by another one.
+    """
+    with _parses_lock:
+        for path, future in list(_parses.items()):
+            if future.done() and not os.path.exists(path):
+                del _parses[path]
+
+
+def _remove(path: str):
+    # Another worker, or its sweeper, may get there first
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_file(file_path: str):
+    """Delete an upload and anything parsed from it, including ahead of time."""
+    with _parses_lock:
+        future = _parses.pop(file_path, None)
+    if future is not None and not future.cancel():
+        # Already running: remove its output once it is written
+        future.add_done_callback(lambda _: _remove(f"{file_path}.parsed"))
+    _remove(f"{file_path}.parsed")
+    _remove(file_path)
+
+
+def _set_state(db: Session, job: IngestionJob, **fields):
+    for key, value in fields.items():
+        setattr(job, key, value)
+    locked_commit(db)
+
+
+async def run_job(job_id: str, bind: Engine):
+    """
+    Parse the job's file in the process pool, then write the aggregates.
+
+    A coroutine, for FastAPI's BackgroundTasks or asyncio.create_task: the
+    parse is awaited without holding a thread, and the database work runs on
+    the jobs' own threads (_in_job_thread) rather than the request threadpool.
+
+    A job runs in one web worker at a time: the worker holds a lock on the
+    uploaded file while it runs, and every worker resumes pending jobs at
+    startup, so a job another worker holds is skipped.
+    """
+    file_path = await _in_job_thread(_pending_file, bind, job_id)
+    if file_path is None:
+        return
+
+    with try_lock(file_path) as claimed:
+        if claimed:
+            await _run_claimed(job_id, bind)
+
+
+def _pending_file(bind: Engine, job_id: str) -> Optional[str]:
+    with Session(bind=bind) as db:
+        job = db.get(IngestionJob, job_id)
+        if job is None or job.status in ("done", "skipped"):
+            return None
+        return str(job.file_path)
+
+
+async def _run_claimed(job_id: str, bind: Engine):
+    with Session(bind=bind) as db:
+        # Read again under the lock: the previous holder may have finished it
+        job = await _in_job_thread(db.get, IngestionJob, job_id)
+        if job is None or job.status in ("done", "skipped"):
+            return
+        file_path = str(job.file_path)
+        parsed_path = f"{file_path}.parsed"
+        stats = IngestStats()
+
+        try:
+            content_hash = await _in_job_thread(_start_job, db, job, stats)
+            if content_hash is not None:
+                with stats.time("parse"):
+                    stats.merge(await asyncio.wrap_future(_take_parse(file_path)))
+                await _in_job_thread(_write_job, db, job, content_hash, stats, bind)
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            await _in_job_thread(_fail_jobs, db, [job], e)
+            record_ingest(stats, "failed")
+            return
+        finally:
+            _remove(parsed_path)
+
+    await _in_job_thread(discard_file, file_path)
+
+
+def _start_job(db: Session, job: IngestionJob, stats: IngestStats) -> Optional[str]:
+    """
+    Mark the job as parsing and return its file's fingerprint, or None when
+    the same file was already ingested for the person.
+    """
+    with open(str(job.file_path), "rb") as f:
+        content_hash = fingerprint(f)
+    previous = find_upload(db, content_hash, str(job.person_name))
+    if previous is not None:
+        _set_state(
+            db,
+            job,
+            status="skipped",
+            stage=None,
+            record_count=previous.record_count,
+            error=None,
+        )
+        record_ingest(stats, "skipped")
+        return None
+    _set_state(db, job, status="running", stage="parse", error=None)
+    return content_hash
+
+
+def _write_job(
+    db: Session, job: IngestionJob, content_hash: str, stats: IngestStats, bind: Engine
+):
+    # pandas is only needed once something is ingested; importing it lazily
+    # keeps it off the cold-start path
+    from .processor import ingest_transactions, load_chunks
+
+    _set_state(db, job, stage="write")
+    with write_lock(bind):
+        count = ingest_transactions(
+            stats.timed_iter(load_chunks(f"{job.file_path}.parsed"), "load"),
+            str(job.person_name),
+            db,
+            content_hash,
+            cast(Optional[str], job.filename),
+            stats,
+        )
+
+    _set_state(db, job, status="done", stage=None, record_count=count)
+    record_ingest(stats, "done")
+
+
+def _fail_jobs(db: Session, jobs: list[IngestionJob], error: Exception):
+    """Mark the jobs still queued or running as failed with `error`."""
+    db.rollback()
+    for job in jobs:
+        if job.status in ("queued", "running"):
+            _set_state(db, job, status="failed", error=str(error))
+
+
+def create_batch(
+    db: Session,
+    files: Sequence[tuple[Optional[str], str, Optional[str]]],
+    errors: Optional[list[Optional[str]]] = None,
+) -> str:
+    """
+    Queue one job per (file_path, person_name, filename) under a new batch
+    id, for run_batch, and return the id. A file rejected before it was
+    written, with its reason in `errors`, gets a failed job instead, so the
+    batch still accounts for every file.
+    """
+    batch_id = str(uuid.uuid4())
+    for (file_path, person_name, filename), error in zip(
+        files, errors or [None] * len(files)
+    ):
+        db.add(
+            IngestionJob(
+                id=str(uuid.uuid4()),
+                batch_id=batch_id,
+                person_name=person_name,
+                filename=filename,
+                file_path=file_path,
+                status="failed" if error else "queued",
+                stage=STAGES[0],
+                error=error,
+            )
+        )
+    locked_commit(db)
+    return batch_id
+
+
+def batch_jobs(db: Session, batch_id: str) -> list[IngestionJob]:
+    """A batch's jobs in the order the files were given."""
+    # One commit created them all, so rowid rather than created_at orders them
+    stmt = (
+        select(IngestionJob)
+        .where(IngestionJob.batch_id == batch_id)
+        .order_by(text("ingestion_jobs.rowid"))
+    )
+    return list(db.scalars(stmt))
+
+
+async def run_batch(batch_id: str, bind: Engine):
+    """
+    Ingest a batch's queued jobs together: parse their files in parallel in
+    the process pool, then write every file that parsed in one transaction.
+    Each job records its own outcome, and the uploaded files are removed
+    afterwards whatever it is.
+
+    A coroutine, like run_job. Jobs another worker holds are left to it; a
+    batch interrupted by a restart is resumed job by job, through run_job.
+    """
+    with Session(bind=bind) as db, ExitStack() as held:
+        jobs = await _in_job_thread(_claim_batch, db, held, batch_id)
+        # Read now: the commits that follow expire the jobs' attributes
+        stats = {str(job.id): IngestStats() for job in jobs}
+        file_paths = [str(job.file_path) for job in jobs]
+        batch_stats = IngestStats()
+        try:
+            parsing, duplicates = await _in_job_thread(_start_batch, db, jobs)
+            results = await asyncio.gather(
+                *(asyncio.wrap_future(future) for _, _, future in parsing),
+                return_exceptions=True,
+            )
+            await _in_job_thread(
+                _write_batch,
+                db,
+                [(job, content_hash) for job, content_hash, _ in parsing],
+                results,
+                duplicates,
+                stats,
+                batch_stats,
+                bind,
+            )
+        except Exception as e:
+            logger.exception("Batch %s failed", batch_id)
+            await _in_job_thread(_fail_jobs, db, jobs, e)
+        finally:
+            for file_path in file_paths:
+                await _in_job_thread(discard_file, file_path)
+
+        await _in_job_thread(_record_batch, jobs, stats, batch_stats)
+
+
+def _claim_batch(db: Session, held: ExitStack, batch_id: str) -> list[IngestionJob]:
+    """The batch's pending jobs this worker could lock, kept locked by `held`."""
+    jobs = [
+        job
+        for job in batch_jobs(db, batch_id)
+        if job.status in ("queued", "running")
+        and held.enter_context(try_lock(str(job.file_path)))
+    ]
+    # Read again under the locks: a previous holder may have finished some
+    for job in jobs:
+        db.refresh(job)
+    return [job for job in jobs if job.status in ("queued", "running")]
+
+
+def _start_batch(
+    db: Session, jobs: list[IngestionJob]
+) -> tuple[
+    list[tuple[IngestionJob, str, Future]], list[tuple[IngestionJob, IngestionJob]]
+]:
+    """
+    Start parsing each new file; return the (job, fingerprint, parse) of each,
+    and the (job, job it repeats) of files given twice.
+    """
+    parsing: list[tuple[IngestionJob, str, Future]] = []
+    duplicates: list[tuple[IngestionJob, IngestionJob]] = []
+    first_seen: dict[tuple[str, str], IngestionJob] = {}
+    for job in jobs:
+        file_path, person_name = str(job.file_path), str(job.person_name)
+        with open(file_path, "rb") as f:
+            content_hash = fingerprint(f)
+        previous = find_upload(db, content_hash, person_name)
+        if previous is not None:
+            _set_state(
+                db,
+                job,
+                status="skipped",
+                stage=None,
+                record_count=previous.record_count,
+            )
+        elif (content_hash, person_name) in first_seen:
+            # Same file twice in one batch: ingest it once
+            duplicates.append((job, first_seen[(content_hash, person_name)]))
+        else:
+            first_seen[(content_hash, person_name)] = job
+            _set_state(db, job, status="running", stage="parse", error=None)
+            parsing.append((job, content_hash, _take_parse(file_path)))
+    return parsing, duplicates
+
+
+def _write_batch(
+    db: Session,
+    parsing: list[tuple[IngestionJob, str]],
+    results: Sequence[object],
+    duplicates: list[tuple[IngestionJob, IngestionJob]],
+    stats: dict[str, IngestStats],
+    batch_stats: IngestStats,
+    bind: Engine,
+):
+    """Write the files that parsed together and record every job's outcome."""
+    from .processor import PreparedFile, ingest_batch, load_chunks
+
+    parsed = []
+    for (job, content_hash), result in zip(parsing, results):
+        if isinstance(result, IngestStats):
+            stats[str(job.id)].merge(result)
+            _set_state(db, job, stage="write")
+            parsed.append((job, content_hash))
+        else:
+            logger.error(
+                "Parsing %s failed", job.file_path, exc_info=cast(Exception, result)
+            )
+            _set_state(db, job, status="failed", error=str(result))
+
+    prepared = [
+        PreparedFile(
+            stats[str(job.id)].timed_iter(
+                load_chunks(f"{job.file_path}.parsed"), "load"
+            ),
+            str(job.person_name),
+            content_hash,
+            cast(Optional[str], job.filename),
+            stats[str(job.id)],
+        )
+        for job, content_hash in parsed
+    ]
+    try:
+        with write_lock(bind):
+            counts = ingest_batch(prepared, db, batch_stats)
+    except Exception as e:
+        logger.exception("Batch write failed")
+        for job, _ in parsed:
+            _set_state(db, job, status="failed", error=str(e))
+    else:
+        for (job, _), count in zip(parsed, counts):
+            _set_state(db, job, status="done", stage=None, record_count=count)
+
+    for job, original in duplicates:
+        _set_state(
+            db,
+            job,
+            status="skipped" if original.status == "done" else "failed",
+            stage=None,
+            record_count=original.record_count,
+            error=original.error,
+        )
+
+
+def _record_batch(
+    jobs: list[IngestionJob], stats: dict[str, IngestStats], batch_stats: IngestStats
+):
+    for job in jobs:
+        record_ingest(stats[str(job.id)], str(job.status))
+    record_stages(batch_stats)
+
+
+def batch_status(batch_id: str, jobs: list[IngestionJob]) -> dict:
+    files = [job_status(job) for job in jobs]
+    pending = any(f["status"] in ("queued", "running") for f in files)
+    return {"id": batch_id, "status": "running" if pending else "done", "files": files}
+
+
+def load_batch(db: Session, batch_id: str) -> Optional[dict]:
+    """batch_status of a batch, or None if there is no such batch."""
+    jobs = batch_jobs(db, batch_id)
+    return batch_status(batch_id, jobs) if jobs else None
+
+
+def pending_job_ids(db: Session) -> list[str]:
+    """Jobs that were queued or interrupted mid-run, oldest first."""
+    jobs = (
+        db.query(IngestionJob.id)
+        .filter(IngestionJob.status.in_(["queued", "running"]))
+        .order_by(IngestionJob.created_at)
+        .all()
+    )
+    return [job_id for (job_id,) in jobs]
+
+
+def job_status(job: IngestionJob) -> dict:
+    stages = {}
+    current = STAGES.index(job.stage) if job.stage in STAGES else len(STAGES)
+    for i, name in enumerate(STAGES):
+        if i < current:
+            stages[name] = "done"
+        elif i > current:
+            stages[name] = "pending"
+        elif job.status == "failed":
+            stages[name] = "failed"
+        elif job.status == "running":
+            stages[name] = "running"
+        else:
+            stages[name] = "pending"
+
+    return {
+        "id": job.id,
+        "person": job.person_name,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "stages": stages,
+        "progress": round(100 * min(current, len(STAGES)) / len(STAGES)),
+        "record_count": job.record_count,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
@@ -0,0 +1,88 @@
+import hashlib
+from typing import BinaryIO, Optional
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from .models import Transaction, Upload
+
+BLOCK_SIZE = 1 << 20
+
+
+def fingerprint(stream: BinaryIO) -> str:
+    """sha256 of the whole stream, read in blocks; rewinds it afterwards."""
+    stream.seek(0)
+    digest = hashlib.sha256()
+    while block := stream.read(BLOCK_SIZE):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def find_upload(db: Session, content_hash: str, person_name: str) -> Optional[Upload]:
+    return db.scalar(
+        select(Upload).where(
+            Upload.content_hash == content_hash, Upload.person_name == person_name
+        )
+    )
+
+
+def record_upload(
+    db: Session,
+    content_hash: str,
+    person_name: str,
+    filename: Optional[str],
+    month_range: tuple[Optional[str], Optional[str]],
+    record_count: int,
+    ingest_id: str,
+):
+    """Add the file to the ledger. Does not commit; call inside the ingestion."""
+    stmt = insert(Upload).values(
+        content_hash=content_hash,
+        person_name=person_name,
+        filename=filename,
+        month_from=month_range[0],
+        month_to=month_range[1],
+        record_count=record_count,
+        ingest_id=ingest_id,
+    )
+    db.execute(stmt.on_conflict_do_nothing())
+
+
+def list_uploads(
+    db: Session, person: Optional[str] = None, month: Optional[str] = None
+) -> list[dict]:
+    """Ledger entries, newest first, with the months each file added rows to."""
+    stmt = select(Upload).order_by(Upload.created_at.desc(), Upload.id.desc())
+    if person:
+        stmt = stmt.where(Upload.person_name == person)
+    if month:
+        stmt = stmt.where(Upload.month_from <= month, Upload.month_to >= month)
+    uploads = list(db.scalars(stmt))
+
+    fed: dict[str, dict[str, int]] = {}
+    ingest_ids = [u.ingest_id for u in uploads]
+    if ingest_ids:
+        rows = db.execute(
+            select(Transaction.ingest_id, Transaction.month_year, func.count())
+            .where(Transaction.ingest_id.in_(ingest_ids))
+            .group_by(Transaction.ingest_id, Transaction.month_year)
+            .order_by(Transaction.month_year)
+        )
+        for ingest_id, month_year, count in rows:
+            fed.setdefault(ingest_id, {})[month_year] = count
+
+    return [
+        {
+            "id": u.id,
+            "content_hash": u.content_hash,
+            "person": u.person_name,
+            "filename": u.filename,
+            "month_from": u.month_from,
+            "month_to": u.month_to,
+            "record_count": u.record_count,
+            # New rows this file contributed per month
+            "months_fed": fed.get(str(u.ingest_id), {}),
+            "created_at": u.created_at.isoformat() if u.created_at else None,
+        }
+        for u in uploads
+    ]
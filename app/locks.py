@@ -0,0 +1,80 @@
+"""
+File locks for running several web workers against one SQLite database.
+
+SQLite allows one writer at a time, and a writer that waits longer than the
+busy timeout fails with "database is locked". Ingestion holds the write lock
+for as long as a whole statement takes to store, which can be longer than
+the timeout, so every write from every worker process (ingestions, job and
+upload-store updates through locked_commit, maintenance commands) queues on
+write_lock instead, and nothing waits on SQLite's own lock for long.
+
+Locks are flock()s, so a worker that dies releases its locks with it. Where
+fcntl is unavailable (Windows) only threads of one process are coordinated.
+"""
+
+import threading
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Iterator, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .database import _is_file_db, session_engine
+
+fcntl: Optional[ModuleType]
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def write_lock(bind: Engine) -> Iterator[None]:
+    """
+    Hold the single-writer lock for bind's database, waiting as long as it
+    takes. The lock file sits next to the database file.
+    """
+    with _write_lock:
+        if fcntl is None or not _is_file_db(bind.url):
+            # In-memory databases are private to the process anyway
+            yield
+            return
+        with open(f"{bind.url.database}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def locked_commit(db: Session):
+    """
+    Commit db's pending writes as the single writer. Blocks while another
+    worker ingests, so async callers run it on the threadpool.
+    """
+    with write_lock(session_engine(db)):
+        db.commit()
+
+
+@contextmanager
+def try_lock(path: str) -> Iterator[bool]:
+    """
+    Lock an existing file exclusively without waiting; yields whether this
+    process got the lock (or the file is gone, so there is nothing to hold).
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        yield True
+        return
+    with f:
+        acquired = True
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                acquired = False
+        yield acquired
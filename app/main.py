@@ -1,23 +1,84 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import RedirectResponse, Response
 from .config import settings
-from .database import engine, Base
+from .database import engine, SessionLocal
 from .auth import oauth
-from .routers import upload, reports
+from .jobs import pending_job_ids, run_job, shutdown_executor
+from .locks import write_lock
+from . import metrics
+from .migrations import migrate
+from .routers import upload, reports, jobs, search
+from .uploads import BodyLimitMiddleware, sweep_store
 
-# Create DB tables
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="RePivot")
+_resumed: set[asyncio.Task] = set()
+
+
+async def _load_oidc_metadata():
+    # Fetch Google's discovery document now rather than on the first /login
+    try:
+        await oauth.google.load_server_metadata()
+    except Exception:
+        logger.warning("Could not load OIDC metadata; retrying on first login")
+
+
+async def _sweep_uploads():
+    # Evict abandoned uploads (a share sheet nobody finished) on a timer
+    while True:
+        try:
+            await run_in_threadpool(sweep_store, engine)
+        except Exception:
+            logger.exception("Sweeping temporary uploads failed")
+        await asyncio.sleep(settings.TEMP_UPLOAD_SWEEP_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.MIGRATE_ON_STARTUP:
+        # With several workers, the first to start migrates; the rest wait
+        with write_lock(engine):
+            migrate(engine)
+    with SessionLocal() as db:
+        # Resume ingestion jobs that were queued or interrupted by the last
+        # shutdown. Every worker tries; run_job lets one of them have each job.
+        job_ids = pending_job_ids(db)
+    for job_id in job_ids:
+        task = asyncio.create_task(run_job(job_id, engine))
+        # The loop only keeps a weak reference to its tasks
+        _resumed.add(task)
+        task.add_done_callback(_resumed.discard)
+    # In the background so /health answers without waiting on the network
+    oidc = None
+    if settings.GOOGLE_CLIENT_ID and not settings.AUTH_BYPASS:
+        oidc = asyncio.create_task(_load_oidc_metadata())
+
+    sweeper = asyncio.create_task(_sweep_uploads())
+
+    yield
+
+    sweeper.cancel()
+    if oidc is not None:
+        oidc.cancel()
+    shutdown_executor()
+
+
+app = FastAPI(title="RePivot", lifespan=lifespan)
 
 # Middleware
 # Middleware
 
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=settings.TRUSTED_HOSTS)
 app.add_middleware(SessionMiddleware, secret_key=settings.SECRET_KEY)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(BodyLimitMiddleware)
 
 
 @app.exception_handler(401)
@@ -31,6 +92,8 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Routers
 app.include_router(upload.router)
 app.include_router(reports.router)
+app.include_router(jobs.router)
+app.include_router(search.router)
 
 
 @app.get("/login")
@@ -62,3 +125,8 @@ async def logout(request: Request):
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,158 @@
+"""Maintenance commands: python -m app.manage <command>"""
+
+import argparse
+import sys
+from sqlalchemy import func, select
+from .config import settings
+from .database import SessionLocal, engine
+from .fx import load_rates_file, reconvert
+from .locks import write_lock
+from .merchants import add_rule, recanonicalise
+from .migrations import migrate
+from .models import FxRate, MerchantRule
+from .rollup import check_rollups, rebuild_rollups
+
+
+def migrate_command(args) -> int:
+    # main() has already migrated; this command exists to do only that
+    print("Schema is up to date.")
+    return 0
+
+
+def rollups(args) -> int:
+    with SessionLocal() as db:
+        if args.rebuild:
+            rebuild_rollups(db)
+            print("Rebuilt person/month rollups from monthly_summaries.")
+            return 0
+
+        problems = check_rollups(db)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} inconsistencies; run with --rebuild to fix.")
+        return 1
+    print("Rollups are consistent.")
+    return 0
+
+
+def merchants(args) -> int:
+    with SessionLocal() as db:
+        if args.add:
+            pattern, merchant = args.add
+            try:
+                add_rule(db, pattern, merchant, args.priority)
+            except ValueError as e:
+                print(e)
+                return 1
+        if args.remove is not None:
+            db.query(MerchantRule).filter_by(id=args.remove).delete()
+            db.commit()
+
+        if args.apply:
+            descriptions, months = recanonicalise(db)
+            print(
+                f"Re-canonicalised {descriptions} descriptions; "
+                f"rebuilt {months} person/months."
+            )
+            return 0
+
+        for rule in db.query(MerchantRule).order_by(
+            MerchantRule.priority, MerchantRule.id
+        ):
+            print(f"{rule.id}\t{rule.priority}\t{rule.pattern}\t{rule.merchant}")
+    if args.add or args.remove is not None:
+        print("Rules changed; run with --apply to update existing data.")
+    return 0
+
+
+def fx(args) -> int:
+    with SessionLocal() as db:
+        if args.load:
+            try:
+                loaded = load_rates_file(db, args.load)
+            except (OSError, ValueError) as e:
+                print(e)
+                return 1
+            print(f"Loaded {loaded} rates from {args.load}.")
+
+        if args.apply:
+            updated = reconvert(db)
+            print(
+                f"Converted {updated} transactions to {settings.REPORTING_CURRENCY} "
+                "and rebuilt their summaries."
+            )
+            return 0
+
+        for currency, first, last, count in db.execute(
+            select(
+                FxRate.currency,
+                func.min(FxRate.date),
+                func.max(FxRate.date),
+                func.count(),
+            )
+            .group_by(FxRate.currency)
+            .order_by(FxRate.currency)
+        ):
+            print(f"{currency}\t{first}\t{last}\t{count}")
+    if args.load:
+        print("Rates changed; run with --apply to update existing data.")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser(
+        "migrate", help="Create or upgrade the database schema, then exit"
+    )
+    cmd.set_defaults(func=migrate_command)
+
+    cmd = commands.add_parser(
+        "rollups", help="Check the person/month rollup table against the details"
+    )
+    cmd.add_argument(
+        "--rebuild", action="store_true", help="Regenerate it from the detail rows"
+    )
+    cmd.set_defaults(func=rollups)
+
+    cmd = commands.add_parser(
+        "merchants", help="List or edit merchant rules, or re-apply them"
+    )
+    cmd.add_argument(
+        "--add", nargs=2, metavar=("PATTERN", "MERCHANT"), help="Add a rule"
+    )
+    cmd.add_argument("--priority", type=int, default=0, help="Lower wins")
+    cmd.add_argument("--remove", type=int, metavar="ID", help="Delete a rule")
+    cmd.add_argument(
+        "--apply",
+        action="store_true",
+        help="Re-canonicalise stored transactions and rebuild their summaries",
+    )
+    cmd.set_defaults(func=merchants)
+
+    cmd = commands.add_parser(
+        "fx", help="List or load FX rates, or re-convert stored amounts"
+    )
+    cmd.add_argument(
+        "--load", metavar="FILE", help="Upsert rates from a date,currency,rate CSV"
+    )
+    cmd.add_argument(
+        "--apply",
+        action="store_true",
+        help="Re-convert stored transactions and rebuild their summaries",
+    )
+    cmd.set_defaults(func=fx)
+
+    args = parser.parse_args(argv)
+    # Commands rewrite summaries wholesale, so they take their turn as the
+    # single writer alongside the web workers' ingestions
+    with write_lock(engine):
+        # Every command needs the current schema
+        migrate(engine)
+        return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Merchant canonicalisation.
+
+The rules in merchant_rules are compiled into a single alternation, so each
+description is matched once against all of them, and the result is memoised
+per distinct description. Chunks are mapped per category rather than per
+row.
+"""
+
+import re
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from .cache import bump_data_version
+from .models import MerchantRule, Transaction
+
+# Distinct descriptions remembered per compiled rule set
+MATCH_CACHE_SIZE = 65_536
+
+
+class MerchantMatcher:
+    def __init__(self, rules: tuple[tuple[str, str], ...]):
+        """rules: (pattern, merchant) pairs, highest priority first."""
+        self.merchants = [merchant for _, merchant in rules]
+        # One named group per rule, each allowed to match anywhere in the
+        # description. Matched from the start, alternatives are tried in
+        # order, so the highest-priority rule wins rather than the leftmost hit.
+        combined = "|".join(
+            _alternative(i, pattern) for i, (pattern, _) in enumerate(rules)
+        )
+        self._regex = re.compile(combined, re.IGNORECASE | re.DOTALL) if rules else None
+        self.match = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._match)
+
+    def _match(self, description: str) -> Optional[str]:
+        if self._regex is None:
+            return None
+        found = self._regex.match(description)
+        if found is None or found.lastgroup is None:
+            return None
+        return self.merchants[int(found.lastgroup[1:])]
+
+    def canonicalise(self, descriptions: pd.Series) -> pd.Series:
+        """Canonical merchant per row, None where no rule matched."""
+        values = descriptions.astype("category")
+        mapped = np.array(
+            [self.match(str(d)) for d in values.cat.categories] + [None],
+            dtype=object,
+        )
+        # Missing descriptions have code -1, which picks the trailing None
+        return pd.Series(mapped[values.cat.codes.to_numpy()], index=descriptions.index)
+
+
+@lru_cache(maxsize=4)
+def _compile(rules: tuple[tuple[str, str], ...]) -> MerchantMatcher:
+    return MerchantMatcher(rules)
+
+
+def load_matcher(db: Session) -> MerchantMatcher:
+    """
+    Matcher for the current rules. Compiled matchers (and their memoised
+    matches) are reused for as long as the rules stay the same.
+    """
+    rules = db.execute(
+        select(MerchantRule.pattern, MerchantRule.merchant).order_by(
+            MerchantRule.priority, MerchantRule.id
+        )
+    ).all()
+    return _compile(tuple((pattern, merchant) for pattern, merchant in rules))
+
+
+def _alternative(i: int, pattern: str) -> str:
+    return f"(?P<r{i}>.*?(?:{pattern}))"
+
+
+def add_rule(db: Session, pattern: str, merchant: str, priority: int = 0):
+    """
+    Store a rule. The pattern must also work as one alternative of the
+    matcher's combined regex, so it cannot define groups of its own (nor,
+    therefore, refer back to them) or set flags for the whole expression.
+    """
+    try:
+        compiled = re.compile(pattern)
+        re.compile(_alternative(0, pattern))
+    except re.error as e:
+        raise ValueError(f"Invalid pattern {pattern!r}: {e}")
+    if compiled.groups:
+        raise ValueError(
+            f"Invalid pattern {pattern!r}: use non-capturing groups, (?:...)"
+        )
+    db.add(MerchantRule(pattern=pattern, merchant=merchant, priority=priority))
+    db.commit()
+
+
+def recanonicalise(db: Session) -> tuple[int, int]:
+    """
+    Re-apply the current rules to every stored transaction and rebuild the
+    summaries of the months whose merchants changed, in one transaction.
+    Returns (descriptions changed, person/months rebuilt).
+    """
+    # processor imports this module for load_matcher
+    from .processor import _aggregate_transactions, write_summaries
+
+    matcher = load_matcher(db)
+    pairs = db.execute(
+        select(Transaction.description, Transaction.merchant).distinct()
+    ).all()
+    changes = {}
+    for description, current in pairs:
+        merchant = matcher.match(description)
+        if merchant != current:
+            changes[description] = merchant
+    if not changes:
+        return 0, 0
+
+    try:
+        affected = db.execute(
+            select(Transaction.person_name, Transaction.month_year)
+            .where(Transaction.description.in_(list(changes)))
+            .distinct()
+        ).all()
+        # Core executemany: one UPDATE per changed description
+        transactions = Transaction.__table__
+        db.connection().execute(
+            update(transactions)
+            .where(transactions.c.description == bindparam("old"))
+            .values(merchant=bindparam("new")),
+            [{"old": d, "new": m} for d, m in changes.items()],
+        )
+
+        by_person: dict[str, list[str]] = {}
+        for person_name, month in affected:
+            by_person.setdefault(person_name, []).append(month)
+        for person_name, months in by_person.items():
+            agg_df = _aggregate_transactions(db, person_name, months)
+            write_summaries(agg_df, person_name, db)
+        bump_data_version(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(changes), len(affected)
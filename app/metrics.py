@@ -0,0 +1,296 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Kept deliberately small: a handful of counters, gauges and histograms behind
+one lock each, cheap enough to record on every request and every ingestion.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000)
+MEMORY_BUCKETS = tuple(mib * 1024 * 1024 for mib in (8, 16, 32, 64, 128, 256, 512))
+
+_registry: list["_Metric"] = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", r"\\").replace('"', r"\""))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_max(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Counts are stored per bucket and made cumulative at render time
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(names, key + (le,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of this process; None where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+REQUEST_SECONDS = Histogram(
+    "repivot_http_request_duration_seconds",
+    "Request latency by route.",
+    ("method", "route", "status"),
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "repivot_ingest_stage_seconds",
+    "Time spent in each ingestion stage.",
+    ("stage",),
+)
+INGEST_ROWS = Histogram(
+    "repivot_ingest_rows",
+    "Rows handled per ingestion.",
+    ("kind",),
+    buckets=ROW_BUCKETS,
+)
+INGESTIONS = Counter(
+    "repivot_ingestions_total",
+    "Ingestions by outcome.",
+    ("status",),
+)
+INGEST_RSS_GROWTH = Histogram(
+    "repivot_ingest_rss_growth_bytes",
+    "Resident memory growth over an ingestion, per process role.",
+    ("process",),
+    buckets=MEMORY_BUCKETS,
+)
+
+
+class IngestStats:
+    """
+    Stage durations and row counts for one ingestion. Plain attributes so it
+    pickles back from a worker process and can be merged into the parent's.
+
+    Memory is tracked as growth over the RSS when the stats were created,
+    sampled at the end of every timed stage. The process peak (ru_maxrss)
+    would not do: after one large ingestion it is the same for all later
+    ones. Other requests served meanwhile count towards the growth too.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self.rows: dict[str, int] = {}
+        self.rss_start = rss_bytes()
+        self.rss_peak = self.rss_start
+        self.worker_rss_growth: Optional[int] = None
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + (
+                time.perf_counter() - start
+            )
+            rss = rss_bytes()
+            if rss is not None and self.rss_peak is not None:
+                self.rss_peak = max(self.rss_peak, rss)
+
+    def timed_iter(self, iterable: Iterable[T], stage: str) -> Iterator[T]:
+        """Iterate, charging the time spent producing each item to `stage`."""
+        iterator = iter(iterable)
+        while True:
+            with self.time(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, kind: str, rows: int):
+        self.rows[kind] = self.rows.get(kind, 0) + rows
+
+    def rss_growth(self) -> Optional[int]:
+        if self.rss_start is None or self.rss_peak is None:
+            return None
+        return self.rss_peak - self.rss_start
+
+    def merge(self, other: "IngestStats"):
+        for stage, seconds in other.stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for kind, rows in other.rows.items():
+            self.count(kind, rows)
+        if other.worker_rss_growth is not None:
+            self.worker_rss_growth = other.worker_rss_growth
+
+
+def record_stages(stats: IngestStats):
+    for stage, seconds in stats.stages.items():
+        INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+    for kind, rows in stats.rows.items():
+        INGEST_ROWS.observe(rows, kind=kind)
+
+
+def record_ingest(stats: IngestStats, status: str):
+    record_stages(stats)
+    INGESTIONS.inc(status=status)
+
+    growth = stats.rss_growth()
+    if growth is not None:
+        INGEST_RSS_GROWTH.observe(growth, process="web")
+    if stats.worker_rss_growth is not None:
+        INGEST_RSS_GROWTH.observe(stats.worker_rss_growth, process="worker")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every request that matched a route, labelled
+    by the route's path template so path parameters don't explode the series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None)
+            if path is not None and path != "/metrics":
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - start,
+                    method=scope["method"],
+                    route=path,
+                    status=status,
+                )
@@ -0,0 +1,127 @@
+"""
+Schema management.
+
+Runs from the lifespan hook when MIGRATE_ON_STARTUP is set (the default), or
+once per deploy with `python -m app.manage migrate` so the web process can
+start serving without paying for DDL.
+
+create_all covers new tables; changes to existing tables are numbered steps
+in STEPS, tracked with SQLite's user_version pragma. Steps must tolerate a
+fresh database, where create_all has already built the current schema.
+"""
+
+from sqlalchemy import MetaData, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from .database import Base
+from .models import (
+    SUMMARY_SEARCH_DDL,
+    IngestionJob,
+    MonthlySummary,
+    PersonMonthTotal,
+    Transaction,
+)
+from .rollup import rebuild_rollups, rollups_missing
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str):
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+
+def _transactions_merchant(conn: Connection):
+    # NULL means "no rule matched"; `manage merchants --apply` fills it in
+    _add_column(conn, "transactions", "merchant", "VARCHAR")
+
+
+def _reporting_amounts(conn: Connection):
+    # Existing rows stay NULL until `manage fx --apply` converts them
+    for table in ("transactions", "monthly_summaries", "person_month_totals"):
+        _add_column(conn, table, "reporting_amount", "FLOAT")
+
+
+def _summaries_fts(conn: Connection):
+    # create_all only builds the index along with a new monthly_summaries
+    for statement in SUMMARY_SEARCH_DDL:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("INSERT INTO summaries_fts(summaries_fts) VALUES ('rebuild')")
+
+
+def _covering_indexes(conn: Connection):
+    # Single-column indexes that the composite ones below (or the unique
+    # constraints) now lead with
+    for name in [
+        "ix_monthly_summaries_person_name",
+        "ix_monthly_summaries_month_year",
+        "ix_person_month_totals_person_name",
+        "ix_person_month_totals_month_year",
+        "ix_transactions_person_month",
+        "ix_transactions_ingest_id",
+    ]:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    for model in (MonthlySummary, PersonMonthTotal, Transaction):
+        for index in model.__table__.indexes:
+            # Reflection skips expression indexes, so no checkfirst
+            conn.execute(CreateIndex(index, if_not_exists=True))
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _summary_currency_key(conn: Connection):
+    # d_p_m_desc_uc gained currency. SQLite cannot alter a constraint, so the
+    # table is rebuilt under its current definition, keeping the ids the
+    # search index refers to; dropping the old one takes its indexes and
+    # triggers with it. Existing rows are unique on the narrower key already.
+    table = MonthlySummary.__table__
+    columns = ", ".join(c.name for c in table.columns)
+    rebuilt = table.to_metadata(MetaData(), name="monthly_summaries_rebuilt")
+    conn.execute(CreateTable(rebuilt))
+    conn.exec_driver_sql(
+        f"INSERT INTO monthly_summaries_rebuilt ({columns}) "
+        f"SELECT {columns} FROM monthly_summaries"
+    )
+    conn.exec_driver_sql("DROP TABLE monthly_summaries")
+    conn.exec_driver_sql(
+        "ALTER TABLE monthly_summaries_rebuilt RENAME TO monthly_summaries"
+    )
+    for index in table.indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+    _summaries_fts(conn)
+
+
+def _job_batches(conn: Connection):
+    # Jobs queued before batches went through the job table have no batch
+    _add_column(conn, "ingestion_jobs", "batch_id", "VARCHAR")
+    for index in IngestionJob.__table__.indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+# Step N brings the database to user_version N + 1. Append only.
+STEPS = [
+    _transactions_merchant,
+    _reporting_amounts,
+    _summaries_fts,
+    _covering_indexes,
+    _summary_currency_key,
+    _job_batches,
+]
+
+
+def schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+
+def migrate(bind: Engine):
+    """Create missing tables, apply pending steps, backfill derived data."""
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for version in range(schema_version(conn), len(STEPS)):
+            STEPS[version](conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version + 1}")
+
+    with Session(bind=bind) as db:
+        # Backfill the rollup table for databases created before it existed
+        if rollups_missing(db):
+            rebuild_rollups(db)
@@ -1,4 +1,18 @@
-from sqlalchemy import Column, Integer, String, Float, UniqueConstraint
+from datetime import datetime
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    event,
+    func,
+)
 from .database import Base
 
 
@@ -6,14 +20,254 @@ class MonthlySummary(Base):
     __tablename__ = "monthly_summaries"
 
     id = Column(Integer, primary_key=True, index=True)
-    person_name = Column(String, index=True)
-    month_year = Column(String, index=True)  # Format: YYYY-MM
+    person_name = Column(String)
+    month_year = Column(String)  # Format: YYYY-MM
     description = Column(String)
     total_amount = Column(Float)
     currency = Column(String)
+    # total_amount in the reporting currency; NULL if any row lacked a rate
+    reporting_amount = Column(Float)
+
+    __table_args__ = (
+        # One row per merchant and currency spent in. Also serves person/month
+        # lookups: the upsert's delete and exports
+        UniqueConstraint(
+            "person_name",
+            "month_year",
+            "description",
+            "currency",
+            name="d_p_m_desc_uc",
+        ),
+        # Covering, in group order, for the rollup refresh
+        Index(
+            "ix_monthly_summaries_month_person_currency",
+            "month_year",
+            "person_name",
+            "currency",
+            "total_amount",
+            "reporting_amount",
+        ),
+    )
+
+
+def summary_sort_amount():
+    # What report entries are ranked by: comparable across currencies where a
+    # conversion exists
+    return func.coalesce(MonthlySummary.reporting_amount, MonthlySummary.total_amount)
+
+
+# Covering, in window order, for the report listing: entries of a page of
+# months come off the index already partitioned and ranked
+Index(
+    "ix_monthly_summaries_report",
+    MonthlySummary.month_year,
+    MonthlySummary.person_name,
+    summary_sort_amount().desc(),
+    MonthlySummary.description,
+    MonthlySummary.total_amount,
+    MonthlySummary.currency,
+    MonthlySummary.reporting_amount,
+)
+
+
+# Full-text index over summary descriptions (merchants), for /search. An
+# external-content FTS5 table: it stores only the index, and triggers keep it
+# in step with every insert, upsert and delete on monthly_summaries. Prefix
+# indexes make "rob*" style queries a single lookup.
+SUMMARY_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS summaries_fts USING fts5(
+        description, content='monthly_summaries', content_rowid='id',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS summaries_fts_insert
+    AFTER INSERT ON monthly_summaries BEGIN
+        INSERT INTO summaries_fts(rowid, description)
+        VALUES (new.id, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS summaries_fts_delete
+    AFTER DELETE ON monthly_summaries BEGIN
+        INSERT INTO summaries_fts(summaries_fts, rowid, description)
+        VALUES ('delete', old.id, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS summaries_fts_update
+    AFTER UPDATE OF description ON monthly_summaries BEGIN
+        INSERT INTO summaries_fts(summaries_fts, rowid, description)
+        VALUES ('delete', old.id, old.description);
+        INSERT INTO summaries_fts(rowid, description)
+        VALUES (new.id, new.description);
+    END""",
+]
+
+for statement in SUMMARY_SEARCH_DDL:
+    event.listen(
+        MonthlySummary.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    MonthlySummary.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS summaries_fts").execute_if(dialect="sqlite"),
+)
+
+
+class Transaction(Base):
+    """
+    Raw card payments. A row is identified by the person, a hash of its
+    (completed date, description, amount, fee, currency) and its occurrence
+    number among identical rows in the same upload, so re-uploading an
+    overlapping export only adds the rows that were not seen before.
+    """
+
+    __tablename__ = "transactions"
+
+    person_name = Column(String, primary_key=True)
+    row_hash = Column(BigInteger, primary_key=True)
+    occurrence = Column(Integer, primary_key=True)
+    completed_at = Column(DateTime)
+    month_year = Column(String)  # Format: YYYY-MM
+    description = Column(String)
+    # Canonical merchant from merchant_rules; NULL when no rule matched
+    merchant = Column(String)
+    amount = Column(Float)
+    fee = Column(Float)
+    currency = Column(String)
+    # amount + fee in settings.REPORTING_CURRENCY, converted at ingestion;
+    # NULL when there is no rate for the currency
+    reporting_amount = Column(Float)
+    ingest_id = Column(String)  # Ingestion that first added the row
+
+    __table_args__ = (
+        # In summary group order (see processor._merchant_or_description), for
+        # aggregating a person's months and finding summaries that dropped out
+        Index(
+            "ix_transactions_person_month_merchant",
+            "person_name",
+            "month_year",
+            func.coalesce(merchant, description),
+            "currency",
+        ),
+        # Covering for the months an ingestion fed (ledger, summary refresh)
+        Index("ix_transactions_ingest_month", "ingest_id", "month_year"),
+    )
+
+
+class MerchantRule(Base):
+    """
+    Regex mapped to a canonical merchant name. Summaries group transactions
+    by merchant, so "TFL TRAVEL CH" and "TfL Travel Charge" become one row.
+    """
+
+    __tablename__ = "merchant_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    pattern = Column(String, nullable=False, unique=True)  # Case-insensitive
+    merchant = Column(String, nullable=False)
+    priority = Column(Integer, nullable=False, default=0)  # Lower wins
+
+
+class FxRate(Base):
+    """
+    Value of one unit of `currency` in the reporting currency on `date`,
+    loaded from a local file with `python -m app.manage fx --load`.
+    """
+
+    __tablename__ = "fx_rates"
+
+    currency = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    rate = Column(Float, nullable=False)
+
+
+class PersonMonthTotal(Base):
+    """Rollup of monthly_summaries per person, month and currency."""
+
+    __tablename__ = "person_month_totals"
+
+    id = Column(Integer, primary_key=True, index=True)
+    person_name = Column(String)
+    month_year = Column(String)  # Format: YYYY-MM
+    currency = Column(String)
+    total_amount = Column(Float)
+    reporting_amount = Column(Float)  # NULL if any detail row lacked a rate
+    merchant_count = Column(Integer)
 
     __table_args__ = (
+        # Also serves the per-person month list and list_people
         UniqueConstraint(
-            "person_name", "month_year", "description", name="d_p_m_desc_uc"
+            "person_name", "month_year", "currency", name="p_m_currency_uc"
+        ),
+        # Covering, in display order, for the report headers and the month list
+        Index(
+            "ix_person_month_totals_report",
+            month_year.desc(),
+            "person_name",
+            total_amount.desc(),
+            "currency",
+            "reporting_amount",
+            "merchant_count",
         ),
     )
+
+
+class Upload(Base):
+    """Ledger of ingested files, used to skip re-processing identical uploads."""
+
+    __tablename__ = "uploads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String)  # sha256 of the file as uploaded
+    person_name = Column(String, index=True)
+    filename = Column(String)
+    month_from = Column(String)  # Format: YYYY-MM
+    month_to = Column(String)
+    record_count = Column(Integer)  # Card payments read from the file
+    ingest_id = Column(String)  # Matches Transaction.ingest_id of rows it added
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("content_hash", "person_name", name="upload_hash_person_uc"),
+    )
+
+
+class DataVersion(Base):
+    """Single-row counter bumped by every ingestion that changes report data."""
+
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class StashedUpload(Base):
+    """
+    A file uploaded without a person (the Share Target flow), waiting in
+    UPLOAD_DIR until it is finalized or swept, see app/uploads.py.
+    """
+
+    __tablename__ = "stashed_uploads"
+
+    id = Column(String, primary_key=True)  # uuid4, also the file name
+    owner = Column(String, index=True)  # Email of the user who uploaded it
+    filename = Column(String)
+    path = Column(String)
+    size = Column(BigInteger)  # Bytes
+    format = Column(String)  # Sniffed from the leading bytes: xlsx, xls or csv
+    content_hash = Column(String)  # sha256, computed while writing
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4
+    batch_id = Column(String, index=True)  # Shared by the files of a batch upload
+    person_name = Column(String)
+    filename = Column(String)
+    file_path = Column(String)  # NULL when the file was rejected before writing
+    status = Column(String, index=True)  # queued, running, done, skipped, failed
+    stage = Column(String)  # Current entry of jobs.STAGES
+    record_count = Column(Integer)
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
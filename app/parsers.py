@@ -0,0 +1,334 @@
+"""
+Statement parsers.
+
+A statement is read in two steps: the container format is picked from the
+file's leading bytes (xlsx, xls, or delimited text as the fallback), then the
+bank layout from its header row. Each layout maps its columns onto the
+Revolut schema the processor works with, see CANONICAL_COLUMNS.
+"""
+
+import io
+from operator import itemgetter
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Optional, Union
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Rows are parsed this many at a time and staged into SQLite, so peak memory is
+# bounded by the chunk size rather than the size of the statement.
+CHUNK_ROWS = 10_000
+
+XLSX_SIGNATURE = b"PK\x03\x04"
+XLS_SIGNATURE = b"\xd0\xcf\x11\xe0"
+
+DATE_COL = "Completed Date"
+CARD_PAYMENT = "Card Payment"
+CANONICAL_COLUMNS = ["Type", DATE_COL, "Description", "Amount", "Fee", "Currency"]
+
+StatementSource = Union[bytes, BinaryIO]
+
+
+class Layout(NamedTuple):
+    """How one bank's export maps onto the canonical columns."""
+
+    name: str
+    # Header columns that identify the layout
+    signature: frozenset
+    # Source column -> canonical column; only these columns are read
+    columns: dict
+    # Source column -> dtype, for readers that can apply them while parsing
+    dtypes: dict
+    # Anything a rename cannot express, applied after renaming
+    transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None
+    # Renamed columns the processor (or transform) cannot do without
+    required: frozenset = frozenset()
+
+    def wanted(self, header) -> list[str]:
+        return [c for c in header if c in self.columns]
+
+    def missing(self, header) -> list[str]:
+        """Required columns the header lacks, by their source names."""
+        present = {self.columns[c] for c in self.wanted(header)}
+        sources: dict[str, str] = {}
+        for source, canonical in self.columns.items():
+            sources.setdefault(canonical, source)
+        return sorted(sources.get(c, c) for c in self.required - present)
+
+    def to_canonical(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df[self.wanted(df.columns)].rename(columns=self.columns)
+        if self.transform is not None:
+            df = self.transform(df)
+        return df
+
+
+REVOLUT = Layout(
+    name="revolut",
+    signature=frozenset({DATE_COL, "Amount", "Currency"}),
+    columns={
+        "Type": "Type",
+        DATE_COL: DATE_COL,
+        "Description": "Description",
+        # Older exports
+        "DateDescription": "Description",
+        "Amount": "Amount",
+        "Fee": "Fee",
+        "Currency": "Currency",
+    },
+    # Few distinct values per column: categoricals keep one copy of each
+    dtypes={
+        "Type": "category",
+        DATE_COL: str,
+        "Description": "category",
+        "DateDescription": "category",
+        "Amount": "float64",
+        "Fee": "float64",
+        "Currency": "category",
+    },
+    required=frozenset({DATE_COL, "Description", "Amount", "Fee", "Currency"}),
+)
+
+
+def _monzo_to_canonical(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Type": df["Type"].where(df["Type"] != "Card payment", CARD_PAYMENT),
+            # Day-first dates, which the processor would read month-first
+            DATE_COL: pd.to_datetime(
+                df["Date"] + " " + df["Time"],
+                format="%d/%m/%Y %H:%M:%S",
+                errors="coerce",
+            ),
+            "Description": df["Description"],
+            "Amount": df["Amount"],
+            "Fee": 0.0,
+            "Currency": df["Currency"],
+        },
+        index=df.index,
+    )
+
+
+MONZO = Layout(
+    name="monzo",
+    signature=frozenset({"Transaction ID", "Date", "Time", "Name", "Amount"}),
+    columns={
+        "Date": "Date",
+        "Time": "Time",
+        "Type": "Type",
+        "Name": "Description",
+        "Amount": "Amount",
+        "Currency": "Currency",
+    },
+    dtypes={
+        "Date": str,
+        "Time": str,
+        "Type": str,
+        "Name": "category",
+        "Amount": "float64",
+        "Currency": "category",
+    },
+    transform=_monzo_to_canonical,
+    required=frozenset({"Date", "Time", "Type", "Description", "Amount", "Currency"}),
+)
+
+LAYOUTS: list[Layout] = [REVOLUT, MONZO]
+
+
+def register_layout(layout: Layout):
+    LAYOUTS.append(layout)
+
+
+def detect_layout(header) -> Layout:
+    """
+    The layout whose signature the header matches most specifically. Revolut
+    is the default, so a file missing its columns fails with the usual error.
+    """
+    header = set(header)
+    matches = [layout for layout in LAYOUTS if layout.signature <= header]
+    if not matches:
+        return REVOLUT
+    return max(matches, key=lambda layout: len(layout.signature))
+
+
+def open_source(source: StatementSource) -> BinaryIO:
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def _sniff(stream: BinaryIO) -> bytes:
+    signature = stream.read(8)
+    stream.seek(0)
+    return signature
+
+
+def _open_workbook(stream: BinaryIO):
+    try:
+        return load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ValueError(f"Failed to read Excel file: {e}")
+
+
+def _cell_names(row: tuple) -> list[str]:
+    return [str(c) if c is not None else "" for c in row]
+
+
+def _xlsx_header(stream: BinaryIO) -> list[str]:
+    workbook = _open_workbook(stream)
+    try:
+        row = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+    finally:
+        workbook.close()
+    return _cell_names(row)
+
+
+def _iter_xlsx_chunks(stream: BinaryIO) -> Iterator[pd.DataFrame]:
+    workbook = _open_workbook(stream)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = _cell_names(header)
+        layout = detect_layout(header)
+        width = len(header)
+        # Keep only the layout's cells of each row
+        columns = layout.wanted(header)
+        positions = [header.index(c) for c in columns]
+        pick = lambda row: tuple(row[i] for i in positions)  # noqa: E731
+        if len(positions) > 1:
+            pick = itemgetter(*positions)
+
+        chunk: list = []
+        for row in rows:
+            if len(row) != width:
+                row = tuple(row[:width]) + (None,) * (width - len(row))
+            chunk.append(pick(row))
+            if len(chunk) >= CHUNK_ROWS:
+                yield layout.to_canonical(
+                    pd.DataFrame.from_records(chunk, columns=columns)
+                )
+                chunk = []
+        if chunk:
+            yield layout.to_canonical(pd.DataFrame.from_records(chunk, columns=columns))
+    finally:
+        workbook.close()
+
+
+def _xls_header(stream: BinaryIO) -> list[str]:
+    try:
+        return list(pd.read_excel(stream, nrows=0).columns)
+    except Exception as e:
+        raise ValueError(f"Failed to read Excel file: {e}")
+
+
+def _iter_xls_chunks(stream: BinaryIO) -> Iterator[pd.DataFrame]:
+    # Legacy BIFF workbooks cannot be read incrementally; load once and
+    # hand the frame out in chunks so the aggregation path stays the same.
+    try:
+        df = pd.read_excel(stream)
+    except Exception as e:
+        raise ValueError(f"Failed to read Excel file: {e}")
+    df = detect_layout(df.columns).to_canonical(df)
+    for start in range(0, len(df), CHUNK_ROWS):
+        yield df.iloc[start : start + CHUNK_ROWS]
+
+
+def _csv_header(stream: BinaryIO) -> list[str]:
+    try:
+        return list(pd.read_csv(stream, nrows=0).columns)
+    except Exception as e:
+        raise ValueError(f"Failed to read CSV file: {e}")
+
+
+def _iter_csv_chunks(stream: BinaryIO) -> Iterator[pd.DataFrame]:
+    # Header first, so only the layout's columns are parsed, with fixed dtypes
+    # instead of per-column inference
+    header = _csv_header(stream)
+    try:
+        stream.seek(0)
+        layout = detect_layout(header)
+        wanted = layout.wanted(header)
+        reader = pd.read_csv(
+            stream,
+            usecols=wanted,
+            dtype={c: layout.dtypes[c] for c in wanted if c in layout.dtypes},
+            engine="c",
+            chunksize=CHUNK_ROWS,
+        )
+    except Exception as e:
+        raise ValueError(f"Failed to read CSV file: {e}")
+    with reader:
+        try:
+            for chunk in reader:
+                yield layout.to_canonical(chunk)
+        except ValueError as e:
+            raise ValueError(f"Failed to read CSV file: {e}")
+
+
+# Container formats by leading bytes, checked in order; anything else is
+# read as delimited text
+FORMATS: list[tuple[bytes, Callable[[BinaryIO], Iterator[pd.DataFrame]]]] = [
+    (XLSX_SIGNATURE, _iter_xlsx_chunks),
+    (XLS_SIGNATURE, _iter_xls_chunks),
+]
+
+# Header row readers for preflight, by format signature
+HEADERS: dict[bytes, Callable[[BinaryIO], list[str]]] = {
+    XLSX_SIGNATURE: _xlsx_header,
+    XLS_SIGNATURE: _xls_header,
+}
+
+
+def register_format(
+    signature: bytes,
+    reader: Callable[[BinaryIO], Iterator[pd.DataFrame]],
+    header: Optional[Callable[[BinaryIO], list[str]]] = None,
+):
+    """Add a container format; without a header reader, preflight skips it."""
+    FORMATS.append((signature, reader))
+    if header is not None:
+        HEADERS[signature] = header
+
+
+def iter_statement_chunks(source: StatementSource) -> Iterator[pd.DataFrame]:
+    """Yield the statement as canonical DataFrames of at most CHUNK_ROWS rows."""
+    stream = open_source(source)
+    signature = _sniff(stream)
+    for prefix, reader in FORMATS:
+        if signature.startswith(prefix):
+            return reader(stream)
+    return _iter_csv_chunks(stream)
+
+
+def read_header(source: StatementSource) -> Optional[list[str]]:
+    """
+    The statement's header row, reading no more of the file than the format
+    needs. None for a format registered without a header reader.
+    """
+    stream = open_source(source)
+    signature = _sniff(stream)
+    try:
+        for prefix, _ in FORMATS:
+            if signature.startswith(prefix):
+                header = HEADERS.get(prefix)
+                return header(stream) if header is not None else None
+        return _csv_header(stream)
+    finally:
+        stream.seek(0)
+
+
+def preflight(source: StatementSource) -> Optional[Layout]:
+    """
+    Check a statement from its signature and header row alone, so a file
+    that cannot be ingested is turned away before anything parses it.
+    Raises ValueError saying what is wrong; returns the detected layout.
+    """
+    header = read_header(source)
+    if header is None:
+        return None
+    layout = detect_layout(header)
+    missing = layout.missing(header)
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    return layout
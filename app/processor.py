@@ -1,103 +1,560 @@
+import pickle
+import uuid
+import warnings
+from typing import Iterable, Iterator, NamedTuple, Optional, cast
+
 import pandas as pd
-import io
+from pandas.tseries.api import guess_datetime_format
+from pandas.util import hash_pandas_object
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+    true,
+    tuple_,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import CursorResult
 from sqlalchemy.orm import Session
-from .models import MonthlySummary
+from .cache import bump_data_version
+from .ledger import find_upload, fingerprint, record_upload
+from .fx import load_rates, to_reporting
+from .metrics import IngestStats, record_ingest
+from .parsers import (
+    CARD_PAYMENT,
+    DATE_COL,
+    StatementSource,
+    open_source,
+    iter_statement_chunks,
+)
+from .merchants import MerchantMatcher, load_matcher
+from .models import MonthlySummary, Transaction
+from .rollup import complete_sum, refresh_rollups
 
+# Rows per executemany when upserting monthly summaries
+UPSERT_BATCH_ROWS = 5_000
 
-def process_revolut_file(file_content: bytes, person_name: str, db: Session):
-    # Load Excel file
-    try:
-        df = pd.read_excel(io.BytesIO(file_content))
-    except Exception as e:
-        raise ValueError(f"Failed to read Excel file: {e}")
+# Rows sampled to detect the export's date format
+DATE_SAMPLE_ROWS = 200
+GROUP_KEYS = ["month_year", "Description", "Currency"]
+SUMMARY_COLUMNS = GROUP_KEYS + ["TotalCost", "ReportingTotal"]
 
-    # Expected columns check could go here, but strict filtering might be enough
 
-    # Filter for 'Card Payment'
-    if "Type" in df.columns:
-        df = df[df["Type"] == "Card Payment"].copy()
-
-    # Ensure required columns exist
-    # required_cols = [
-    #     "Product",
-    #     "Amount",
-    #     "Fee",
-    #     "Currency",
-    #     "Description",
-    #     "Completed Date",
-    # ]  # 'DateDescription' -> Description logic?
-    # Prompt says: "Pivot the data by Description (from DateDescription)"
-    # But usually Revolut export has 'Description'. Let's assume 'Description' exists or mapped from 'DateDescription'
-    # Actually, verify column names. Standard Revolut usually has 'Description'.
-    # The prompt mentions "DateDescription". I will look for Description or DateDescription.
-
-    col_map = {"DateDescription": "Description"}
-    df.rename(columns=col_map, inplace=True)
-
-    if "Description" not in df.columns:
-        # Fallback or error?
-        pass
-
-    # Transformation
-    # TotalCost = Amount + Fee.
-    # Ensure numeric
-    df["Amount"] = pd.to_numeric(df["Amount"], errors="coerce").fillna(0)
-    df["Fee"] = pd.to_numeric(df["Fee"], errors="coerce").fillna(0)
-    df["TotalCost"] = df["Amount"] + df["Fee"]
-
-    # Extract Month-Year. 'DateCompleted' or 'Started'? Prompt says 'Started', 'DateCompleted'.
-    # Usually 'DateCompleted' is final.
-    date_col = "Completed Date"
-    if date_col in df.columns:
-        df[date_col] = pd.to_datetime(df[date_col], format="mixed", dayfirst=False)
-        df["month_year"] = df[date_col].dt.strftime("%Y-%m")
-    else:
+def _is_safe_format(fmt: str) -> bool:
+    # Only formats that read every string exactly as format="mixed" with
+    # dayfirst=False would: no day-before-numeric-month (dateutil reads those
+    # month first), no two-digit years (different century pivot) and no
+    # timezones (mixed-offset handling differs).
+    if any(code in fmt for code in ("%y", "%z", "%Z")):
+        return False
+    if "%d" in fmt and "%m" in fmt and fmt.index("%d") < fmt.index("%m"):
+        return False
+    return True
+
+
+def detect_date_format(values: pd.Series) -> Optional[str]:
+    """
+    Guess the export's date format from a sample of the column. Returns None
+    when there is no safe single format and the mixed parser must be used.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return None
+
+    sample = values.dropna().astype(str).head(DATE_SAMPLE_ROWS)
+    if sample.empty:
+        return None
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        guesses = sample.map(lambda v: guess_datetime_format(v, dayfirst=False))
+    guesses = guesses.dropna()
+    if guesses.empty:
+        return None
+
+    fmt = guesses.value_counts().index[0]
+    if not _is_safe_format(fmt):
+        return None
+
+    # Belt and braces: the sample must parse identically both ways
+    reference = pd.to_datetime(sample, format="mixed", dayfirst=False)
+    if not parse_dates(sample, fmt).equals(reference):
+        return None
+    return fmt
+
+
+def parse_dates(values: pd.Series, date_format: Optional[str]) -> pd.Series:
+    """
+    Parse the column in one vectorised pass with date_format; only the rows it
+    does not match go through the (per-element) mixed parser.
+    """
+    if date_format is None or pd.api.types.is_datetime64_any_dtype(values):
+        return pd.to_datetime(values, format="mixed", dayfirst=False)
+
+    parsed = pd.to_datetime(values, format=date_format, errors="coerce")
+    failed = parsed.isna() & values.notna()
+    if failed.any():
+        parsed[failed] = pd.to_datetime(values[failed], format="mixed", dayfirst=False)
+    return parsed
+
+
+def month_keys(completed: pd.Series) -> pd.Series:
+    """'YYYY-MM' for each timestamp, formatted once per distinct month."""
+    periods = completed.dt.year * 12 + completed.dt.month - 1
+    labels = {
+        int(p): f"{int(p) // 12:04d}-{int(p) % 12 + 1:02d}"
+        for p in pd.unique(periods.dropna())
+    }
+    return periods.map(labels)
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    """
+    Categorical with string categories, so hashing and staging work once per
+    distinct value. Hashes match those of the plain string column.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype("category")
+    if values.cat.categories.inferred_type != "string":
+        # Numbers or mixed cells from a spreadsheet
+        values = values.astype(str).astype("category")
+    return values
+
+
+def _as_amount(values: pd.Series) -> pd.Series:
+    """
+    float64 with blanks as 0, even when a chunk happens to hold only whole
+    numbers, so the row hash does not depend on how the file was chunked.
+    """
+    amounts = pd.to_numeric(values, errors="coerce").fillna(0)
+    if amounts.dtype != "float64":
+        amounts = amounts.astype("float64")
+    return amounts
+
+
+def _prepare_chunk(df: pd.DataFrame, date_format: Optional[str] = None) -> pd.DataFrame:
+    """Reduce a raw statement chunk to card payments in the transactions layout."""
+    if DATE_COL not in df.columns:
         raise ValueError("Could not find date column")
 
-    # Pivot / Aggregate
-    # Group by Month, Description, Currency
-    # We want to store monthly aggregates.
+    # One boolean mask and a single row selection instead of a copy per filter;
+    # rows without a date, description or currency were never aggregated
+    keep = df[DATE_COL].notna() & df["Description"].notna() & df["Currency"].notna()
+    if "Type" in df.columns:
+        keep &= df["Type"] == CARD_PAYMENT
+    if not keep.all():
+        df = df[keep]
+
+    completed = parse_dates(df[DATE_COL], date_format)
+    tx = pd.DataFrame(
+        {
+            "completed_at": completed,
+            "month_year": month_keys(completed),
+            "description": _as_text(df["Description"]),
+            "currency": _as_text(df["Currency"]),
+            "amount": _as_amount(df["Amount"]),
+            "fee": _as_amount(df["Fee"]),
+        }
+    )
+    if completed.isna().any():
+        tx = tx[completed.notna()]
+
+    # Stable per-row identity; occurrence numbers are assigned in SQL so that
+    # identical rows spread over several chunks are still counted once each.
+    key = pd.DataFrame(
+        {
+            "completed_at": tx["completed_at"].dt.as_unit("s").astype("int64"),
+            "description": tx["description"],
+            "amount": tx["amount"],
+            "fee": tx["fee"],
+            "currency": tx["currency"],
+        },
+        copy=False,
+    )
+    tx.insert(
+        0, "row_hash", hash_pandas_object(key, index=False).to_numpy().view("int64")
+    )
+    return tx
+
+
+def iter_transaction_chunks(
+    source: StatementSource, stats: Optional[IngestStats] = None
+) -> Iterator[pd.DataFrame]:
+    stats = stats or IngestStats()
+    date_format = None
+    detected = False
+    for chunk in stats.timed_iter(iter_statement_chunks(source), "read"):
+        stats.count("read", len(chunk))
+        with stats.time("prepare"):
+            # Detect the date format once, from the first chunk
+            if not detected and DATE_COL in chunk.columns:
+                date_format = detect_date_format(chunk[DATE_COL])
+                detected = True
+            prepared = _prepare_chunk(chunk, date_format)
+        yield prepared
+
+
+def save_chunks(chunks: Iterable[pd.DataFrame], path: str):
+    """Spill prepared chunks to disk, e.g. to hand them from a worker process."""
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    # The requirement says: "Pivot the data by Description ... Aggregate: sum(TotalCost)"
-    # And "Table: monthly_summaries (Columns: person_name, month_year, description, total_amount, currency)"
 
-    # So we group by (month_year, Description, Currency)
+def load_chunks(path: str) -> Iterator[pd.DataFrame]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
 
-    agg_df = (
-        df.groupby(["month_year", "Description", "Currency"])["TotalCost"]
-        .sum()
-        .reset_index()
+
+# Per-connection scratch table the chunks are staged into before the
+# deduplicating insert; `seq` preserves file order for occurrence numbers.
+_staging = Table(
+    "staged_transactions",
+    MetaData(),
+    Column("seq", Integer, primary_key=True),
+    Column("row_hash", BigInteger),
+    Column("completed_at", DateTime),
+    Column("month_year", String),
+    Column("description", String),
+    Column("merchant", String),
+    Column("amount", Float),
+    Column("fee", Float),
+    Column("currency", String),
+    Column("reporting_amount", Float),
+    prefixes=["TEMPORARY"],
+)
+
+
+def _stage(
+    db: Session, chunks: Iterable[pd.DataFrame], stats: Optional[IngestStats] = None
+) -> int:
+    stats = stats or IngestStats()
+    conn = db.connection()
+    _staging.create(conn, checkfirst=True)
+    conn.execute(delete(_staging))
+
+    count = 0
+    # Timed per chunk: `chunks` is usually lazy and its own stages are
+    # charged by whoever produces it
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        with stats.time("stage"):
+            columns = list(chunk.columns)
+            records = [
+                dict(zip(columns, row))
+                for row in zip(*(chunk[c].tolist() for c in columns))
+            ]
+            conn.execute(insert(_staging), records)
+        count += len(chunk)
+    return count
+
+
+def _insert_new_transactions(db: Session, person_name: str, ingest_id: str):
+    occurrence = func.row_number().over(
+        partition_by=_staging.c.row_hash, order_by=_staging.c.seq
+    )
+    rows = select(
+        literal(person_name),
+        _staging.c.row_hash,
+        occurrence - 1,
+        _staging.c.completed_at,
+        _staging.c.month_year,
+        _staging.c.description,
+        _staging.c.merchant,
+        _staging.c.amount,
+        _staging.c.fee,
+        _staging.c.currency,
+        _staging.c.reporting_amount,
+        literal(ingest_id),
+    ).where(true())  # SQLite needs a WHERE to parse INSERT ... SELECT ... ON CONFLICT
+    stmt = sqlite_insert(Transaction).from_select(
+        [
+            "person_name",
+            "row_hash",
+            "occurrence",
+            "completed_at",
+            "month_year",
+            "description",
+            "merchant",
+            "amount",
+            "fee",
+            "currency",
+            "reporting_amount",
+            "ingest_id",
+        ],
+        rows,
     )
+    # Rows skipped by ON CONFLICT are not counted, so this is the new rows
+    result = cast(CursorResult, db.execute(stmt.on_conflict_do_nothing()))
+    return result.rowcount
 
-    # Upsert Logic
-    # Simple approach: Delete existing for this person & months found in file, then insert.
-    # Or strict upsert row by row.
-    # "If a report for the same Month and Person is uploaded again, overwrite existing records for that month"
-    # This implies we should wipe data for the *months present in the file* for this *person*, then insert new.
 
-    months_to_update = agg_df["month_year"].unique()
+def _merchant_or_description():
+    # What summaries are keyed on: the canonical merchant if a rule matched
+    return func.coalesce(Transaction.merchant, Transaction.description)
 
-    for month in months_to_update:
-        # Delete existing
-        db.query(MonthlySummary).filter(
+
+def _aggregate_transactions(
+    db: Session, person_name: str, months: list[str]
+) -> pd.DataFrame:
+    merchant = _merchant_or_description()
+    stmt = (
+        select(
+            Transaction.month_year,
+            merchant,
+            Transaction.currency,
+            func.sum(Transaction.amount + Transaction.fee),
+            complete_sum(Transaction.reporting_amount),
+        )
+        .where(
+            Transaction.person_name == person_name,
+            Transaction.month_year.in_(months),
+        )
+        .group_by(Transaction.month_year, merchant, Transaction.currency)
+    )
+    return pd.DataFrame(db.execute(stmt).all(), columns=SUMMARY_COLUMNS)
+
+
+def _batches(records: list, size: int) -> Iterator[list]:
+    for start in range(0, len(records), size):
+        yield records[start : start + size]
+
+
+def write_summaries(agg_df: pd.DataFrame, person_name: str, db: Session) -> int:
+    """
+    Replace the person's summaries for every month in agg_df. Does not commit.
+
+    agg_df holds the complete aggregate of those months (it is built from the
+    transactions table), so existing rows are upserted in place and any
+    description and currency that no longer has transactions is deleted.
+    """
+    months_to_update = [str(m) for m in agg_df["month_year"].unique()]
+    if not months_to_update:
+        return 0
+
+    records = [
+        {
+            "person_name": person_name,
+            "month_year": month,
+            "description": description,
+            "total_amount": total,
+            "currency": currency,
+            "reporting_amount": reporting,
+        }
+        for month, description, currency, total, reporting in zip(
+            agg_df["month_year"].tolist(),
+            agg_df["Description"].tolist(),
+            agg_df["Currency"].tolist(),
+            agg_df["TotalCost"].tolist(),
+            # NaN -> None, so a missing conversion is stored as NULL
+            agg_df["ReportingTotal"]
+            .astype(object)
+            .where(agg_df["ReportingTotal"].notna(), None)
+            .tolist(),
+        )
+    ]
+
+    # One executemany per batch against the d_p_m_desc_uc constraint. A Core
+    # insert on the table: the ORM's bulk path would split the batch by which
+    # values are None and compile a statement per group.
+    upsert = sqlite_insert(MonthlySummary.__table__)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=["person_name", "month_year", "description", "currency"],
+        set_={
+            "total_amount": upsert.excluded.total_amount,
+            "reporting_amount": upsert.excluded.reporting_amount,
+        },
+    )
+    for batch in _batches(records, UPSERT_BATCH_ROWS):
+        db.execute(upsert, batch)
+
+    # Single set-based DELETE for (description, currency) pairs that dropped
+    # out of these months. The subquery is not correlated, so SQLite builds
+    # the set of remaining keys once from ix_transactions_person_month_merchant
+    # rather than probing transactions per summary row. Neither column is ever
+    # NULL.
+    remaining = select(
+        Transaction.month_year, _merchant_or_description(), Transaction.currency
+    ).where(
+        Transaction.person_name == person_name,
+        Transaction.month_year.in_(months_to_update),
+    )
+    db.execute(
+        delete(MonthlySummary)
+        .where(
             MonthlySummary.person_name == person_name,
-            MonthlySummary.month_year == month,
-        ).delete()
-
-    # Bulk insert
-    summaries = []
-    for _, row in agg_df.iterrows():
-        summaries.append(
-            MonthlySummary(
-                person_name=person_name,
-                month_year=row["month_year"],
-                description=row["Description"],
-                total_amount=row["TotalCost"],
-                currency=row["Currency"],
-            )
+            MonthlySummary.month_year.in_(months_to_update),
+            tuple_(
+                MonthlySummary.month_year,
+                MonthlySummary.description,
+                MonthlySummary.currency,
+            ).not_in(remaining),
         )
+        .execution_options(synchronize_session=False)
+    )
+
+    refresh_rollups(db, person_name, months_to_update)
+
+    return len(records)
+
+
+def _enrich(
+    chunks: Iterable[pd.DataFrame],
+    matcher: MerchantMatcher,
+    rates: pd.DataFrame,
+    stats: IngestStats,
+) -> Iterator[pd.DataFrame]:
+    # Timed per chunk, like _stage, so producing the chunks (read, prepare,
+    # load) is not charged to this stage as well
+    for chunk in chunks:
+        with stats.time("enrich"):
+            chunk = chunk.assign(
+                merchant=matcher.canonicalise(chunk["description"]),
+                reporting_amount=to_reporting(chunk, rates),
+            )
+        yield chunk
+
+
+class PreparedFile(NamedTuple):
+    """One statement's prepared chunks and where they go, for ingest_batch."""
+
+    chunks: Iterable[pd.DataFrame]
+    person_name: str
+    content_hash: Optional[str] = None
+    filename: Optional[str] = None
+    # Per-file stage timings and row counts; the batch's own go elsewhere
+    stats: Optional[IngestStats] = None
+
+
+def ingest_batch(
+    files: Iterable[PreparedFile], db: Session, stats: Optional[IngestStats] = None
+) -> list[int]:
+    """
+    Store the prepared transactions of several files and refresh the summaries
+    of the months that gained rows, all in one transaction. Each person's
+    summaries are recomputed once over the months any of their files touched.
+    Files with a content_hash are added to the upload ledger in the same
+    transaction. Returns the number of card payments read from each file.
+    """
+    stats = stats or IngestStats()
+    counts = []
+    changed: dict[str, set[str]] = {}
+    try:
+        matcher = load_matcher(db)
+        rates = load_rates(db)
+        for file in files:
+            file_stats = file.stats or stats
+            ingest_id = uuid.uuid4().hex
+            chunks = _enrich(file.chunks, matcher, rates, file_stats)
+            count = _stage(db, chunks, file_stats)
+            file_stats.count("card_payments", count)
+            with file_stats.time("insert"):
+                new = _insert_new_transactions(db, file.person_name, ingest_id)
+            file_stats.count("new", new)
+
+            # Only (person, month) cells that actually received new rows
+            changed.setdefault(file.person_name, set()).update(
+                db.scalars(
+                    select(Transaction.month_year)
+                    .where(Transaction.ingest_id == ingest_id)
+                    .distinct()
+                )
+            )
+
+            if file.content_hash:
+                month_range = db.execute(
+                    select(
+                        func.min(_staging.c.month_year), func.max(_staging.c.month_year)
+                    )
+                ).one()
+                record_upload(
+                    db,
+                    file.content_hash,
+                    file.person_name,
+                    file.filename,
+                    tuple(month_range),
+                    count,
+                    ingest_id,
+                )
+            counts.append(count)
 
-    db.add_all(summaries)
-    db.commit()
+        for person_name, months in changed.items():
+            if not months:
+                continue
+            with stats.time("aggregate"):
+                agg_df = _aggregate_transactions(db, person_name, sorted(months))
+            with stats.time("write_summaries"):
+                write_summaries(agg_df, person_name, db)
+        if any(changed.values()):
+            bump_data_version(db)
 
-    return len(summaries)
+        with stats.time("commit"):
+            db.execute(delete(_staging))
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return counts
+
+
+def ingest_transactions(
+    chunks: Iterable[pd.DataFrame],
+    person_name: str,
+    db: Session,
+    content_hash: Optional[str] = None,
+    filename: Optional[str] = None,
+    stats: Optional[IngestStats] = None,
+) -> int:
+    """
+    Store one file's prepared transactions, see ingest_batch. Returns the
+    number of card payments read. Stage timings go to `stats` if given.
+    """
+    file = PreparedFile(chunks, person_name, content_hash, filename, stats)
+    return ingest_batch([file], db, stats)[0]
+
+
+def process_revolut_file(
+    file_content: StatementSource,
+    person_name: str,
+    db: Session,
+    filename: Optional[str] = None,
+):
+    stream = open_source(file_content)
+    content_hash = fingerprint(stream)
+
+    # Identical file for the same person: nothing to do
+    previous = find_upload(db, content_hash, person_name)
+    if previous is not None:
+        record_ingest(IngestStats(), "skipped")
+        return previous.record_count
+
+    stats = IngestStats()
+    try:
+        count = ingest_transactions(
+            iter_transaction_chunks(stream, stats),
+            person_name,
+            db,
+            content_hash,
+            filename,
+            stats,
+        )
+    except Exception:
+        record_ingest(stats, "failed")
+        raise
+    record_ingest(stats, "done")
+    return count
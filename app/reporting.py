@@ -0,0 +1,138 @@
+from typing import Any, Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from .models import MonthlySummary, PersonMonthTotal, summary_sort_amount
+
+DEFAULT_PAGE_MONTHS = 6
+
+
+def _filter(
+    stmt, model=MonthlySummary, person=None, month_from=None, month_to=None, before=None
+):
+    if person:
+        stmt = stmt.where(model.person_name == person)
+    if month_from:
+        stmt = stmt.where(model.month_year >= month_from)
+    if month_to:
+        stmt = stmt.where(model.month_year <= month_to)
+    if before:
+        # Cursor: only months strictly older than the last one already shown
+        stmt = stmt.where(model.month_year < before)
+    return stmt
+
+
+def list_people(db: Session) -> list[str]:
+    stmt = select(PersonMonthTotal.person_name).distinct().order_by("person_name")
+    return list(db.scalars(stmt))
+
+
+def page_months(
+    db: Session,
+    months: int = DEFAULT_PAGE_MONTHS,
+    person: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    before: Optional[str] = None,
+) -> tuple[list[str], Optional[str]]:
+    """
+    Return the newest `months` months matching the filters and the cursor for
+    the next page (None when this is the last page).
+    """
+    # The rollup table has one row per person/month/currency, so this is
+    # proportional to the number of months rather than merchants.
+    stmt = _filter(
+        select(PersonMonthTotal.month_year).distinct(),
+        PersonMonthTotal,
+        person,
+        month_from,
+        month_to,
+        before,
+    )
+    stmt = stmt.order_by(PersonMonthTotal.month_year.desc()).limit(months + 1)
+    found = list(db.scalars(stmt))
+
+    page = found[:months]
+    next_cursor = page[-1] if len(found) > months else None
+    return page, next_cursor
+
+
+def load_report(
+    db: Session,
+    month_list: list[str],
+    person: Optional[str] = None,
+    top: Optional[int] = None,
+) -> dict[str, Any]:
+    """
+    Build the Month -> Person -> {entries, totals, reporting_total, count}
+    structure for the given months. Headers come from the rollup table; `top`
+    limits the entries listed per person to the N largest.
+    """
+    if not month_list:
+        return {}
+
+    totals_stmt = _filter(
+        select(PersonMonthTotal).where(PersonMonthTotal.month_year.in_(month_list)),
+        PersonMonthTotal,
+        person,
+    ).order_by(
+        PersonMonthTotal.month_year.desc(),
+        PersonMonthTotal.person_name,
+        PersonMonthTotal.total_amount.desc(),
+    )
+
+    # Partitions and ranking follow ix_monthly_summaries_report, so the window
+    # reads the entries off the index without a sort. The outer query keeps
+    # only the `top` ranks and orders what is left by rank; that sort is over
+    # the entries shown, not every summary row of the months.
+    order = (
+        MonthlySummary.month_year,
+        MonthlySummary.person_name,
+        summary_sort_amount().desc(),
+        MonthlySummary.description,
+    )
+    rank = (
+        func.row_number().over(partition_by=order[:2], order_by=order[2:]).label("rank")
+    )
+    ranked = _filter(
+        select(
+            MonthlySummary.month_year,
+            MonthlySummary.person_name,
+            MonthlySummary.description,
+            MonthlySummary.total_amount,
+            MonthlySummary.currency,
+            MonthlySummary.reporting_amount,
+            rank,
+        ).where(MonthlySummary.month_year.in_(month_list)),
+        person=person,
+    ).subquery()
+    entries_stmt = select(ranked).order_by(
+        ranked.c.month_year, ranked.c.person_name, ranked.c.rank
+    )
+    if top:
+        entries_stmt = entries_stmt.where(ranked.c.rank <= top)
+
+    reports_data: dict[str, Any] = {}
+
+    def person_data(month: str, person_name: str) -> dict[str, Any]:
+        return reports_data.setdefault(month, {}).setdefault(
+            person_name,
+            {"entries": [], "totals": [], "reporting_total": 0.0, "count": 0},
+        )
+
+    for row in db.scalars(totals_stmt):
+        data = person_data(row.month_year, row.person_name)
+        # One (currency, total) per currency spent in, largest first
+        data["totals"].append((row.currency, row.total_amount))
+        # Converted at ingestion; unknown if any currency lacks a rate
+        if row.reporting_amount is None or data["reporting_total"] is None:
+            data["reporting_total"] = None
+        else:
+            data["reporting_total"] += row.reporting_amount
+        data["count"] += row.merchant_count
+
+    # Entries without a rollup row (stale, or not rebuilt since an upgrade)
+    # are still listed, under empty totals
+    for item in db.execute(entries_stmt):
+        person_data(item.month_year, item.person_name)["entries"].append(item)
+
+    return reports_data
@@ -0,0 +1,105 @@
+from typing import Iterable, Optional
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.orm import Session
+from .cache import bump_data_version
+from .models import MonthlySummary, PersonMonthTotal
+
+
+def complete_sum(column):
+    # SUM that is NULL unless every row has a value, so a total with an
+    # unconverted row is reported as unknown rather than as a partial sum
+    return case((func.count(column) == func.count(), func.sum(column)))
+
+
+def _rollup_select():
+    return select(
+        MonthlySummary.person_name,
+        MonthlySummary.month_year,
+        MonthlySummary.currency,
+        func.sum(MonthlySummary.total_amount),
+        complete_sum(MonthlySummary.reporting_amount),
+        func.count(),
+    ).group_by(
+        MonthlySummary.person_name,
+        MonthlySummary.month_year,
+        MonthlySummary.currency,
+    )
+
+
+def _insert_from(query):
+    return insert(PersonMonthTotal).from_select(
+        [
+            "person_name",
+            "month_year",
+            "currency",
+            "total_amount",
+            "reporting_amount",
+            "merchant_count",
+        ],
+        query,
+    )
+
+
+def refresh_rollups(db: Session, person_name: str, months: Iterable[str]):
+    """
+    Recompute the rollup rows for one person's months from the detail rows.
+
+    Does not commit, so it lands in the same transaction as the detail write.
+    """
+    months = list(months)
+    if not months:
+        return
+
+    db.execute(
+        delete(PersonMonthTotal).where(
+            PersonMonthTotal.person_name == person_name,
+            PersonMonthTotal.month_year.in_(months),
+        )
+    )
+    db.execute(
+        _insert_from(
+            _rollup_select().where(
+                MonthlySummary.person_name == person_name,
+                MonthlySummary.month_year.in_(months),
+            )
+        )
+    )
+
+
+def rebuild_rollups(db: Session):
+    """Recompute every rollup row and commit. Cached reports are invalidated."""
+    db.execute(delete(PersonMonthTotal))
+    db.execute(_insert_from(_rollup_select()))
+    bump_data_version(db)
+    db.commit()
+
+
+def rollups_missing(db: Session) -> bool:
+    """True when there are detail rows but no rollups, e.g. after an upgrade."""
+    has_details = db.scalar(select(MonthlySummary.id).limit(1)) is not None
+    has_rollups = db.scalar(select(PersonMonthTotal.id).limit(1)) is not None
+    return has_details and not has_rollups
+
+
+def check_rollups(db: Session, tolerance: float = 1e-6) -> list[str]:
+    """Compare the rollup table against the detail rows; return the differences."""
+    expected = {
+        (person, month, currency): (total, count)
+        for person, month, currency, total, _, count in db.execute(_rollup_select())
+    }
+    actual = {
+        (r.person_name, r.month_year, r.currency): (r.total_amount, r.merchant_count)
+        for r in db.scalars(select(PersonMonthTotal))
+    }
+
+    problems = []
+    for key in sorted(expected.keys() | actual.keys(), key=str):
+        want: Optional[tuple] = expected.get(key)
+        got: Optional[tuple] = actual.get(key)
+        if want is None:
+            problems.append(f"{key}: stale rollup row {got}")
+        elif got is None:
+            problems.append(f"{key}: missing rollup row, expected {want}")
+        elif abs(want[0] - got[0]) > tolerance or want[1] != got[1]:
+            problems.append(f"{key}: rollup has {got}, details give {want}")
+    return problems
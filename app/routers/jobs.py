@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from ..database import get_db
+from ..models import IngestionJob
+from ..auth import require_auth
+from ..jobs import job_status, load_batch
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}")
+def get_job(
+    job_id: str, db: Session = Depends(get_db), user: dict = Depends(require_auth)
+):
+    job = db.get(IngestionJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No such job")
+    return job_status(job)
+
+
+@router.get("/batches/{batch_id}")
+def get_batch(
+    batch_id: str, db: Session = Depends(get_db), user: dict = Depends(require_auth)
+):
+    batch = load_batch(db, batch_id)
+    if batch is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No such batch"
+        )
+    return batch
@@ -1,50 +1,220 @@
-from fastapi import APIRouter, Depends, Request
-from typing import Any
-from fastapi.responses import HTMLResponse
+from urllib.parse import urlencode
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import Iterator, Optional
+from fastapi.responses import HTMLResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from ..database import get_db
-from ..models import MonthlySummary
+from ..database import get_db, get_read_db, run_read
 from ..auth import require_auth
 from ..dependencies import templates
-from itertools import groupby
-from operator import attrgetter
+from ..config import settings
+from ..export import FORMATS, iter_summary_batches
+from ..cache import etag_matches, get_data_version, make_etag, report_cache
+from ..reporting import DEFAULT_PAGE_MONTHS, list_people, load_report, page_months
 
 router = APIRouter()
 
+# Streamed pages are sent in chunks of at least this many characters
+STREAM_FLUSH_CHARS = 1024
+
+
+def _positive_int(value: Optional[str]) -> Optional[int]:
+    # The filter form submits empty strings for blank fields
+    if not value:
+        return None
+    if not value.isdigit() or int(value) < 1:
+        raise HTTPException(status_code=422, detail="top must be a positive integer")
+    return int(value)
+
+
+def _report_filters(
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    person: Optional[str] = None,
+    top: Optional[str] = None,
+    months: int = Query(DEFAULT_PAGE_MONTHS, ge=1, le=120),
+) -> dict:
+    return {
+        "month_from": month_from or None,
+        "month_to": month_to or None,
+        "person": person or None,
+        "top": _positive_int(top),
+        "months": months,
+    }
+
+
+def _page(db: Session, filters: dict, before: Optional[str]):
+    # Only the requested page of months is loaded; totals are summed in SQL
+    return page_months(
+        db,
+        filters["months"],
+        filters["person"],
+        filters["month_from"],
+        filters["month_to"],
+        before,
+    )
+
+
+def _iter_months(
+    db: Session, filters: dict, month_list: list[str], next_cursor: Optional[str]
+) -> Iterator[str]:
+    """One rendered block per month, then the link to the next page."""
+    template = templates.get_template("report_month.html")
+    for month in month_list:
+        # A month per query, so the first block is out before the rest load
+        month_data = load_report(db, [month], filters["person"], filters["top"])
+        yield template.render(
+            month=month,
+            month_data=month_data.get(month, {}),
+            reporting_currency=settings.REPORTING_CURRENCY,
+        )
+
+    if next_cursor:
+        params = {k: v for k, v in filters.items() if v}
+        query = urlencode({**params, "before": next_cursor})
+        yield templates.get_template("report_more.html").render(
+            next_url="/reports?" + query, fragment_url="/reports/months?" + query
+        )
+
+
+def _iter_body(db: Session, filters: dict, before: Optional[str]) -> Iterator[str]:
+    month_list, next_cursor = _page(db, filters, before)
+
+    # Exports take the same person and month range, but are not paged
+    export_query = urlencode(
+        {k: filters[k] for k in ("person", "month_from", "month_to") if filters[k]}
+    )
+    yield templates.get_template("report_header.html").render(
+        people=list_people(db),
+        filters=filters,
+        export_query=export_query,
+        empty=not month_list,
+    )
+    yield from _iter_months(db, filters, month_list, next_cursor)
+
+
+def _render_months(db: Session, filters: dict, before: Optional[str]) -> str:
+    return "".join(_iter_months(db, filters, *_page(db, filters, before)))
+
+
+def _cached(key, parts: Iterator[str]) -> Iterator[str]:
+    # Stored once the whole body has rendered, so a failed stream is not cached
+    rendered = []
+    for part in parts:
+        rendered.append(part)
+        yield part
+    report_cache.set(key, "".join(rendered))
+
+
+def _coalesce(parts: Iterator[str], size: int = STREAM_FLUSH_CHARS) -> Iterator[bytes]:
+    # Jinja yields many small strings; send them in fewer, larger chunks
+    buffer: list[str] = []
+    buffered = 0
+    for part in parts:
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= size:
+            yield "".join(buffer).encode()
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+async def _cache_key(db, filters: dict, before: Optional[str], *kind) -> tuple:
+    # Report data only changes when an ingestion bumps the data version
+    version = await run_read(db, get_data_version)
+    return (version, tuple(filters.items()), before or None, *kind)
+
+
+def _not_modified(request: Request, key: tuple, user: dict):
+    """Cache headers for the response, and the 304 to send instead if any."""
+    # The page also shows who is signed in, so the user is part of the ETag
+    etag = make_etag(key, user.get("email"))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None
+
 
 @router.get("/reports", response_class=HTMLResponse)
 async def view_reports(
-    request: Request, db: Session = Depends(get_db), user: dict = Depends(require_auth)
+    request: Request,
+    before: Optional[str] = None,
+    filters: dict = Depends(_report_filters),
+    db=Depends(get_read_db),
+    sync_db: Session = Depends(get_db),
+    user: dict = Depends(require_auth),
 ):
-    # Fetch all, order by month desc, person
-    summaries = (
-        db.query(MonthlySummary)
-        .order_by(
-            MonthlySummary.month_year.desc(),
-            MonthlySummary.person_name,
-            MonthlySummary.total_amount.desc(),
+    key = await _cache_key(db, filters, before)
+    headers, not_modified = _not_modified(request, key, user)
+    if not_modified:
+        return not_modified
+
+    body = report_cache.get(key)
+    if body is not None:
+        return templates.TemplateResponse(
+            "report.html",
+            {"request": request, "user": user, "body": [body]},
+            headers=headers,
         )
-        .all()
+
+    # Not rendered for this data version yet: stream the page, so the header
+    # and first month reach the browser while later months are still loading.
+    # The sync generator runs on the threadpool with the request's session,
+    # which stays open until the response has been sent.
+    page = templates.get_template("report.html").generate(
+        request=request,
+        user=user,
+        body=_cached(key, _iter_body(sync_db, filters, before)),
     )
+    return StreamingResponse(
+        _coalesce(page), media_type="text/html; charset=utf-8", headers=headers
+    )
+
+
+@router.get("/reports/months", response_class=HTMLResponse)
+async def report_months(
+    request: Request,
+    before: Optional[str] = None,
+    filters: dict = Depends(_report_filters),
+    db=Depends(get_read_db),
+    user: dict = Depends(require_auth),
+):
+    """The page of months after `before`, as a fragment for infinite scroll."""
+    key = await _cache_key(db, filters, before, "months")
+    headers, not_modified = _not_modified(request, key, user)
+    if not_modified:
+        return not_modified
+
+    body = report_cache.get(key)
+    if body is None:
+        body = await run_read(db, _render_months, filters, before)
+        report_cache.set(key, body)
+    return HTMLResponse(body, headers=headers)
 
-    # Process data for view: Group by Month -> Person -> List of items + Total
-    reports_data: dict[str, Any] = {}
-
-    for month, group_month in groupby(summaries, key=attrgetter("month_year")):
-        reports_data[month] = {}
-        # Sort by person within month just to be safe for groupby
-        month_items = list(group_month)
-        month_items.sort(key=attrgetter("person_name"))
-
-        for person, group_person in groupby(month_items, key=attrgetter("person_name")):
-            items = list(group_person)
-            total = sum(i.total_amount for i in items)
-            reports_data[month][person] = {
-                "entries": items,
-                "total": total,
-                "currency": items[0].currency if items else "GBP",
-            }
-
-    return templates.TemplateResponse(
-        "report.html", {"request": request, "user": user, "reports": reports_data}
+
+@router.get("/reports/export.{fmt}")
+def export_summaries(
+    fmt: str,
+    person: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user: dict = Depends(require_auth),
+):
+    export = FORMATS.get(fmt)
+    if export is None:
+        raise HTTPException(status_code=404, detail="Unknown export format")
+
+    # The session stays open until the response has been sent, and the sync
+    # generator is iterated on the threadpool, one cursor batch at a time
+    batches = iter_summary_batches(
+        db, person or None, month_from or None, month_to or None
+    )
+    return StreamingResponse(
+        export.encode(batches),
+        media_type=export.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="summaries.{fmt}"',
+            "Cache-Control": "private, no-store",
+        },
     )
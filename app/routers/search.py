@@ -0,0 +1,71 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import HTMLResponse
+from ..database import get_read_db, run_read
+from ..auth import require_auth
+from ..config import settings
+from ..dependencies import templates
+from ..reporting import list_people
+from ..search import search_totals
+
+router = APIRouter()
+
+
+def _search_filters(
+    q: str = "",
+    person: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+) -> dict:
+    return {
+        "q": q.strip(),
+        "person": person or None,
+        "month_from": month_from or None,
+        "month_to": month_to or None,
+    }
+
+
+def _search(db, filters: dict) -> dict:
+    return search_totals(db, **filters)
+
+
+def _totals_json(rows, *keys) -> list[dict]:
+    fields = [*keys, "currency", "total_amount", "reporting_amount", "merchant_count"]
+    return [{field: getattr(row, field) for field in fields} for row in rows]
+
+
+@router.get("/search", response_class=HTMLResponse)
+async def search_page(
+    request: Request,
+    filters: dict = Depends(_search_filters),
+    db=Depends(get_read_db),
+    user: dict = Depends(require_auth),
+):
+    results = await run_read(db, _search, filters)
+    people = await run_read(db, list_people)
+    return templates.TemplateResponse(
+        "search.html",
+        {
+            "request": request,
+            "user": user,
+            "filters": filters,
+            "people": people,
+            "results": results,
+            "reporting_currency": settings.REPORTING_CURRENCY,
+        },
+    )
+
+
+@router.get("/search.json")
+async def search_json(
+    filters: dict = Depends(_search_filters),
+    db=Depends(get_read_db),
+    user: dict = Depends(require_auth),
+):
+    results = await run_read(db, _search, filters)
+    return {
+        "query": filters["q"],
+        "merchants": results["merchants"],
+        "months": _totals_json(results["months"], "month_year", "person_name"),
+        "people": _totals_json(results["people"], "person_name"),
+    }
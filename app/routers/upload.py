@@ -1,14 +1,31 @@
-from fastapi import APIRouter, UploadFile, File, Depends, Form, Request
-import shutil
-import uuid
-import os
-from fastapi.responses import HTMLResponse
-from typing import Optional
+from fastapi import (
+    APIRouter,
+    UploadFile,
+    File,
+    Depends,
+    Form,
+    Request,
+    BackgroundTasks,
+    HTTPException,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse
+from typing import Optional, Sequence, cast
 from sqlalchemy.orm import Session
-from ..processor import process_revolut_file
-from ..database import get_db
+from ..database import get_db, run_read, session_engine
 from ..auth import require_auth
 from ..dependencies import templates
+from ..jobs import (
+    create_batch,
+    create_job,
+    discard_file,
+    load_batch,
+    run_batch,
+    run_job,
+)
+from ..ledger import find_upload, list_uploads
+from ..metrics import IngestStats, record_ingest
+from ..uploads import claim, find_stashed, stash, write_upload
 
 router = APIRouter()
 
@@ -18,61 +35,223 @@ async def index(request: Request, user: dict = Depends(require_auth)):
     return templates.TemplateResponse("index.html", {"request": request, "user": user})
 
 
+async def _enqueue(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session,
+    user: dict,
+    person: str,
+    file_path: str,
+    filename: Optional[str],
+    content_hash: str,
+):
+    # Database work goes to the threadpool: it can wait on SQLite's lock
+    if await run_read(db, find_upload, content_hash, person) is not None:
+        # Same file shared twice (share sheet + by hand): skip the parse entirely
+        discard_file(file_path)
+        return templates.TemplateResponse(
+            "index.html",
+            {
+                "request": request,
+                "user": user,
+                "message": f"{filename or 'File'} is already up to date for {person}.",
+                "msg_type": "success",
+            },
+        )
+
+    job_id = await run_in_threadpool(_create_job, db, person, file_path, filename)
+    # Parsing happens in the process pool once the response has been sent
+    background_tasks.add_task(run_job, job_id, session_engine(db))
+
+    return templates.TemplateResponse(
+        "index.html",
+        {
+            "request": request,
+            "user": user,
+            "job_id": job_id,
+            "message": f"Processing {filename or 'file'} for {person}...",
+            "msg_type": "info",
+        },
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+def _create_job(
+    db: Session, person: str, file_path: str, filename: Optional[str]
+) -> str:
+    # The id is read here: after the commit, reading it loads the row again
+    return str(create_job(db, person, file_path, filename).id)
+
+
+async def _preflight(files: list[UploadFile]) -> list[Optional[str]]:
+    """
+    Check each upload from its signature and header row, in place in the
+    spooled request body: the reason a file cannot be ingested, else None.
+    """
+    # pandas is only needed once something is uploaded
+    from ..parsers import preflight
+
+    errors: list[Optional[str]] = []
+    for f in files:
+        try:
+            await run_in_threadpool(preflight, f.file)
+        except ValueError as e:
+            record_ingest(IngestStats(), "rejected")
+            errors.append(str(e))
+        else:
+            errors.append(None)
+    return errors
+
+
+def _rejected(request: Request, user: dict, files: list, errors: list):
+    message = "; ".join(
+        f"{f.filename or 'File'}: {error}" for f, error in zip(files, errors) if error
+    )
+    return templates.TemplateResponse(
+        "index.html",
+        {"request": request, "user": user, "message": message, "msg_type": "error"},
+        status_code=422,
+    )
+
+
+async def _enqueue_batch(
+    background_tasks: BackgroundTasks,
+    db: Session,
+    files: Sequence[tuple[Optional[str], str, Optional[str]]],
+    errors: Optional[list[Optional[str]]] = None,
+) -> str:
+    batch_id = await run_in_threadpool(create_batch, db, files, errors)
+    # Parsed in parallel and written together once the response has been sent
+    background_tasks.add_task(run_batch, batch_id, session_engine(db))
+    return batch_id
+
+
+async def _upload_batch(
+    background_tasks: BackgroundTasks,
+    db: Session,
+    files: list[UploadFile],
+    persons: list[str],
+    errors: list[Optional[str]],
+) -> str:
+    """Write the files that passed preflight and queue them all as a batch."""
+    batch = [
+        (
+            (await write_upload(f)).path if error is None else None,
+            person_name,
+            f.filename,
+        )
+        for f, person_name, error in zip(files, persons, errors)
+    ]
+    return await _enqueue_batch(background_tasks, db, batch, errors)
+
+
+async def _render_batch(request: Request, user: dict, db: Session, batch_id: str):
+    # One row per file, which the page keeps up to date from /batches/{id}
+    results = (await run_read(db, load_batch, batch_id))["files"]
+    return templates.TemplateResponse(
+        "index.html",
+        {
+            "request": request,
+            "user": user,
+            "batch_id": batch_id,
+            "message": f"Processing {len(results)} files...",
+            "msg_type": "info",
+            "results": results,
+        },
+        status_code=202,
+        headers={"Location": f"/batches/{batch_id}"},
+    )
+
+
 @router.post("/upload", response_class=HTMLResponse)
 async def upload_file(
     request: Request,
-    file: UploadFile = File(...),
+    background_tasks: BackgroundTasks,
+    file: list[UploadFile] = File(...),
     person: Optional[str] = Form(None),
     db: Session = Depends(get_db),
     user: dict = Depends(require_auth),
 ):
-    if person is None:
-        # Share Target flow: stash file and ask for person
-        file_id = str(uuid.uuid4())
-        temp_dir = "temp_uploads"
-        os.makedirs(temp_dir, exist_ok=True)
-        file_path = os.path.join(temp_dir, f"{file_id}.xls")
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    errors = await _preflight(file)
 
+    if person is None:
+        if any(errors):
+            return _rejected(request, user, file, errors)
+        # Share Target flow: files wait in the store, parsing, while the user
+        # picks a person
+        stashed = []
+        for f in file:
+            entry = await stash(db, f, user.get("email"))
+            # Read now: the next file's commit expires the entry again
+            stashed.append({"file_id": entry.id, "filename": entry.filename})
         return templates.TemplateResponse(
             "select_person.html",
-            {
-                "request": request,
-                "user": user,
-                "file_id": file_id,
-                "filename": file.filename,
-            },
+            {"request": request, "user": user, "files": stashed},
         )
 
-    try:
-        content = await file.read()
-        count = process_revolut_file(content, person, db)
-        message = f"Successfully processed {count} records for {person}."
-        msg_type = "success"
-    except Exception as e:
-        message = f"Error processing file: {str(e)}"
-        msg_type = "error"
+    if len(file) > 1:
+        batch_id = await _upload_batch(
+            background_tasks, db, file, [person] * len(file), errors
+        )
+        return await _render_batch(request, user, db, batch_id)
 
-    return templates.TemplateResponse(
-        "index.html",
-        {"request": request, "user": user, "message": message, "msg_type": msg_type},
+    if errors[0]:
+        return _rejected(request, user, file, errors)
+    written = await write_upload(file[0])
+    return await _enqueue(
+        request,
+        background_tasks,
+        db,
+        user,
+        person,
+        written.path,
+        file[0].filename,
+        written.content_hash,
+    )
+
+
+@router.post("/upload/batch")
+async def upload_batch(
+    background_tasks: BackgroundTasks,
+    files: list[UploadFile] = File(...),
+    person: list[str] = Form(...),
+    db: Session = Depends(get_db),
+    user: dict = Depends(require_auth),
+):
+    """
+    Ingest several statements at once. `person` is given once per file, in
+    the same order, or once for all of them. Answers 202 with the batch, a
+    job per file; its Location reports on them until they are all finished.
+    """
+    if len(person) == 1:
+        person = person * len(files)
+    elif len(person) != len(files):
+        raise HTTPException(status_code=422, detail="Give one person, or one per file")
+
+    errors = await _preflight(files)
+    batch_id = await _upload_batch(background_tasks, db, files, person, errors)
+    return JSONResponse(
+        await run_read(db, load_batch, batch_id),
+        status_code=202,
+        headers={"Location": f"/batches/{batch_id}"},
     )
 
 
 @router.post("/upload/finalize", response_class=HTMLResponse)
 async def finalize_upload(
     request: Request,
-    file_id: str = Form(...),
-    person: str = Form(...),
+    background_tasks: BackgroundTasks,
+    file_id: list[str] = Form(...),
+    person: list[str] = Form(...),
     db: Session = Depends(get_db),
     user: dict = Depends(require_auth),
 ):
-    temp_dir = "temp_uploads"
-    file_path = os.path.join(temp_dir, f"{file_id}.xls")
+    # Repeated fields when several files were shared at once. Only the user
+    # who uploaded a file can finalize it.
+    entries = await run_read(db, find_stashed, file_id, user.get("email"))
 
-    if not os.path.exists(file_path):
+    if entries is None or len(person) != len(entries):
         return templates.TemplateResponse(
             "index.html",
             {
@@ -83,22 +262,40 @@ async def finalize_upload(
             },
         )
 
-    try:
-        with open(file_path, "rb") as f:
-            content = f.read()
+    # From here the job owns the files, and reuses what was already parsed
+    files = [
+        (str(entry.path), cast(Optional[str], entry.filename), str(entry.content_hash))
+        for entry in entries
+    ]
+    await run_in_threadpool(claim, db, entries)
 
-        count = process_revolut_file(content, person, db)
-        message = f"Successfully processed {count} records for {person}."
-        msg_type = "success"
+    if len(files) > 1:
+        batch = [
+            (path, person_name, filename)
+            for (path, filename, _), person_name in zip(files, person)
+        ]
+        batch_id = await _enqueue_batch(background_tasks, db, batch)
+        return await _render_batch(request, user, db, batch_id)
 
-        # Cleanup
-        os.remove(file_path)
+    path, filename, content_hash = files[0]
+    return await _enqueue(
+        request,
+        background_tasks,
+        db,
+        user,
+        person[0],
+        path,
+        filename,
+        content_hash,
+    )
 
-    except Exception as e:
-        message = f"Error processing file: {str(e)}"
-        msg_type = "error"
 
-    return templates.TemplateResponse(
-        "index.html",
-        {"request": request, "user": user, "message": message, "msg_type": msg_type},
-    )
+@router.get("/uploads")
+def get_uploads(
+    person: Optional[str] = None,
+    month: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user: dict = Depends(require_auth),
+):
+    """Upload ledger: which files were ingested and which months they fed."""
+    return list_uploads(db, person, month)
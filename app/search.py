@@ -0,0 +1,93 @@
+"""
+Merchant search over monthly_summaries.
+
+Descriptions are indexed in the summaries_fts FTS5 table (see models), which
+triggers keep in step with the summaries as they are written. Each word of a
+query matches as a prefix, so "tes ex" finds "Tesco Express"; the matching
+summaries are then totalled per month and per person in SQL.
+"""
+
+import re
+from typing import Any, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from .models import MonthlySummary
+from .reporting import _filter
+from .rollup import complete_sum
+
+# Matching merchant names listed with the results
+MAX_MERCHANTS = 50
+
+_TOKEN = re.compile(r"\w+")
+
+
+def match_query(q: str) -> Optional[str]:
+    """
+    The FTS5 MATCH expression for a search box query: every word as a quoted
+    prefix, so punctuation and FTS5 operators in the input are taken literally.
+    None if there is nothing to search for.
+    """
+    tokens = _TOKEN.findall(q)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search_totals(
+    db: Session,
+    q: str,
+    person: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+) -> dict[str, Any]:
+    """
+    Totals of the summaries whose description matches `q`: {months, people,
+    merchants}. Months and people are lists of rows with total_amount and
+    reporting_amount per currency (None where a summary has no conversion),
+    newest month first.
+    """
+    match = match_query(q)
+    if match is None:
+        return {"months": [], "people": [], "merchants": []}
+
+    matching = _filter(
+        select(MonthlySummary).where(
+            MonthlySummary.id.in_(
+                text(
+                    "SELECT rowid FROM summaries_fts WHERE summaries_fts MATCH :match"
+                ).bindparams(match=match)
+            )
+        ),
+        person=person,
+        month_from=month_from,
+        month_to=month_to,
+    ).subquery()
+
+    def totals(*keys):
+        return select(
+            *keys,
+            matching.c.currency,
+            func.sum(matching.c.total_amount).label("total_amount"),
+            complete_sum(matching.c.reporting_amount).label("reporting_amount"),
+            func.count().label("merchant_count"),
+        ).group_by(*keys, matching.c.currency)
+
+    months = db.execute(
+        totals(matching.c.month_year, matching.c.person_name).order_by(
+            matching.c.month_year.desc(), matching.c.person_name, matching.c.currency
+        )
+    ).all()
+    people = db.execute(
+        totals(matching.c.person_name).order_by(
+            matching.c.person_name, matching.c.currency
+        )
+    ).all()
+    merchants = db.scalars(
+        select(matching.c.description)
+        .distinct()
+        .order_by(matching.c.description)
+        .limit(MAX_MERCHANTS)
+    ).all()
+    return {"months": months, "people": people, "merchants": merchants}
@@ -0,0 +1,236 @@
+"""
+Store for uploads waiting on a person.
+
+A file shared to the app arrives before anyone has said whose statement it
+is. It is written to UPLOAD_DIR in blocks, off the event loop, and recorded
+in stashed_uploads with its owner, size, sniffed format and hash. Parsing
+starts straight away in the process pool, so by the time the person is
+picked, finalizing only has to write the result.
+
+Entries leave the store when they are finalized (the ingestion job takes the
+file over) or when the sweeper evicts them: after TEMP_UPLOAD_TTL_SECONDS,
+or oldest first while the store is over TEMP_UPLOAD_QUOTA_BYTES.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, NamedTuple, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import jobs
+from .config import settings
+from .ledger import BLOCK_SIZE
+from .locks import locked_commit, write_lock
+from .models import IngestionJob, StashedUpload
+
+# Leading bytes of the container formats parsers.FORMATS reads; csv is the
+# fallback. Kept here so the upload path does not import pandas.
+SIGNATURES = {b"PK\x03\x04": "xlsx", b"\xd0\xcf\x11\xe0": "xls"}
+
+
+class BodyLimitMiddleware:
+    """
+    Refuse request bodies over MAX_UPLOAD_BYTES with 413: straight away when
+    Content-Length says so, otherwise as soon as the streamed body passes the
+    limit, before the rest is read or spooled to disk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = settings.MAX_UPLOAD_BYTES
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = PlainTextResponse("Upload too large", status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Handled like any HTTPException raised by the endpoint
+                    raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def sniff_format(head: bytes) -> str:
+    for signature, name in SIGNATURES.items():
+        if head.startswith(signature):
+            return name
+    return "csv"
+
+
+def _append(dest: BinaryIO, digest, block: bytes):
+    digest.update(block)
+    dest.write(block)
+
+
+class WrittenUpload(NamedTuple):
+    file_id: str
+    path: str
+    size: int
+    format: str
+    content_hash: str
+
+
+async def write_upload(file: UploadFile) -> WrittenUpload:
+    """Copy an upload into UPLOAD_DIR, hashing and sniffing it on the way."""
+    file_id = str(uuid.uuid4())
+    path = jobs.stash_path(file_id)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    # Hashing and writing run on the threadpool a block at a time, so a large
+    # statement never holds up the event loop
+    dest = await run_in_threadpool(open, path, "wb")
+    try:
+        while block := await file.read(BLOCK_SIZE):
+            if not head:
+                head = block[:8]
+            size += len(block)
+            await run_in_threadpool(_append, dest, digest, block)
+    finally:
+        await run_in_threadpool(dest.close)
+    return WrittenUpload(file_id, path, size, sniff_format(head), digest.hexdigest())
+
+
+async def stash(db: Session, file: UploadFile, owner: Optional[str]) -> StashedUpload:
+    """
+    Write the upload and record it in the store, then start parsing it.
+    Commits.
+    """
+    written = await write_upload(file)
+    entry = StashedUpload(
+        id=written.file_id,
+        owner=owner,
+        filename=file.filename,
+        path=written.path,
+        size=written.size,
+        format=written.format,
+        content_hash=written.content_hash,
+    )
+    db.add(entry)
+    await run_in_threadpool(locked_commit, db)
+    # Loaded here rather than on the event loop when the caller reads it
+    await run_in_threadpool(db.refresh, entry)
+    jobs.start_parse(written.path)
+    return entry
+
+
+def find_stashed(
+    db: Session, file_ids: list[str], owner: Optional[str]
+) -> Optional[list[StashedUpload]]:
+    """The owner's entries in the order given, or None if any is gone."""
+    found = {
+        str(entry.id): entry
+        for entry in db.scalars(
+            select(StashedUpload).where(
+                StashedUpload.id.in_(file_ids), StashedUpload.owner == owner
+            )
+        )
+    }
+    if len(found) != len(set(file_ids)) or not all(
+        os.path.exists(entry.path) for entry in found.values()
+    ):
+        return None
+    return [found[file_id] for file_id in file_ids]
+
+
+def claim(db: Session, entries: list[StashedUpload]):
+    """
+    Hand the files over to ingestion: the sweeper no longer owns them.
+    Blocking, see locked_commit.
+    """
+    for entry in entries:
+        db.delete(entry)
+    locked_commit(db)
+
+
+def _evictions(entries: list[StashedUpload], now: datetime) -> list[StashedUpload]:
+    cutoff = now - timedelta(seconds=settings.TEMP_UPLOAD_TTL_SECONDS)
+    total = sum(int(entry.size or 0) for entry in entries)
+    evicted = []
+    # Oldest first: expired entries, then as many more as the quota needs
+    for entry in sorted(entries, key=lambda e: e.created_at):
+        if entry.created_at < cutoff or total > settings.TEMP_UPLOAD_QUOTA_BYTES:
+            evicted.append(entry)
+            total -= int(entry.size or 0)
+    return evicted
+
+
+# What jobs._parse_file writes next to an upload: the parse, and the partial
+# output of one in progress, named after the worker writing it
+_PARSED = re.compile(r"\.parsed(\.\d+)?$")
+
+
+def _orphans(db: Session, now: datetime) -> list[str]:
+    """
+    Files in UPLOAD_DIR older than the TTL that neither the store nor a
+    pending job refers to: failed jobs' uploads, or leftovers of a crash.
+    """
+    if not os.path.isdir(jobs.UPLOAD_DIR):
+        return []
+    in_use = set(db.scalars(select(StashedUpload.path)))
+    in_use.update(
+        db.scalars(
+            select(IngestionJob.file_path).where(
+                IngestionJob.status.in_(["queued", "running"])
+            )
+        )
+    )
+    cutoff = now.replace(tzinfo=timezone.utc).timestamp() - (
+        settings.TEMP_UPLOAD_TTL_SECONDS
+    )
+    orphans = []
+    for name in os.listdir(jobs.UPLOAD_DIR):
+        path = os.path.join(jobs.UPLOAD_DIR, name)
+        source = _PARSED.sub("", path)
+        if source not in in_use and os.path.getmtime(path) < cutoff:
+            orphans.append(path)
+    return orphans
+
+
+def sweep(db: Session, now: Optional[datetime] = None) -> int:
+    """Evict expired and over-quota entries, and orphaned files; returns how many."""
+    # created_at is stored as naive UTC
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    evicted = _evictions(list(db.scalars(select(StashedUpload))), now)
+    for entry in evicted:
+        jobs.discard_file(str(entry.path))
+        db.delete(entry)
+    db.commit()
+
+    orphans = _orphans(db, now)
+    for path in orphans:
+        jobs.discard_file(path)
+    return len(evicted) + len(orphans)
+
+
+def sweep_store(bind: Engine) -> int:
+    jobs.prune_parses()
+    # Every web worker runs a sweeper; one at a time sweeps
+    with write_lock(bind), Session(bind=bind) as db:
+        return sweep(db)
@@ -0,0 +1,91 @@
+"""
+Memory and time of the parse/prepare pipeline on one synthetic statement.
+
+    python -m benchmarks.pipeline --rows 500000 --format csv
+
+Reports read/prepare time, traced peak memory while streaming, the in-memory
+size of the prepared chunks and of their pickled form (what a worker hands
+back through the .parsed file), and the time of the SQL month aggregation
+over the result.
+"""
+
+import argparse
+import io
+import json
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .generate import generate_statement
+
+
+def measure(content: bytes) -> dict:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from app.metrics import IngestStats
+    from app.models import Base, Transaction
+    from app.processor import (
+        _aggregate_transactions,
+        ingest_transactions,
+        iter_transaction_chunks,
+    )
+
+    stats = IngestStats()
+    chunks = list(iter_transaction_chunks(io.BytesIO(content), stats))
+
+    # Second pass for memory only: tracing slows allocation-heavy code down
+    tracemalloc.start()
+    for _ in iter_transaction_chunks(io.BytesIO(content)):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "rows": sum(len(c) for c in chunks),
+        "read_seconds": stats.stages.get("read", 0.0),
+        "prepare_seconds": stats.stages.get("prepare", 0.0),
+        "peak_traced_bytes": peak,
+        "prepared_bytes": int(sum(c.memory_usage(deep=True).sum() for c in chunks)),
+        "pickled_bytes": sum(
+            len(pickle.dumps(c, protocol=pickle.HIGHEST_PROTOCOL)) for c in chunks
+        ),
+    }
+
+    with tempfile.TemporaryDirectory() as scratch:
+        engine = create_engine(f"sqlite:///{scratch}/pipeline.db")
+        Base.metadata.create_all(engine)
+        with Session(engine) as db:
+            ingest_transactions(chunks, "bench", db)
+            months = [m for (m,) in db.query(Transaction.month_year).distinct()]
+            start = time.perf_counter()
+            _aggregate_transactions(db, "bench", months)
+            result["aggregate_seconds"] = time.perf_counter() - start
+        engine.dispose()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="csv")
+    parser.add_argument("--merchants", type=int, default=200)
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args(argv)
+
+    content = generate_statement(
+        args.rows, args.format, merchants=args.merchants, currencies=["GBP", "EUR"]
+    )
+    result = {"format": args.format, "file_bytes": len(content), **measure(content)}
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text, file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
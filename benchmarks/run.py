@@ -0,0 +1,342 @@
+"""
+Benchmark ingestion and reporting against a scratch database.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 -o results.json
+    python -m benchmarks.run --sizes 1000000 --format csv --upload-max-rows 0
+
+For each size this records the per-stage ingestion timings, the end-to-end
+process_revolut_file time and peak memory growth, the /upload round-trip
+through the ASGI app and the /reports latency (cold, cached and 304) as the
+database grows. With --max-rss-growth-mib the run fails when an ingestion's
+memory grows past that budget, so bounded-memory ingestion stays bounded.
+
+Run from the project root. The database and uploads live in a temporary
+directory and AUTH_BYPASS is set, so the real database is never touched.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from .generate import generate_statement
+
+BENCH_USER = "bench@example.com"
+
+
+def _summary(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "max": ordered[-1],
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_ingest(content: bytes, person: str) -> dict:
+    """
+    process_revolut_file's ingestion on a fresh person, so nothing is
+    deduplicated away, with the per-stage timings ingest_batch records in
+    IngestStats. Stages are timed exclusively, so `unaccounted` is whatever
+    the end-to-end total spends outside them.
+    """
+    from sqlalchemy import func, select
+
+    from app.database import SessionLocal
+    from app.ledger import fingerprint
+    from app.metrics import IngestStats
+    from app.models import MonthlySummary
+    from app.processor import ingest_transactions, iter_transaction_chunks
+
+    stats = IngestStats()
+    stream = io.BytesIO(content)
+    with SessionLocal() as db:
+        start = time.perf_counter()
+        with stats.time("fingerprint"):
+            content_hash = fingerprint(stream)
+        ingest_transactions(
+            iter_transaction_chunks(stream, stats),
+            person,
+            db,
+            content_hash,
+            stats=stats,
+        )
+        total = time.perf_counter() - start
+
+        months, summaries = db.execute(
+            select(
+                func.count(MonthlySummary.month_year.distinct()), func.count()
+            ).where(MonthlySummary.person_name == person)
+        ).one()
+
+    return {
+        "rows_read": stats.rows.get("read", 0),
+        "card_payments": stats.rows.get("card_payments", 0),
+        "months": months,
+        "summaries": summaries,
+        "stages": stats.stages,
+        "unaccounted": total - sum(stats.stages.values()),
+        "total": total,
+    }
+
+
+def bench_process(content: bytes, person: str) -> float:
+    """End-to-end process_revolut_file, as the synchronous path calls it."""
+    from app.database import SessionLocal
+    from app.processor import process_revolut_file
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        process_revolut_file(content, person, db)
+        return time.perf_counter() - start
+    finally:
+        db.close()
+
+
+def _peak_rss() -> Optional[int]:
+    # VmHWM rather than ru_maxrss: Linux carries ru_maxrss over from the
+    # parent through fork and exec, so a child would start at our peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _ingest_rss(path: str, person: str):
+    # Runs in a fresh interpreter, see bench_memory. The baseline is taken
+    # once the app and pandas are imported, so only the ingestion counts.
+    from app.database import SessionLocal
+    from app.processor import process_revolut_file
+
+    baseline = _peak_rss()
+    with open(path, "rb") as f, SessionLocal() as db:
+        process_revolut_file(f, person, db)
+    print(json.dumps({"baseline": baseline, "peak": _peak_rss()}))
+
+
+def bench_memory(content: bytes, person: str, scratch: str) -> dict:
+    """
+    Peak RSS growth of process_revolut_file in its own process, against the
+    benchmark database. A process's peak never goes down, so each size gets
+    a fresh one. Empty where the peak cannot be read (not Linux).
+    """
+    path = os.path.join(scratch, "memory-statement")
+    with open(path, "wb") as f:
+        f.write(content)
+    code = f"from benchmarks.run import _ingest_rss; _ingest_rss({path!r}, {person!r})"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    os.remove(path)
+    rss = json.loads(result.stdout.splitlines()[-1])
+    if rss["peak"] is None:
+        return {}
+    return {
+        "baseline_bytes": rss["baseline"],
+        "peak_bytes": rss["peak"],
+        "growth_bytes": rss["peak"] - rss["baseline"],
+    }
+
+
+def bench_reports(client, repeat: int) -> dict:
+    from app.cache import report_cache
+
+    results: dict = {}
+    cold, warm, not_modified = [], [], []
+    for _ in range(repeat):
+        report_cache.clear()
+        start = time.perf_counter()
+        response = client.get("/reports")
+        cold.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+        start = time.perf_counter()
+        client.get("/reports").raise_for_status()
+        warm.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        client.get("/reports", headers={"If-None-Match": response.headers["etag"]})
+        not_modified.append(time.perf_counter() - start)
+
+    results["cold"] = _summary(cold)
+    results["cached"] = _summary(warm)
+    results["not_modified"] = _summary(not_modified)
+    results["bytes"] = len(response.content)
+    return results
+
+
+def bench_upload(client, content: bytes, person: str, filename: str) -> dict:
+    """
+    POST /upload and wait for the job. TestClient runs background tasks
+    before returning, so the job is finished by the time the POST returns.
+    """
+    start = time.perf_counter()
+    response = client.post(
+        "/upload",
+        files={"file": (filename, content, "application/octet-stream")},
+        data={"person": person},
+    )
+    posted = time.perf_counter() - start
+    response.raise_for_status()
+
+    job = client.get(response.headers["location"]).json()
+    if job["status"] != "done":
+        raise RuntimeError(f"Upload job did not finish: {job}")
+    return {
+        "round_trip": posted,
+        "record_count": job["record_count"],
+    }
+
+
+def _count_transactions() -> int:
+    from sqlalchemy import func, select
+
+    from app.database import SessionLocal
+    from app.models import Transaction
+
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(Transaction)) or 0
+
+
+def run(args, scratch: str) -> dict:
+    # The app reads its settings at import time, so configure it first
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ["AUTH_BYPASS"] = BENCH_USER
+    os.environ["ALLOWED_USERS"] = BENCH_USER
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    from fastapi.testclient import TestClient
+
+    from app import jobs
+    from app.main import app
+
+    jobs.UPLOAD_DIR = os.path.join(scratch, "uploads")
+
+    gen_kwargs = {
+        "merchants": args.merchants,
+        "currencies": args.currencies.split(","),
+        "date_format": args.date_format,
+    }
+    results = []
+    with TestClient(app) as client:
+        # First upload spins up the worker pool; keep it out of the numbers
+        bench_upload(
+            client, generate_statement(100, "csv", seed=999), "warmup", "w.csv"
+        )
+
+        for i, rows in enumerate(args.sizes):
+            start = time.perf_counter()
+            content = generate_statement(rows, args.format, seed=i, **gen_kwargs)
+            generated = time.perf_counter() - start
+            print(f"{rows} rows: {len(content)} bytes", file=sys.stderr)
+
+            entry = {
+                "rows": rows,
+                "file_bytes": len(content),
+                "generate": generated,
+                "ingest": bench_ingest(content, f"stages-{rows}"),
+                "process_revolut_file": bench_process(content, f"process-{rows}"),
+                "memory": bench_memory(content, f"memory-{rows}", scratch),
+            }
+            if rows <= args.upload_max_rows:
+                entry["upload"] = bench_upload(
+                    client, content, f"upload-{rows}", f"statement.{args.format}"
+                )
+            entry["db_transactions"] = _count_transactions()
+            entry["reports"] = bench_reports(client, args.repeat)
+            results.append(entry)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {
+            "format": args.format,
+            "repeat": args.repeat,
+            **gen_kwargs,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--merchants", type=int, default=200)
+    parser.add_argument("--currencies", default="GBP,EUR")
+    parser.add_argument("--date-format", default="%Y-%m-%d %H:%M:%S")
+    parser.add_argument("--repeat", type=int, default=5, help="Report runs per size")
+    parser.add_argument(
+        "--upload-max-rows",
+        type=int,
+        default=100_000,
+        help="Skip the /upload round-trip above this size",
+    )
+    parser.add_argument(
+        "--max-rss-growth-mib",
+        type=int,
+        help="Fail if an ingestion's peak RSS grows by more than this",
+    )
+    parser.add_argument("-o", "--output", default="benchmark-results.json")
+    args = parser.parse_args(argv)
+
+    # Run from the project root: templates and static files are found
+    # relative to it, only the database and uploads go to the scratch dir.
+    with tempfile.TemporaryDirectory(prefix="revolut-bench-") as scratch:
+        report = run(args, scratch)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.max_rss_growth_mib is not None:
+        budget = args.max_rss_growth_mib * 1024 * 1024
+        over = [
+            entry
+            for entry in report["results"]
+            if entry["memory"].get("growth_bytes", 0) > budget
+        ]
+        for entry in over:
+            growth = entry["memory"]["growth_bytes"] / 1024 / 1024
+            print(
+                f"{entry['rows']} rows: ingestion memory grew {growth:.0f} MiB, "
+                f"over the {args.max_rss_growth_mib} MiB budget",
+                file=sys.stderr,
+            )
+        if over:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Cold-start profile: import time of app.main and time to the first /health.
+
+    python -m benchmarks.startup -o startup.json
+
+Import times come from `python -X importtime`. Each measurement runs in a
+fresh interpreter against a scratch database, as a new container would.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+from .run import _git_commit
+
+
+def _env(scratch: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'startup.db')}"
+    return env
+
+
+def import_profile(scratch: str, top: int) -> dict:
+    """Cumulative import time per module, slowest first."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=_env(scratch),
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = (
+            field.strip() for field in line[len("import time:") :].split("|")
+        )
+        if not self_us.isdigit():
+            continue  # header line
+        modules.append((name, int(self_us), int(cumulative_us)))
+
+    total = next(cum for name, _, cum in modules if name == "app.main")
+    slowest = sorted(modules, key=lambda m: m[2], reverse=True)[:top]
+    return {
+        "app_main_seconds": total / 1e6,
+        "heavy_modules_loaded": sorted(
+            name for name, _, _ in modules if name in ("pandas", "numpy", "openpyxl")
+        ),
+        "slowest": [
+            {"module": name, "self": s / 1e6, "cumulative": c / 1e6}
+            for name, s, c in slowest
+        ],
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_health(scratch: str, timeout: float = 30.0) -> float:
+    """Seconds from spawning uvicorn until /health answers 200."""
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        env=_env(scratch),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{port}/health", timeout=1
+                ) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("Server did not answer /health in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="Modules to list")
+    parser.add_argument("-o", "--output", default="startup-results.json")
+    args = parser.parse_args(argv)
+
+    health = []
+    with tempfile.TemporaryDirectory(prefix="revolut-startup-") as scratch:
+        profile = import_profile(scratch, args.top)
+        for _ in range(args.repeat):
+            health.append(time_to_health(scratch))
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "imports": profile,
+        "time_to_health": {
+            "runs": len(health),
+            "min": min(health),
+            "median": statistics.median(health),
+            "max": max(health),
+        },
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"import app.main: {profile['app_main_seconds']:.3f}s, "
+        f"first /health: {report['time_to_health']['median']:.3f}s (median)",
+        file=sys.stderr,
+    )
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import io
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base
+
+
+@pytest.fixture
+def xls_bytes():
+    """Write a DataFrame as the bytes of an .xlsx workbook."""
+
+    def write(df):
+        output = io.BytesIO()
+        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False)
+        return output.getvalue()
+
+    return write
+
+
+@pytest.fixture
+def statement(xls_bytes):
+    """
+    Build a statement of card payments from (completed date, description,
+    amount) rows. A row may also give its own (fee, currency); the others
+    take `fee` and `currency`.
+    """
+
+    def build(rows, fee=0.0, currency="GBP"):
+        full = [tuple(row) + (fee, currency)[len(row) - 3 :] for row in rows]
+        dates, descriptions, amounts, fees, currencies = zip(*full)
+        return xls_bytes(
+            pd.DataFrame(
+                {
+                    "Type": "Card Payment",
+                    "Completed Date": dates,
+                    "Description": descriptions,
+                    "Amount": amounts,
+                    "Fee": fees,
+                    "Currency": currencies,
+                }
+            )
+        )
+
+    return build
+
+
+# Sample data construction
+@pytest.fixture
+def sample_xls(xls_bytes):
+    return xls_bytes(
+        pd.DataFrame(
+            {
+                "Type": ["Card Payment", "Card Payment", "Free", "Card Payment"],
+                "Product": ["Current", "Current", "Current", "Current"],
+                "Started": [
+                    "2023-01-01 10:00:00",
+                    "2023-01-02 11:00:00",
+                    "2023-01-03",
+                    "2023-02-01",
+                ],
+                "Completed Date": [
+                    "2023-01-01 10:00:00",
+                    "2023-01-02 11:00:00",
+                    "2023-01-03",
+                    "2023-02-01",
+                ],
+                "Description": ["Groceries", "Transport", "Fee", "Groceries"],
+                "Amount": [10.50, 5.00, 0.00, 20.00],
+                "Fee": [0.00, 0.10, 0.00, 0.00],
+                "Currency": ["GBP", "GBP", "GBP", "GBP"],
+            }
+        )
+    )
+
+
+@pytest.fixture
+def db_session():
+    # In-memory SQLite for testing; modules that need seeded data or a file
+    # database define their own
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
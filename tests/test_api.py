@@ -1,10 +1,14 @@
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.database import get_db, Base
 from app.auth import require_auth
+from app import jobs
+from app.config import settings
+import asyncio
 import io
+import json
 import pandas as pd
 import os
 from unittest.mock import patch
@@ -42,12 +46,14 @@ app.dependency_overrides[require_auth] = override_require_auth
 client = TestClient(app)
 
 
-def create_sample_xls_bytes():
+def create_sample_xls_bytes(
+    description="Test Expense", completed_date="2023-01-01 10:00:00"
+):
     data = {
         "Type": ["Card Payment"],
         "Product": ["Current"],
-        "Completed Date": ["2023-01-01 10:00:00"],
-        "Description": ["Test Expense"],
+        "Completed Date": [completed_date],
+        "Description": [description],
         "Amount": [10.00],
         "Fee": [0.00],
         "Currency": ["GBP"],
@@ -60,8 +66,9 @@ def create_sample_xls_bytes():
 
 
 def teardown_module(module):
-    if os.path.exists("./test.db"):
-        os.remove("./test.db")
+    for path in ("./test.db", "./test.db.lock"):
+        if os.path.exists(path):
+            os.remove(path)
     if os.path.exists("./temp_uploads"):
         import shutil
 
@@ -72,6 +79,7 @@ def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
     assert "Upload Expenses" in response.text
+    assert f"up to {settings.MAX_UPLOAD_BYTES / 2**20:g}MB" in response.text
     assert "test@example.com" in response.text
 
 
@@ -80,11 +88,61 @@ def test_upload_flow():
     files = {"file": ("test.xls", xls_content, "application/vnd.ms-excel")}
 
     response = client.post("/upload", files=files, data={"person": "Eva"})
-    if "Error processing file" in response.text:
-        print(response.text)
 
+    # Returns a job straight away; TestClient runs the background task
+    # before handing the response back, so the job has finished here.
+    assert response.status_code == 202
+    job_url = response.headers["location"]
+    assert job_url.split("/")[-1] in response.text
+
+    job = client.get(job_url).json()
+    assert job["status"] == "done", job["error"]
+    assert job["record_count"] == 1
+    assert job["person"] == "Eva"
+    assert job["stages"] == {"parse": "done", "write": "done"}
+    assert job["progress"] == 100
+
+
+def test_metrics_endpoint():
+    client.get("/reports")
+    response = client.get("/metrics")
     assert response.status_code == 200
-    assert "Successfully processed 1 records" in response.text
+    assert response.headers["content-type"].startswith("text/plain")
+
+    text = response.text
+    # Stage timings recorded by the upload above, including the worker's
+    assert 'repivot_ingest_stage_seconds_count{stage="read"}' in text
+    assert 'repivot_ingest_stage_seconds_count{stage="write_summaries"}' in text
+    assert 'repivot_ingestions_total{status="done"}' in text
+    assert 'route="/reports"' in text
+    assert 'route="/upload"' in text
+
+
+def test_bad_upload_is_rejected_before_parsing():
+    csv = b"Date,Amount\n2023-01-01,10\n"
+    files = {"file": ("bad.csv", csv, "text/csv")}
+    with patch("app.routers.upload.create_job") as create_job:
+        response = client.post("/upload", files=files, data={"person": "Eva"})
+    assert response.status_code == 422
+    assert "bad.csv: Missing required column(s)" in response.text
+    create_job.assert_not_called()
+
+    # Share Target flow: nothing is stashed either
+    response = client.post("/upload", files=files)
+    assert response.status_code == 422
+    assert "Finalize Upload" not in response.text
+
+
+def test_upload_size_limit(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 1024)
+    files = {"file": ("big.xls", b"x" * 2048, "application/vnd.ms-excel")}
+    response = client.post("/upload", files=files, data={"person": "Eva"})
+    assert response.status_code == 413
+
+
+def test_unknown_job():
+    response = client.get("/jobs/does-not-exist")
+    assert response.status_code == 404
 
 
 def test_share_target_flow():
@@ -104,18 +162,154 @@ def test_share_target_flow():
     # Check if file exists
     temp_path = f"temp_uploads/{known_uuid}.xls"
     assert os.path.exists(temp_path)
+    # Parsing started while the person is being picked
+    assert temp_path in jobs._parses
+
+    response = client.post(
+        "/upload/finalize", data={"file_id": "not-a-stash", "person": "Sophie"}
+    )
+    assert "expired or invalid" in response.text
 
     # 2. Finalize
     response = client.post(
         "/upload/finalize", data={"file_id": known_uuid, "person": "Sophie"}
     )
-    assert response.status_code == 200
-    assert "Successfully processed 1 records for Sophie" in response.text
+    assert response.status_code == 202
+    job = client.get(response.headers["location"]).json()
+    assert job["status"] == "done", job["error"]
+    assert job["record_count"] == 1
+    assert job["person"] == "Sophie"
 
     # File should be gone
     assert not os.path.exists(temp_path)
 
 
+def test_batch_upload():
+    files = [
+        (
+            "files",
+            ("a.xls", create_sample_xls_bytes("Batch A"), "application/vnd.ms-excel"),
+        ),
+        (
+            "files",
+            ("b.xls", create_sample_xls_bytes("Batch B"), "application/vnd.ms-excel"),
+        ),
+        (
+            "files",
+            (
+                "a-again.xls",
+                create_sample_xls_bytes("Batch A"),
+                "application/vnd.ms-excel",
+            ),
+        ),
+        ("files", ("broken.xls", b"not a statement", "application/vnd.ms-excel")),
+    ]
+    data = {"person": ["Eva", "Sophie", "Eva", "Eva"]}
+
+    response = client.post("/upload/batch", files=files, data=data)
+    assert response.status_code == 202
+    # Rejected by preflight before the batch ran
+    assert response.json()["files"][3]["status"] == "failed"
+    batch = client.get(response.headers["location"]).json()
+    assert batch["status"] == "done"
+    results = batch["files"]
+
+    assert [r["filename"] for r in results] == [
+        "a.xls",
+        "b.xls",
+        "a-again.xls",
+        "broken.xls",
+    ]
+    assert [r["status"] for r in results] == ["done", "done", "skipped", "failed"]
+    assert results[0]["record_count"] == 1
+    assert results[2]["record_count"] == 1
+    assert results[3]["error"]
+
+    response = client.get("/reports")
+    assert "Batch A" in response.text
+    assert "Batch B" in response.text
+
+    response = client.post(
+        "/upload/batch", files=files[:2], data={"person": ["Eva", "Eva", "Eva"]}
+    )
+    assert response.status_code == 422
+
+
+def test_share_target_multiple_files():
+    files = [
+        (
+            "file",
+            (
+                "one.xls",
+                create_sample_xls_bytes("Shared One"),
+                "application/vnd.ms-excel",
+            ),
+        ),
+        (
+            "file",
+            (
+                "two.xls",
+                create_sample_xls_bytes("Shared Two"),
+                "application/vnd.ms-excel",
+            ),
+        ),
+    ]
+    with patch("uuid.uuid4", side_effect=["share-1", "share-2"]):
+        response = client.post("/upload", files=files)
+    assert response.status_code == 200
+    assert "2 files uploaded" in response.text
+    assert "two.xls" in response.text
+
+    response = client.post(
+        "/upload/finalize",
+        data={
+            "file_id": ["share-1", "share-2"],
+            "filename": ["one.xls", "two.xls"],
+            "person": ["Eva", "Sophie"],
+        },
+    )
+    assert response.status_code == 202
+    assert "Processing 2 files..." in response.text
+    batch = client.get(response.headers["location"]).json()
+    assert [(f["person"], f["status"]) for f in batch["files"]] == [
+        ("Eva", "done"),
+        ("Sophie", "done"),
+    ]
+    assert not os.path.exists("temp_uploads/share-1.xls")
+    assert not os.path.exists("temp_uploads/share-2.xls")
+
+
+def test_upload_routes_keep_queries_off_the_event_loop():
+    on_loop = []
+
+    def check(conn, cursor, statement, parameters, context, executemany):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # A threadpool thread
+        on_loop.append(statement)
+
+    content = create_sample_xls_bytes("Off The Loop")
+    files = [
+        ("file", (name, content, "application/vnd.ms-excel"))
+        for name in ("x.xls", "y.xls")
+    ]
+    event.listen(engine, "before_cursor_execute", check)
+    try:
+        # A batch, then the same file alone, which is already up to date
+        client.post("/upload", files=files, data={"person": "Eva"})
+        client.post("/upload", files=files[:1], data={"person": "Eva"})
+        with patch("uuid.uuid4", side_effect=["loop-1", "loop-2"]):
+            client.post("/upload", files=files)
+        client.post(
+            "/upload/finalize",
+            data={"file_id": ["loop-1", "loop-2"], "person": ["Eva", "Sophie"]},
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", check)
+    assert on_loop == []
+
+
 def test_report_population():
     # View Report
     response = client.get("/reports")
@@ -124,3 +318,121 @@ def test_report_population():
     # "Eva" from test_upload_flow, "Sophie" from test_share_target_flow
     assert "Eva" in response.text
     assert "Sophie" in response.text
+    # Entries carry their currency: a merchant can have a row per currency
+    assert "10.00 GBP" in response.text
+
+
+def test_report_filters_from_form():
+    # Blank form fields arrive as empty strings
+    response = client.get("/reports?person=Eva&month_from=&month_to=&top=")
+    assert response.status_code == 200
+    assert "Test Expense" in response.text
+
+    response = client.get("/reports?top=0")
+    assert response.status_code == 422
+
+
+def test_export_summaries():
+    response = client.get("/reports/export.csv?person=Eva&month_from=2023-01")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "attachment" in response.headers["content-disposition"]
+    lines = response.text.splitlines()
+    assert lines[0].startswith("person_name,month_year,description")
+    assert any(line.startswith("Eva,2023-01,Test Expense,GBP") for line in lines)
+    assert not any(line.startswith("Sophie,") for line in lines)
+
+    response = client.get("/reports/export.ndjson?person=Sophie")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows and {row["person_name"] for row in rows} == {"Sophie"}
+
+    response = client.get("/reports/export.xlsx")
+    exported = pd.read_excel(io.BytesIO(response.content))
+    assert {"Eva", "Sophie"} <= set(exported["person_name"])
+
+    assert client.get("/reports/export.pdf").status_code == 404
+
+
+def test_search_merchants():
+    response = client.get("/search?q=test+exp&person=Eva")
+    assert response.status_code == 200
+    assert "Test Expense" in response.text
+
+    response = client.get("/search.json?q=test")
+    assert response.status_code == 200
+    data = response.json()
+    assert "Test Expense" in data["merchants"]
+    assert {"Eva", "Sophie"} <= {row["person_name"] for row in data["people"]}
+    assert all(row["month_year"] for row in data["months"])
+
+    assert client.get("/search.json?q=").json()["months"] == []
+
+
+def test_report_etag_and_cache():
+    response = client.get("/reports")
+    etag = response.headers["etag"]
+
+    response = client.get("/reports", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    # Different filters are a different representation
+    response = client.get("/reports?person=Eva", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    # Re-uploading rows we already have changes nothing
+    content = create_sample_xls_bytes()
+    files = {"file": ("same.xls", content, "application/vnd.ms-excel")}
+    client.post("/upload", files=files, data={"person": "Eva"})
+    response = client.get("/reports", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # New rows bump the data version, so the old ETag no longer matches
+    content = create_sample_xls_bytes("Another Expense")
+    files = {"file": ("new.xls", content, "application/vnd.ms-excel")}
+    client.post("/upload", files=files, data={"person": "Eva"})
+    response = client.get("/reports", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_duplicate_upload_is_short_circuited():
+    content = create_sample_xls_bytes("Duplicate Expense")
+    files = {"file": ("dup.xls", content, "application/vnd.ms-excel")}
+    response = client.post("/upload", files=files, data={"person": "Sophie"})
+    assert response.status_code == 202
+
+    response = client.post("/upload", files=files, data={"person": "Sophie"})
+    assert response.status_code == 200
+    assert "already up to date for Sophie" in response.text
+
+    ledger = client.get("/uploads", params={"person": "Sophie", "month": "2023-01"})
+    entry = next(u for u in ledger.json() if u["filename"] == "dup.xls")
+    assert entry["month_from"] == entry["month_to"] == "2023-01"
+    assert entry["months_fed"] == {"2023-01": 1}
+
+
+def test_report_streams_months_and_loads_older_ones_as_fragments():
+    content = create_sample_xls_bytes("December Expense", "2022-12-05 10:00:00")
+    files = {"file": ("december.xls", content, "application/vnd.ms-excel")}
+    client.post("/upload", files=files, data={"person": "Eva"})
+
+    # First request for this data version is streamed
+    streamed = client.get("/reports?person=Eva&months=1")
+    assert streamed.status_code == 200
+    assert "2023-01" in streamed.text
+    assert "December Expense" not in streamed.text
+    assert 'data-next="/reports/months?person=Eva&amp;months=1&amp;before=2023-01"' in (
+        streamed.text
+    )
+
+    fragment = client.get("/reports/months?person=Eva&months=1&before=2023-01")
+    assert fragment.status_code == 200
+    assert "December Expense" in fragment.text
+    assert "<html" not in fragment.text
+    assert "data-next" not in fragment.text
+
+    # The cached render is the same page
+    cached = client.get("/reports?person=Eva&months=1")
+    assert cached.text == streamed.text
+    assert cached.headers["etag"] == streamed.headers["etag"]
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import Base, make_async_engine, make_engine, run_read
+from app.locks import try_lock, write_lock
+from app.models import MonthlySummary
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+def test_sqlite_pragmas_applied(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL == 1
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        busy_timeout = conn.execute(text("PRAGMA busy_timeout")).scalar()
+        assert busy_timeout == settings.DB_BUSY_TIMEOUT_MS
+    engine.dispose()
+
+
+def test_write_lock_excludes_other_processes(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'locked.db'}")
+    lock_file = str(tmp_path / "locked.db.lock")
+    with write_lock(engine):
+        # flock() locks belong to the open file, so this stands in for
+        # another worker process
+        with try_lock(lock_file) as acquired:
+            assert not acquired
+    with try_lock(lock_file) as acquired:
+        assert acquired
+    engine.dispose()
+
+
+def _count(db: Session) -> int:
+    return db.query(MonthlySummary).count()
+
+
+@pytest.mark.asyncio
+async def test_run_read_on_async_session(tmp_path):
+    path = tmp_path / "async.db"
+    sync_engine = make_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync_engine)
+    with Session(sync_engine) as db:
+        db.add(
+            MonthlySummary(
+                person_name="Eva",
+                month_year="2023-01",
+                description="Shop",
+                total_amount=1.0,
+                currency="GBP",
+            )
+        )
+        db.commit()
+
+    async_engine = make_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with async_sessionmaker(async_engine)() as session:
+        assert await run_read(session, _count) == 1
+
+    # The same helper pushes sync sessions onto the threadpool
+    with Session(sync_engine) as db:
+        assert await run_read(db, _count) == 1
+
+    await async_engine.dispose()
+    sync_engine.dispose()
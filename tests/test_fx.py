@@ -0,0 +1,155 @@
+import pytest
+import numpy as np
+import pandas as pd
+from app.dependencies import templates
+from app.fx import load_rates, load_rates_file, reconvert, to_reporting
+from app.models import MonthlySummary, PersonMonthTotal, Transaction
+from app.processor import process_revolut_file
+from app.reporting import load_report
+
+RATES_CSV = """date,currency,rate
+2023-01-01,EUR,0.90
+2023-01-10,EUR,0.80
+2023-01-05,USD,0.75
+"""
+
+
+@pytest.fixture
+def rates_file(tmp_path):
+    path = tmp_path / "rates.csv"
+    path.write_text(RATES_CSV)
+    return str(path)
+
+
+@pytest.fixture
+def payments(statement):
+    # (completed date, description, amount, fee, currency)
+    return statement(
+        [
+            ("2023-01-03 10:00:00", "Cafe", -10.0, 0.0, "EUR"),
+            ("2023-01-12 10:00:00", "Cafe", -10.0, -1.0, "EUR"),
+            ("2023-01-02 10:00:00", "Tesco", -20.0, 0.0, "GBP"),
+            ("2023-01-04 10:00:00", "Diner", -4.0, 0.0, "USD"),
+        ]
+    )
+
+
+def test_to_reporting_uses_rate_as_of_each_date(db_session, rates_file):
+    load_rates_file(db_session, rates_file)
+    chunk = pd.DataFrame(
+        {
+            "completed_at": pd.to_datetime(
+                [
+                    "2023-01-12 09:00",  # after the second EUR rate
+                    "2023-01-10 23:59",  # same day as it
+                    "2023-01-09 23:59",  # still on the first
+                    "2023-01-02 00:00",  # before the first USD rate: uses it
+                    "2023-01-02 00:00",
+                    "2023-01-02 00:00",
+                ]
+            ),
+            "amount": [-10.0, -10.0, -10.0, -4.0, -5.0, -1.0],
+            "fee": [-1.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+            "currency": pd.Categorical(["EUR", "EUR", "EUR", "USD", "GBP", "CHF"]),
+        },
+        index=[7, 3, 5, 1, 0, 2],
+    )
+    converted = to_reporting(chunk, load_rates(db_session), "GBP")
+    assert list(converted.index) == [7, 3, 5, 1, 0, 2]
+    np.testing.assert_allclose(converted.to_numpy()[:5], [-8.8, -8.0, -9.0, -3.0, -5.0])
+    # No rates at all for the currency
+    assert np.isnan(converted.iloc[5])
+
+
+def test_ingestion_stores_converted_totals(db_session, rates_file, payments):
+    load_rates_file(db_session, rates_file)
+    process_revolut_file(payments, "Eva", db_session)
+
+    stored = {
+        (t.description, t.currency): t.reporting_amount
+        for t in db_session.query(Transaction)
+    }
+    assert stored[("Tesco", "GBP")] == pytest.approx(-20.0)
+    assert stored[("Diner", "USD")] == pytest.approx(-3.0)
+
+    summary = db_session.query(MonthlySummary).filter_by(description="Cafe").one()
+    assert (summary.total_amount, summary.currency) == (-21.0, "EUR")
+    assert summary.reporting_amount == pytest.approx(-9.0 - 8.8)
+
+    rollup = db_session.query(PersonMonthTotal).filter_by(currency="EUR").one()
+    assert rollup.reporting_amount == pytest.approx(-17.8)
+
+    report = load_report(db_session, ["2023-01"])["2023-01"]["Eva"]
+    assert sorted(report["totals"]) == [("EUR", -21.0), ("GBP", -20.0), ("USD", -4.0)]
+    assert report["reporting_total"] == pytest.approx(-17.8 - 20.0 - 3.0)
+
+
+def test_same_merchant_in_two_currencies_converts_each(
+    db_session, rates_file, statement
+):
+    load_rates_file(db_session, rates_file)
+    content = statement(
+        [
+            ("2023-01-03 10:00:00", "Cafe", -10.0, 0.0, "EUR"),
+            ("2023-01-12 10:00:00", "Cafe", -10.0, 0.0, "EUR"),
+            ("2023-01-04 10:00:00", "Cafe", -5.0, 0.0, "GBP"),
+        ]
+    )
+    process_revolut_file(content, "Eva", db_session)
+
+    summaries = {
+        s.currency: (s.total_amount, s.reporting_amount)
+        for s in db_session.query(MonthlySummary).filter_by(description="Cafe")
+    }
+    assert summaries == {
+        "EUR": (-20.0, pytest.approx(-9.0 - 8.0)),
+        "GBP": (-5.0, pytest.approx(-5.0)),
+    }
+    report = load_report(db_session, ["2023-01"])["2023-01"]["Eva"]
+    assert report["reporting_total"] == pytest.approx(-22.0)
+
+    # Two Cafe rows, told apart by currency; EUR also shows what it ranks by
+    html = templates.get_template("report_month.html").render(
+        month="2023-01", month_data={"Eva": report}, reporting_currency="GBP"
+    )
+    assert "-20.00 EUR" in html
+    assert "-17.00 GBP" in html
+    assert "-5.00 GBP" in html
+
+    # Reconverting sums each currency's rows on their own as well
+    assert reconvert(db_session) == 3
+    report = load_report(db_session, ["2023-01"])["2023-01"]["Eva"]
+    assert report["reporting_total"] == pytest.approx(-22.0)
+
+
+def test_missing_rate_makes_total_unknown_until_reconverted(
+    db_session, rates_file, payments
+):
+    process_revolut_file(payments, "Eva", db_session)
+
+    report = load_report(db_session, ["2023-01"])["2023-01"]["Eva"]
+    assert report["reporting_total"] is None
+    summary = db_session.query(MonthlySummary).filter_by(description="Tesco").one()
+    assert summary.reporting_amount == pytest.approx(-20.0)
+
+    load_rates_file(db_session, rates_file)
+    assert reconvert(db_session) == 4
+
+    # Same as-of rule as ingestion
+    stored = {
+        t.completed_at.day: t.reporting_amount for t in db_session.query(Transaction)
+    }
+    assert stored == pytest.approx({3: -9.0, 12: -8.8, 2: -20.0, 4: -3.0})
+    report = load_report(db_session, ["2023-01"])["2023-01"]["Eva"]
+    assert report["reporting_total"] == pytest.approx(-40.8)
+
+
+def test_bad_rates_file(db_session, tmp_path):
+    path = tmp_path / "rates.csv"
+    path.write_text("date,currency\n2023-01-01,EUR\n")
+    with pytest.raises(ValueError, match="Failed to read rates file"):
+        load_rates_file(db_session, str(path))
+
+    path.write_text("date,currency,rate\n2023-01-01,EUR,-1\n")
+    with pytest.raises(ValueError, match="must be positive"):
+        load_rates_file(db_session, str(path))
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+import anyio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, IngestionJob, MonthlySummary
+from app.jobs import (
+    batch_jobs,
+    batch_status,
+    create_batch,
+    create_job,
+    job_status,
+    pending_job_ids,
+    run_batch,
+    run_job,
+)
+from app.locks import try_lock, write_lock
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+async def test_interrupted_job_is_resumed(engine, tmp_path, sample_xls):
+    file_path = tmp_path / "statement.xls"
+    file_path.write_bytes(sample_xls)
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        job = create_job(db, "Eva", str(file_path), "statement.xls")
+        job_id = job.id
+        # Simulate a restart while the job was mid-parse
+        job.status = "running"
+        db.commit()
+
+        assert pending_job_ids(db) == [job_id]
+
+    await run_job(job_id, engine)
+
+    with Session() as db:
+        job = db.get(IngestionJob, job_id)
+        assert job_status(job)["status"] == "done"
+        assert job.record_count == 3
+        assert db.query(MonthlySummary).count() == 3
+        assert pending_job_ids(db) == []
+
+    assert not file_path.exists()
+
+
+async def test_failed_job_records_error(engine, tmp_path):
+    file_path = tmp_path / "broken.xls"
+    file_path.write_bytes(b"PK\x03\x04 not really a workbook")
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        job_id = create_job(db, "Eva", str(file_path), "broken.xls").id
+
+    await run_job(job_id, engine)
+
+    with Session() as db:
+        status = job_status(db.get(IngestionJob, job_id))
+        assert status["status"] == "failed"
+        assert status["stages"] == {"parse": "failed", "write": "pending"}
+        assert "Failed to read Excel file" in status["error"]
+
+    # Failed uploads are kept so the job can be retried
+    assert file_path.exists()
+
+
+async def test_job_held_by_another_worker_is_skipped(engine, tmp_path, sample_xls):
+    file_path = tmp_path / "statement.xls"
+    file_path.write_bytes(sample_xls)
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        job_id = create_job(db, "Eva", str(file_path), "statement.xls").id
+
+    # Another worker resumed the job first and is still running it
+    with try_lock(str(file_path)) as claimed:
+        assert claimed
+        await run_job(job_id, engine)
+        with Session() as db:
+            assert db.get(IngestionJob, job_id).status == "queued"
+
+    await run_job(job_id, engine)
+    with Session() as db:
+        assert db.get(IngestionJob, job_id).status == "done"
+    # Nothing left for a late resume to do
+    await run_job(job_id, engine)
+
+
+async def test_identical_job_is_skipped(engine, tmp_path, sample_xls):
+    # The same file queued twice before either ran, e.g. from two devices
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        job_ids = []
+        for name in ("first.xls", "second.xls"):
+            (tmp_path / name).write_bytes(sample_xls)
+            job_ids.append(create_job(db, "Eva", str(tmp_path / name), name).id)
+
+    for job_id in job_ids:
+        await run_job(job_id, engine)
+
+    with Session() as db:
+        status = job_status(db.get(IngestionJob, job_ids[1]))
+        assert (status["status"], status["record_count"]) == ("skipped", 3)
+        assert status["progress"] == 100
+        assert db.query(MonthlySummary).count() == 3
+    assert not (tmp_path / "second.xls").exists()
+
+
+async def test_batch_jobs_are_written_together(engine, tmp_path, sample_xls):
+    paths = []
+    for name in ("a.xls", "a-again.xls", "held.xls"):
+        paths.append(tmp_path / name)
+        paths[-1].write_bytes(sample_xls)
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        batch_id = create_batch(
+            db,
+            [
+                (str(paths[0]), "Eva", "a.xls"),
+                (str(paths[1]), "Eva", "a-again.xls"),
+                (None, "Eva", "broken.xls"),
+                (str(paths[2]), "Sophie", "held.xls"),
+            ],
+            [None, None, "Not a statement", None],
+        )
+
+    # Another worker resumed the last job on its own and is still running it
+    with try_lock(str(paths[2])):
+        await run_batch(batch_id, engine)
+
+    with Session() as db:
+        batch = batch_status(batch_id, batch_jobs(db, batch_id))
+        assert batch["status"] == "running"
+        assert [(f["filename"], f["status"]) for f in batch["files"]] == [
+            ("a.xls", "done"),
+            ("a-again.xls", "skipped"),
+            ("broken.xls", "failed"),
+            ("held.xls", "queued"),
+        ]
+        assert batch["files"][1]["record_count"] == 3
+        assert pending_job_ids(db) == [batch["files"][3]["id"]]
+    assert not paths[0].exists() and paths[2].exists()
+
+
+def test_job_writes_wait_for_the_writer(tmp_path):
+    # An ingestion holds SQLite's write lock for longer than the busy
+    # timeout; creating a job queues on write_lock rather than failing with
+    # "database is locked"
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'busy.db'}", connect_args={"timeout": 0.1}
+    )
+    Base.metadata.create_all(engine)
+    writing = threading.Event()
+
+    def ingest():
+        with write_lock(engine), engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO ingestion_jobs (id, status) VALUES ('other', 'running')"
+            )
+            writing.set()
+            time.sleep(0.5)
+
+    writer = threading.Thread(target=ingest)
+    writer.start()
+    writing.wait()
+    with sessionmaker(bind=engine)() as db:
+        job_id = create_job(db, "Eva", "statement.xls", None).id
+        writer.join()
+        assert pending_job_ids(db) == ["other", job_id]
+    engine.dispose()
+
+
+async def test_jobs_waiting_to_write_leave_the_threadpool_free(
+    engine, tmp_path, sample_xls
+):
+    # Requests are served on anyio's threadpool; uploads queued behind a long
+    # write must not take its threads while they wait
+    Session = sessionmaker(bind=engine)
+    job_ids = []
+    with Session() as db:
+        for name in ("a.xls", "b.xls", "c.xls"):
+            (tmp_path / name).write_bytes(sample_xls)
+            job_ids.append(create_job(db, name, str(tmp_path / name), name).id)
+
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    with write_lock(engine):
+        tasks = [asyncio.create_task(run_job(job_id, engine)) for job_id in job_ids]
+        await asyncio.sleep(0.2)
+        assert not any(task.done() for task in tasks)
+        assert limiter.borrowed_tokens == 0
+    await asyncio.gather(*tasks)
+
+    with Session() as db:
+        assert {db.get(IngestionJob, i).status for i in job_ids} == {"done"}
@@ -0,0 +1,93 @@
+import pytest
+import pandas as pd
+from app.merchants import MerchantMatcher, add_rule, load_matcher, recanonicalise
+from app.models import MerchantRule, MonthlySummary, PersonMonthTotal, Transaction
+from app.processor import process_revolut_file
+from app.rollup import check_rollups
+
+
+def _payments(descriptions):
+    # 2.00 each, on consecutive days
+    return [
+        (f"2023-01-{i + 1:02d} 10:00:00", description, 2.0)
+        for i, description in enumerate(descriptions)
+    ]
+
+
+def _summaries(db):
+    return {
+        s.description: s.total_amount
+        for s in db.query(MonthlySummary).filter_by(person_name="Eva")
+    }
+
+
+def test_matcher_prefers_priority_over_position():
+    matcher = MerchantMatcher((("trip", "Uber Trips"), ("^uber", "Uber")))
+    assert matcher.match("Uber *Trip 1234") == "Uber Trips"
+    assert matcher.match("UBER EATS") == "Uber"
+    assert matcher.match("Tesco") is None
+
+    values = pd.Series(["Uber *Trip 1", "Tesco", "uber eats", "Uber *Trip 1"])
+    assert list(matcher.canonicalise(values)) == [
+        "Uber Trips",
+        None,
+        "Uber",
+        "Uber Trips",
+    ]
+    # Matched once per distinct description; "Tesco" was already cached
+    assert matcher.match.cache_info().currsize == 5
+
+
+def test_rules_apply_at_ingestion(db_session, statement):
+    add_rule(db_session, r"tfl travel ch", "TfL")
+    content = statement(_payments(["TFL TRAVEL CH", "TfL Travel Charge", "Tesco"]))
+
+    process_revolut_file(content, "Eva", db_session)
+
+    assert _summaries(db_session) == {"TfL": 4.0, "Tesco": 2.0}
+    # The raw description is kept alongside
+    raw = {t.description for t in db_session.query(Transaction)}
+    assert raw == {"TFL TRAVEL CH", "TfL Travel Charge", "Tesco"}
+
+
+def test_recanonicalise_existing_data(db_session, statement):
+    process_revolut_file(
+        statement(_payments(["Uber *Trip 1", "Uber *Trip 2", "Tesco"])),
+        "Eva",
+        db_session,
+    )
+    assert len(_summaries(db_session)) == 3
+
+    add_rule(db_session, r"uber \*trip", "Uber")
+    assert load_matcher(db_session).match("Uber *Trip 9") == "Uber"
+    assert recanonicalise(db_session) == (2, 1)
+
+    assert _summaries(db_session) == {"Uber": 4.0, "Tesco": 2.0}
+    total = db_session.query(PersonMonthTotal).one()
+    assert total.merchant_count == 2
+    assert check_rollups(db_session) == []
+
+    # Nothing left to change
+    assert recanonicalise(db_session) == (0, 0)
+
+
+def test_invalid_pattern_is_rejected(db_session):
+    with pytest.raises(ValueError, match="Invalid pattern"):
+        add_rule(db_session, "(", "Broken")
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        # Groups would clash with, or renumber, the matcher's own
+        "(?P<r0>TESCO)",
+        "(TESCO) \\1",
+        "(?P<shop>TESCO) (?P=shop)",
+        # Valid alone, but not as one alternative of the combined regex
+        "(?i)tesco",
+    ],
+)
+def test_pattern_must_fit_the_combined_matcher(db_session, pattern):
+    with pytest.raises(ValueError, match="Invalid pattern"):
+        add_rule(db_session, pattern, "Tesco")
+    assert db_session.query(MerchantRule).count() == 0
@@ -0,0 +1,52 @@
+import pickle
+import pytest
+from app.metrics import Histogram, IngestStats, _registry, rss_bytes
+
+
+def test_histogram_renders_cumulative_buckets():
+    hist = Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1))
+    _registry.remove(hist)
+    hist.observe(0.05, route="/a")
+    hist.observe(0.5, route="/a")
+    hist.observe(5, route="/a")
+
+    text = hist.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in text
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'test_seconds_count{route="/a"} 3' in text
+    assert hist.count(route="/a") == 3
+
+
+def test_ingest_stats_survive_pickling_and_merge():
+    worker = IngestStats()
+    # Time spent producing items is charged, time spent by the consumer is not
+    assert list(worker.timed_iter(range(3), "read")) == [0, 1, 2]
+    worker.count("read", 3)
+    worker.worker_rss_growth = 1024
+
+    parent = IngestStats()
+    with parent.time("write"):
+        pass
+    parent.merge(pickle.loads(pickle.dumps(worker)))
+
+    assert set(parent.stages) == {"read", "write"}
+    assert parent.rows == {"read": 3}
+    assert parent.worker_rss_growth == 1024
+
+
+@pytest.mark.skipif(rss_bytes() is None, reason="needs /proc")
+def test_rss_growth_is_per_ingestion():
+    first = IngestStats()
+    with first.time("read"):
+        held = b"x" * (64 * 1024 * 1024)
+    assert first.rss_growth() >= 60 * 1024 * 1024
+
+    # The process peak stays where the first ingestion left it; the next
+    # one is measured from its own start
+    del held
+    second = IngestStats()
+    with second.time("read"):
+        pass
+    assert second.rss_growth() < 60 * 1024 * 1024
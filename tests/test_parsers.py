@@ -0,0 +1,92 @@
+import io
+import pandas as pd
+import pytest
+from app import parsers
+from app.parsers import MONZO, REVOLUT, detect_layout, iter_statement_chunks
+from app.processor import iter_transaction_chunks
+
+REVOLUT_CSV = (
+    "Type,Product,Started Date,Completed Date,Description,Amount,Fee,Currency,"
+    "State,Balance\n"
+    "Card Payment,Current,2023-01-01 09:00:00,2023-01-01 10:00:00,Shop,-10.5,0,"
+    "GBP,COMPLETED,100\n"
+    "Topup,Current,2023-01-02 09:00:00,2023-01-02 10:00:00,Top up,50,0,"
+    "GBP,COMPLETED,150\n"
+)
+
+MONZO_CSV = (
+    "Transaction ID,Date,Time,Type,Name,Emoji,Category,Amount,Currency,Description\n"
+    "tx_1,03/02/2023,12:30:00,Card payment,Pret,,Eating out,-4.2,GBP,PRET A MANGER\n"
+    "tx_2,04/02/2023,08:00:00,Faster payment,Mum,,Transfers,20,GBP,POCKET MONEY\n"
+)
+
+
+def test_layout_detection():
+    assert detect_layout(["Completed Date", "Amount", "Currency", "Fee"]) is REVOLUT
+    assert detect_layout(MONZO_CSV.splitlines()[0].split(",")) is MONZO
+    # Unknown layouts fall back to Revolut so the usual errors apply
+    assert detect_layout(["foo", "bar"]) is REVOLUT
+
+
+def test_csv_reads_only_the_layout_columns():
+    (chunk,) = iter_statement_chunks(REVOLUT_CSV.encode())
+    assert list(chunk.columns) == [
+        "Type",
+        "Completed Date",
+        "Description",
+        "Amount",
+        "Fee",
+        "Currency",
+    ]
+    assert chunk["Amount"].dtype == "float64"
+
+
+def test_monzo_csv_maps_to_canonical_schema():
+    tx = pd.concat(list(iter_transaction_chunks(MONZO_CSV.encode())))
+    assert list(tx["description"]) == ["Pret"]
+    assert list(tx["amount"]) == [-4.2]
+    # Day-first dates: 3 February, not 2 March
+    assert list(tx["month_year"]) == ["2023-02"]
+
+
+def test_bad_csv_values_are_reported():
+    content = REVOLUT_CSV.replace("-10.5", "ten pounds").encode()
+    with pytest.raises(ValueError, match="Failed to read CSV file"):
+        list(iter_statement_chunks(content))
+
+
+def test_registered_format_is_used(monkeypatch):
+    def read_fixture(stream):
+        stream.read(6)
+        return iter_statement_chunks(io.BytesIO(stream.read()))
+
+    monkeypatch.setattr(parsers, "FORMATS", list(parsers.FORMATS))
+    parsers.register_format(b"BANK1\n", read_fixture)
+
+    (chunk,) = iter_statement_chunks(b"BANK1\n" + REVOLUT_CSV.encode())
+    assert len(chunk) == 2
+
+
+def test_preflight_checks_header_only():
+    assert parsers.preflight(REVOLUT_CSV.encode()) is REVOLUT
+    assert parsers.preflight(io.BytesIO(MONZO_CSV.encode())) is MONZO
+
+    xlsx = io.BytesIO()
+    pd.read_csv(io.StringIO(REVOLUT_CSV)).to_excel(xlsx, index=False)
+    stream = io.BytesIO(xlsx.getvalue())
+    assert parsers.preflight(stream) is REVOLUT
+    # Left at the start, ready for the full parse
+    assert stream.tell() == 0
+
+    # Values are not parsed, only the header row
+    assert parsers.preflight(REVOLUT_CSV.replace("-10.5", "ten").encode())
+
+    no_date = REVOLUT_CSV.replace("Completed Date", "Finished")
+    with pytest.raises(ValueError, match=r"Missing required column\(s\): Completed"):
+        parsers.preflight(no_date.encode())
+    with pytest.raises(ValueError, match="Missing required column"):
+        parsers.preflight(b"not a statement")
+    with pytest.raises(ValueError, match="Failed to read Excel file"):
+        parsers.preflight(b"PK\x03\x04 truncated")
+    with pytest.raises(ValueError, match="Failed to read CSV file"):
+        parsers.preflight(b"")
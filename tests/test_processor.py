@@ -1,56 +1,21 @@
 import pytest
 import pandas as pd
 import io
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app.models import Base, MonthlySummary
-from app.processor import process_revolut_file
-
-
-# Sample data construction
-def create_sample_xls():
-    data = {
-        "Type": ["Card Payment", "Card Payment", "Free", "Card Payment"],
-        "Product": ["Current", "Current", "Current", "Current"],
-        "Started": [
-            "2023-01-01 10:00:00",
-            "2023-01-02 11:00:00",
-            "2023-01-03",
-            "2023-02-01",
-        ],
-        "Completed Date": [
-            "2023-01-01 10:00:00",
-            "2023-01-02 11:00:00",
-            "2023-01-03",
-            "2023-02-01",
-        ],
-        "Description": ["Groceries", "Transport", "Fee", "Groceries"],
-        "Amount": [10.50, 5.00, 0.00, 20.00],
-        "Fee": [0.00, 0.10, 0.00, 0.00],
-        "Currency": ["GBP", "GBP", "GBP", "GBP"],
-    }
-    df = pd.DataFrame(data)
-
-    # Save to bytes
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
-    return output.getvalue()
-
+from datetime import datetime
+from app.cache import get_data_version
+from app.models import MonthlySummary, PersonMonthTotal, Transaction, Upload
+from app.processor import (
+    detect_date_format,
+    iter_transaction_chunks,
+    month_keys,
+    parse_dates,
+    process_revolut_file,
+)
+from app.rollup import check_rollups, rebuild_rollups
 
-@pytest.fixture
-def db_session():
-    # In-memory SQLite for testing
-    engine = create_engine("sqlite:///:memory:")
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    yield session
-    session.close()
 
-
-def test_process_revolut_file(db_session):
-    content = create_sample_xls()
+def test_process_revolut_file(db_session, sample_xls):
+    content = sample_xls
     person = "Eva"
 
     count = process_revolut_file(content, person, db_session)
@@ -95,8 +60,8 @@ def test_process_revolut_file(db_session):
     assert s3.total_amount == 20.00
 
 
-def test_overwrite_logic(db_session):
-    content = create_sample_xls()
+def test_overwrite_logic(db_session, sample_xls):
+    content = sample_xls
     person = "Eva"
 
     process_revolut_file(content, person, db_session)
@@ -106,3 +71,243 @@ def test_overwrite_logic(db_session):
 
     summaries = db_session.query(MonthlySummary).all()
     assert len(summaries) == 3
+
+
+def test_process_revolut_csv(db_session, sample_xls):
+    df = pd.read_excel(io.BytesIO(sample_xls))
+    content = df.to_csv(index=False).encode()
+
+    count = process_revolut_file(content, "Eva", db_session)
+
+    assert count == 3
+    s2 = (
+        db_session.query(MonthlySummary)
+        .filter_by(description="Transport", month_year="2023-01")
+        .first()
+    )
+    assert s2.total_amount == pytest.approx(5.10)
+
+
+def test_text_columns_are_categorical_with_stable_hashes(sample_xls):
+    content = sample_xls
+    (tx,) = [c for c in iter_transaction_chunks(content) if len(c)]
+    assert isinstance(tx["description"].dtype, pd.CategoricalDtype)
+    assert isinstance(tx["currency"].dtype, pd.CategoricalDtype)
+
+    # Row hashes must not change with the dtype, or re-uploads stop deduplicating
+    plain = tx.astype({"description": str, "currency": str})
+    key = pd.DataFrame(
+        {
+            "completed_at": plain["completed_at"].dt.as_unit("s").astype("int64"),
+            "description": plain["description"],
+            "amount": plain["amount"],
+            "fee": plain["fee"],
+            "currency": plain["currency"],
+        }
+    )
+    expected = pd.util.hash_pandas_object(key, index=False).to_numpy().view("int64")
+    assert list(tx["row_hash"]) == list(expected)
+
+
+def test_chunking_does_not_change_rows(monkeypatch, sample_xls):
+    content = sample_xls
+    expected = pd.concat(list(iter_transaction_chunks(content)), ignore_index=True)
+    assert list(expected["description"]) == ["Groceries", "Transport", "Groceries"]
+
+    # Force every row into its own chunk
+    monkeypatch.setattr("app.parsers.CHUNK_ROWS", 1)
+    chunked = pd.concat(
+        list(iter_transaction_chunks(io.BytesIO(content))), ignore_index=True
+    )
+
+    # Each chunk has its own categories, so compare the values
+    text = {"description": str, "currency": str}
+    pd.testing.assert_frame_equal(chunked.astype(text), expected.astype(text))
+
+
+def test_overlapping_upload_only_adds_new_rows(
+    db_session, monkeypatch, sample_xls, xls_bytes
+):
+    df = pd.read_excel(io.BytesIO(sample_xls))
+    process_revolut_file(sample_xls, "Eva", db_session)
+    assert db_session.query(Transaction).count() == 3
+
+    # A later export: the same January rows plus a new February payment, and
+    # two identical bus fares that must both count.
+    later = pd.concat([df.iloc[:2], df.iloc[[3, 3]]], ignore_index=True)
+    later.loc[2:, "Completed Date"] = "2023-02-15 09:00:00"
+    later.loc[2:, "Description"] = "Bus"
+    later.loc[2:, "Amount"] = 1.5
+
+    rewritten = []
+    monkeypatch.setattr(
+        "app.processor.refresh_rollups",
+        lambda db, person, months: rewritten.append(sorted(months)),
+    )
+    process_revolut_file(xls_bytes(later), "Eva", db_session)
+
+    assert db_session.query(Transaction).count() == 5
+    # January gained nothing, so only February was re-aggregated
+    assert rewritten == [["2023-02"]]
+    bus = (
+        db_session.query(MonthlySummary)
+        .filter_by(description="Bus", month_year="2023-02")
+        .one()
+    )
+    assert bus.total_amount == 3.0
+    groceries = (
+        db_session.query(MonthlySummary)
+        .filter_by(description="Groceries", month_year="2023-02")
+        .one()
+    )
+    assert groceries.total_amount == 20.00
+
+    # Same export again: nothing new at all
+    rewritten.clear()
+    process_revolut_file(xls_bytes(later), "Eva", db_session)
+    assert db_session.query(Transaction).count() == 5
+    assert rewritten == []
+
+
+def test_rollups_follow_ingestion(db_session, sample_xls):
+    process_revolut_file(sample_xls, "Eva", db_session)
+
+    rollups = {
+        r.month_year: (r.total_amount, r.merchant_count)
+        for r in db_session.query(PersonMonthTotal).filter_by(person_name="Eva")
+    }
+    assert rollups["2023-01"] == (pytest.approx(15.60), 2)
+    assert rollups["2023-02"] == (pytest.approx(20.00), 1)
+    assert check_rollups(db_session) == []
+
+    # Drift is detected and repaired by a rebuild
+    db_session.query(PersonMonthTotal).delete()
+    db_session.commit()
+    assert len(check_rollups(db_session)) == 2
+    version = get_data_version(db_session)
+    rebuild_rollups(db_session)
+    assert check_rollups(db_session) == []
+    # Cached reports and ETags built on the drifted headers are invalidated
+    assert get_data_version(db_session) == version + 1
+
+
+def test_upsert_keeps_overwrite_semantics(db_session, sample_xls):
+    # A month written before the file was uploaded, with a stale merchant
+    db_session.add_all(
+        [
+            MonthlySummary(
+                person_name="Eva",
+                month_year="2023-01",
+                description="Groceries",
+                total_amount=99.0,
+                currency="GBP",
+            ),
+            MonthlySummary(
+                person_name="Eva",
+                month_year="2023-01",
+                description="Old Shop",
+                total_amount=1.0,
+                currency="GBP",
+            ),
+        ]
+    )
+    db_session.commit()
+    groceries_id = (
+        db_session.query(MonthlySummary).filter_by(description="Groceries").one().id
+    )
+
+    process_revolut_file(sample_xls, "Eva", db_session)
+
+    january = {
+        s.description: s
+        for s in db_session.query(MonthlySummary).filter_by(month_year="2023-01")
+    }
+    assert set(january) == {"Groceries", "Transport"}
+    # Updated in place by the upsert
+    assert january["Groceries"].id == groceries_id
+    assert january["Groceries"].total_amount == 10.50
+
+
+def test_same_merchant_in_two_currencies(db_session, xls_bytes):
+    df = pd.DataFrame(
+        {
+            "Type": "Card Payment",
+            "Completed Date": [
+                "2023-01-03 10:00:00",
+                "2023-01-04 10:00:00",
+                "2023-01-05 10:00:00",
+            ],
+            "Description": "Amazon",
+            "Amount": [-10.0, -5.0, -20.0],
+            "Fee": 0.0,
+            "Currency": ["GBP", "GBP", "EUR"],
+        }
+    )
+    process_revolut_file(xls_bytes(df), "Eva", db_session)
+
+    def amazon():
+        return {
+            s.currency: s.total_amount
+            for s in db_session.query(MonthlySummary).filter_by(description="Amazon")
+        }
+
+    # One summary per currency, none overwriting the other
+    assert amazon() == {"GBP": -15.0, "EUR": -20.0}
+    rollups = {
+        r.currency: (r.total_amount, r.merchant_count)
+        for r in db_session.query(PersonMonthTotal)
+    }
+    assert rollups == {"GBP": (-15.0, 1), "EUR": (-20.0, 1)}
+
+    # A later payment in one currency leaves the other's summary alone
+    later = df.iloc[[2]].assign(**{"Completed Date": "2023-01-20 10:00:00"})
+    process_revolut_file(xls_bytes(later), "Eva", db_session)
+    assert amazon() == {"GBP": -15.0, "EUR": -40.0}
+
+
+def test_identical_file_is_skipped(db_session, monkeypatch, sample_xls):
+    content = sample_xls
+    assert process_revolut_file(content, "Eva", db_session, "jan.xls") == 3
+
+    upload = db_session.query(Upload).one()
+    assert (upload.month_from, upload.month_to) == ("2023-01", "2023-02")
+    assert upload.filename == "jan.xls"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("identical file should not be parsed again")
+
+    monkeypatch.setattr("app.processor.ingest_transactions", fail)
+    assert process_revolut_file(content, "Eva", db_session) == 3
+    # Same file for someone else is a separate upload
+    monkeypatch.undo()
+    process_revolut_file(content, "Sophie", db_session)
+    assert db_session.query(Upload).count() == 2
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["2023-01-01 10:00:00", "2023-01-02 11:00:00", "2023-01-03", None],
+        ["01/02/2023 10:11", "13/01/2023 09:00", "05/06/2023 10:00"],
+        ["13/01/2023", "14/01/2023", "05/06/2023"],
+        [datetime(2023, 1, 1, 5), "2023-03-04 10:00:00", "2023-03-05"],
+        ["1 Jan 2023", "2 Feb 2023 10:00"],
+    ],
+)
+def test_fast_date_parsing_matches_mixed(values):
+    column = pd.Series(values, dtype=object)
+    expected = pd.to_datetime(column, format="mixed", dayfirst=False)
+
+    parsed = parse_dates(column, detect_date_format(column))
+
+    pd.testing.assert_series_equal(parsed, expected)
+    pd.testing.assert_series_equal(
+        month_keys(parsed), expected.dt.strftime("%Y-%m"), check_dtype=False
+    )
+
+
+def test_day_first_format_falls_back_to_mixed():
+    # strptime would read these day first; the mixed parser reads 05/06 as May
+    column = pd.Series(["13/01/2023", "14/01/2023", "05/06/2023"])
+    assert detect_date_format(column) is None
+    assert detect_date_format(pd.Series(["2023-01-01 10:00:00"])) == "%Y-%m-%d %H:%M:%S"
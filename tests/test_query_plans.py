@@ -0,0 +1,134 @@
+"""
+Query plan regression tests: the report, rollup, export and ingestion queries
+must be index searches, without a full table scan or a temporary B-tree sort.
+A query that stops matching its index (a new ORDER BY, a changed expression)
+fails here rather than slowing down quietly.
+"""
+
+import re
+import pandas as pd
+import pytest
+from sqlalchemy import event
+from app.export import iter_summary_batches
+from app.processor import process_revolut_file
+from app.reporting import list_people, load_report, page_months
+
+TABLES = ("monthly_summaries", "person_month_totals", "transactions")
+# A full pass over a table rather than an index, e.g. "SCAN transactions"
+FULL_SCAN = re.compile(rf"^SCAN ({'|'.join(TABLES)})$")
+
+
+@pytest.fixture
+def year(statement):
+    """A statement of five shops a month for twelve months."""
+    months = pd.date_range("2023-01-03", periods=12, freq="MS")
+    return statement(
+        [(f"{m:%Y-%m}-03 10:00:00", f"Shop {i}", -i) for m in months for i in range(5)]
+    )
+
+
+def _plans(db, run) -> dict[str, list[str]]:
+    """EXPLAIN QUERY PLAN of every query `run` makes on TABLES, by its SQL."""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            captured.append((statement, parameters))
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    plans = {}
+    for statement, parameters in captured:
+        words = statement.split()
+        if words[0] not in ("SELECT", "DELETE", "INSERT", "UPDATE"):
+            continue
+        # The per-upload staging table is scanned and sorted by design
+        if "staged_transactions" in statement or not any(t in words for t in TABLES):
+            continue
+        rows = db.connection().exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, parameters
+        )
+        plans[" ".join(words)] = [row[3] for row in rows]
+    assert plans
+    return plans
+
+
+def _assert_indexed(plans: dict[str, list[str]], sorted_output: str = ""):
+    """
+    No full scans or sorts. Statements containing `sorted_output` may sort
+    their final rows, but nothing they read on the way.
+    """
+    for statement, plan in plans.items():
+        if sorted_output and sorted_output in statement:
+            if plan[-1] == "USE TEMP B-TREE FOR ORDER BY":
+                plan = plan[:-1]
+        for step in plan:
+            assert not FULL_SCAN.match(step), f"{step} in {statement}"
+            assert "TEMP B-TREE" not in step, f"{step} in {statement}"
+
+
+def _matching(plans: dict[str, list[str]], fragment: str) -> list[str]:
+    found = [plan for statement, plan in plans.items() if fragment in statement]
+    assert found, fragment
+    return [step for plan in found for step in plan]
+
+
+def test_ingestion_queries_use_indexes(db_session, year):
+    plans = _plans(db_session, lambda: process_revolut_file(year, "Eva", db_session))
+    _assert_indexed(plans)
+    # The delete of summaries that dropped out, and the rollup refresh
+    assert any(
+        "ix_transactions_person_month_merchant" in step
+        for step in _matching(plans, "DELETE FROM monthly_summaries")
+    )
+    assert any(
+        "COVERING INDEX ix_monthly_summaries_month_person_currency" in step
+        for step in _matching(plans, "INSERT INTO person_month_totals")
+    )
+
+
+def test_report_queries_use_indexes(db_session, year):
+    process_revolut_file(year, "Eva", db_session)
+    process_revolut_file(year, "Sophie", db_session)
+
+    def report():
+        page_months(db_session, 6)
+        page_months(db_session, 6, person="Eva", month_from="2023-03")
+        months, _ = page_months(db_session, 6)
+        load_report(db_session, months)
+        load_report(db_session, months, person="Eva", top=2)
+        list_people(db_session)
+
+    plans = _plans(db_session, report)
+    # The entries shown are ordered by rank; the window itself reads the index
+    # in order
+    _assert_indexed(plans, sorted_output="ORDER BY anon_1.month_year")
+    steps = _matching(plans, "FROM monthly_summaries")
+    assert any("COVERING INDEX ix_monthly_summaries_report" in s for s in steps)
+    # `top` is a filter on the rank in SQL, not applied to every entry fetched
+    assert _matching(plans, "WHERE anon_1.rank <= ?")
+
+
+def test_top_applies_to_entries_read_in_rank_order(db_session, year):
+    process_revolut_file(year, "Eva", db_session)
+    report = load_report(db_session, ["2023-02"], top=2)
+    entries = report["2023-02"]["Eva"]["entries"]
+    # Ranked by amount, descending, within the person's month
+    assert [(e.description, e.rank) for e in entries] == [
+        ("Shop 0", 1),
+        ("Shop 1", 2),
+    ]
+
+
+def test_export_by_person_and_range_uses_indexes(db_session, year):
+    process_revolut_file(year, "Eva", db_session)
+    plans = _plans(
+        db_session,
+        lambda: list(iter_summary_batches(db_session, "Eva", "2023-02", "2023-05")),
+    )
+    _assert_indexed(plans)
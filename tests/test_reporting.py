@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, MonthlySummary, PersonMonthTotal
+from app.reporting import list_people, load_report, page_months
+from app.rollup import rebuild_rollups
+
+
+@pytest.fixture
+def db_session():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    rows = []
+    for month in ["2023-01", "2023-02", "2023-03", "2023-04"]:
+        for person in ["Eva", "Sophie"]:
+            for i, description in enumerate(["Shop", "Bus", "Cafe"]):
+                rows.append(
+                    MonthlySummary(
+                        person_name=person,
+                        month_year=month,
+                        description=description,
+                        total_amount=float(i + 1),
+                        currency="GBP",
+                    )
+                )
+    session.add_all(rows)
+    session.commit()
+    rebuild_rollups(session)
+    yield session
+    session.close()
+
+
+def test_page_months_cursor(db_session):
+    page, cursor = page_months(db_session, months=3)
+    assert page == ["2023-04", "2023-03", "2023-02"]
+    assert cursor == "2023-02"
+
+    page, cursor = page_months(db_session, months=3, before=cursor)
+    assert page == ["2023-01"]
+    assert cursor is None
+
+
+def test_page_months_range(db_session):
+    page, cursor = page_months(db_session, month_from="2023-02", month_to="2023-03")
+    assert page == ["2023-03", "2023-02"]
+    assert cursor is None
+
+
+def test_load_report_totals_and_top(db_session):
+    report = load_report(db_session, ["2023-02"], top=2)
+
+    assert list(report) == ["2023-02"]
+    assert list(report["2023-02"]) == ["Eva", "Sophie"]
+
+    eva = report["2023-02"]["Eva"]
+    # Totals and counts cover every entry, not just the listed top N
+    assert eva["totals"] == [("GBP", 6.0)]
+    assert eva["count"] == 3
+    assert [e.description for e in eva["entries"]] == ["Cafe", "Bus"]
+
+
+def test_load_report_person_filter(db_session):
+    report = load_report(db_session, ["2023-01", "2023-02"], person="Sophie")
+    assert {p for month in report.values() for p in month} == {"Sophie"}
+    assert list_people(db_session) == ["Eva", "Sophie"]
+
+
+def test_load_report_lists_entries_without_rollup_rows(db_session):
+    # A stale rollup, or a database not yet rebuilt after an upgrade
+    db_session.query(PersonMonthTotal).filter_by(person_name="Sophie").delete()
+    db_session.commit()
+
+    sophie = load_report(db_session, ["2023-02"])["2023-02"]["Sophie"]
+    assert sophie["totals"] == []
+    assert [e.description for e in sophie["entries"]] == ["Cafe", "Bus", "Shop"]
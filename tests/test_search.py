@@ -0,0 +1,80 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.migrations import migrate
+from app.models import Base, MonthlySummary
+from app.processor import process_revolut_file
+from app.search import match_query, search_totals
+
+
+def _ingest(db, statement):
+    eva = [
+        ("2023-01-03 10:00:00", "Tesco Express", -5.0),
+        ("2023-01-09 10:00:00", "Tesco Stores", -20.0),
+        ("2023-02-01 10:00:00", "Tesco Stores", -7.5),
+        ("2023-02-02 10:00:00", "Testing Ltd", -1.0),
+    ]
+    process_revolut_file(statement(eva), "Eva", db)
+    sophie = [("2023-01-05 10:00:00", "TESCO", -3.0)]
+    process_revolut_file(statement(sophie), "Sophie", db)
+
+
+def test_match_query_quotes_every_word_as_a_prefix():
+    assert match_query("tesco  ex") == '"tesco"* "ex"*'
+    # FTS5 syntax in the input is not interpreted
+    assert match_query('tes" OR NEAR(') == '"tes"* "OR"* "NEAR"*'
+    assert match_query(" -*") is None
+
+
+def test_search_totals_per_month_and_person(db_session, statement):
+    _ingest(db_session, statement)
+
+    results = search_totals(db_session, "tesc")
+    assert results["merchants"] == ["TESCO", "Tesco Express", "Tesco Stores"]
+    months = {
+        (r.month_year, r.person_name): (r.total_amount, r.merchant_count)
+        for r in results["months"]
+    }
+    assert months == {
+        ("2023-02", "Eva"): (-7.5, 1),
+        ("2023-01", "Eva"): (-25.0, 2),
+        ("2023-01", "Sophie"): (-3.0, 1),
+    }
+    assert [r.month_year for r in results["months"]][0] == "2023-02"
+    people = {r.person_name: r.total_amount for r in results["people"]}
+    assert people == {"Eva": -32.5, "Sophie": -3.0}
+
+    # Every word has to match
+    results = search_totals(db_session, "tes st", person="Eva", month_to="2023-01")
+    assert [(r.month_year, r.total_amount) for r in results["months"]] == [
+        ("2023-01", -20.0)
+    ]
+    assert search_totals(db_session, "sainsbury")["months"] == []
+
+
+def test_index_follows_summary_changes(db_session, statement):
+    _ingest(db_session, statement)
+    summary = db_session.query(MonthlySummary).filter_by(description="TESCO").one()
+    summary.description = "Aldi"
+    db_session.commit()
+    assert search_totals(db_session, "ald")["merchants"] == ["Aldi"]
+    assert "TESCO" not in search_totals(db_session, "tesco")["merchants"]
+
+    db_session.query(MonthlySummary).filter_by(description="Aldi").delete()
+    db_session.commit()
+    assert search_totals(db_session, "ald")["merchants"] == []
+
+
+def test_migration_indexes_existing_summaries(tmp_path, statement):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    _ingest(session, statement)
+    # As if the summaries predate the index
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE summaries_fts")
+        conn.exec_driver_sql("PRAGMA user_version = 2")
+
+    migrate(engine)
+    assert len(search_totals(session, "tesco")["merchants"]) == 3
+    session.close()
+    engine.dispose()
@@ -0,0 +1,88 @@
+import subprocess
+import sys
+from sqlalchemy import create_engine, inspect
+from app.migrations import STEPS, migrate, schema_version
+
+
+def test_app_import_does_not_load_pandas(tmp_path):
+    code = (
+        "import sys, app.main; "
+        "print(sorted(m for m in ('pandas', 'openpyxl') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={"DATABASE_URL": f"sqlite:///{tmp_path / 'startup.db'}", "PATH": ""},
+    )
+    assert result.stdout.strip() == "[]"
+    # No DDL at import time either
+    assert not (tmp_path / "startup.db").exists()
+
+
+def test_migrate_creates_schema_and_is_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    migrate(engine)
+    migrate(engine)
+    tables = set(inspect(engine).get_table_names())
+    assert {"transactions", "monthly_summaries", "person_month_totals"} <= tables
+    engine.dispose()
+
+
+def test_migrate_adds_columns_to_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        # transactions as created before merchant canonicalisation
+        conn.exec_driver_sql(
+            "CREATE TABLE transactions (person_name VARCHAR, row_hash BIGINT, "
+            "occurrence INTEGER, completed_at DATETIME, month_year VARCHAR, "
+            "description VARCHAR, amount FLOAT, fee FLOAT, currency VARCHAR, "
+            "ingest_id VARCHAR, PRIMARY KEY (person_name, row_hash, occurrence))"
+        )
+
+    migrate(engine)
+
+    columns = {c["name"] for c in inspect(engine).get_columns("transactions")}
+    assert "merchant" in columns
+    with engine.connect() as conn:
+        assert schema_version(conn) == len(STEPS)
+    engine.dispose()
+
+
+def test_migrate_keys_summaries_by_currency(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        # monthly_summaries as created before the key included currency
+        conn.exec_driver_sql(
+            "CREATE TABLE monthly_summaries (id INTEGER PRIMARY KEY, "
+            "person_name VARCHAR, month_year VARCHAR, description VARCHAR, "
+            "total_amount FLOAT, currency VARCHAR, reporting_amount FLOAT, "
+            "CONSTRAINT d_p_m_desc_uc UNIQUE (person_name, month_year, description))"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO monthly_summaries VALUES "
+            "(7, 'Eva', '2023-01', 'Amazon', -15.0, 'GBP', -15.0)"
+        )
+
+    migrate(engine)
+
+    (key,) = inspect(engine).get_unique_constraints("monthly_summaries")
+    assert key["column_names"] == [
+        "person_name",
+        "month_year",
+        "description",
+        "currency",
+    ]
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO monthly_summaries (person_name, month_year, description, "
+            "total_amount, currency) VALUES ('Eva', '2023-01', 'Amazon', -20.0, 'EUR')"
+        )
+        # Ids and the search index survive the rebuild, and it stays in step
+        found = conn.exec_driver_sql(
+            "SELECT rowid FROM summaries_fts WHERE summaries_fts MATCH 'amazon' "
+            "ORDER BY rowid"
+        ).scalars()
+        assert list(found) == [7, 8]
+    engine.dispose()
@@ -0,0 +1,155 @@
+import io
+import os
+from datetime import datetime, timedelta
+import pytest
+import httpx
+from fastapi import FastAPI, Request, UploadFile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import jobs, uploads
+from app.config import settings
+from app.models import Base, IngestionJob, StashedUpload
+
+
+@pytest.fixture
+def db_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    # Nothing here needs the parse that stashing starts
+    monkeypatch.setattr(jobs, "start_parse", lambda path: None)
+    engine = create_engine(f"sqlite:///{tmp_path / 'uploads.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _entry(db, file_id, size, age_seconds, now):
+    path = jobs.stash_path(file_id)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    db.add(
+        StashedUpload(
+            id=file_id,
+            owner="eva@example.com",
+            path=path,
+            size=size,
+            created_at=now - timedelta(seconds=age_seconds),
+        )
+    )
+    db.commit()
+    return path
+
+
+def test_sniff_format():
+    assert uploads.sniff_format(b"PK\x03\x04rest") == "xlsx"
+    assert uploads.sniff_format(b"\xd0\xcf\x11\xe0rest") == "xls"
+    assert uploads.sniff_format(b"Type,Product") == "csv"
+
+
+async def test_stash_records_metadata(db_session, monkeypatch):
+    monkeypatch.setattr(uploads, "BLOCK_SIZE", 4)
+    upload = UploadFile(io.BytesIO(b"PK\x03\x04 a workbook"), filename="s.xlsx")
+    entry = await uploads.stash(db_session, upload, "eva@example.com")
+
+    with open(entry.path, "rb") as f:
+        assert f.read() == b"PK\x03\x04 a workbook"
+    assert (entry.size, entry.format, entry.filename) == (15, "xlsx", "s.xlsx")
+    assert len(entry.content_hash) == 64
+
+    assert uploads.find_stashed(db_session, [entry.id], "eva@example.com") == [entry]
+    # Someone else's upload cannot be finalized
+    assert uploads.find_stashed(db_session, [entry.id], "sophie@example.com") is None
+
+    uploads.claim(db_session, [entry])
+    assert db_session.query(StashedUpload).count() == 0
+    assert os.path.exists(entry.path)
+
+
+def test_sweep_evicts_by_ttl_then_quota(db_session, monkeypatch):
+    monkeypatch.setattr(settings, "TEMP_UPLOAD_TTL_SECONDS", 3600)
+    monkeypatch.setattr(settings, "TEMP_UPLOAD_QUOTA_BYTES", 250)
+    now = datetime.utcnow()
+    expired = _entry(db_session, "expired", 10, 7200, now)
+    oldest = _entry(db_session, "oldest", 100, 600, now)
+    older = _entry(db_session, "older", 100, 300, now)
+    newest = _entry(db_session, "newest", 100, 60, now)
+
+    # 300 bytes are fresh, so the oldest of them goes for the 250 byte quota
+    assert uploads.sweep(db_session, now) == 2
+    assert not os.path.exists(expired)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(newest)
+    assert {e.id for e in db_session.query(StashedUpload)} == {"older", "newest"}
+
+
+def test_sweep_removes_orphans_but_not_pending_jobs(db_session, monkeypatch):
+    monkeypatch.setattr(settings, "TEMP_UPLOAD_TTL_SECONDS", 3600)
+    old = datetime.utcnow().timestamp() - 7200
+    paths = {
+        "failed": jobs.stash_path("failed"),
+        "failed.xls.parsed": jobs.stash_path("failed") + ".parsed",
+        "queued": jobs.stash_path("queued"),
+        "recent": jobs.stash_path("recent"),
+    }
+    for name, path in paths.items():
+        with open(path, "wb") as f:
+            f.write(b"x")
+        if name != "recent":
+            os.utime(path, (old, old))
+    db_session.add(IngestionJob(id="job", file_path=paths["queued"], status="queued"))
+    db_session.commit()
+
+    assert uploads.sweep(db_session) == 2
+    assert not os.path.exists(paths["failed"])
+    assert not os.path.exists(paths["failed.xls.parsed"])
+    assert os.path.exists(paths["queued"])
+    assert os.path.exists(paths["recent"])
+
+
+def test_sweep_keeps_parses_in_progress(db_session, monkeypatch):
+    # A worker parsing a pending job's file writes it aside first; a long
+    # parse can outlast the TTL
+    monkeypatch.setattr(settings, "TEMP_UPLOAD_TTL_SECONDS", 3600)
+    old = datetime.utcnow().timestamp() - 7200
+    queued = jobs.stash_path("queued")
+    paths = [queued, f"{queued}.parsed.1234", jobs.stash_path("gone") + ".parsed.99"]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"x")
+        os.utime(path, (old, old))
+    db_session.add(IngestionJob(id="job", file_path=queued, status="running"))
+    db_session.commit()
+
+    # Only the leftover of a worker that died with its upload gone
+    assert uploads.sweep(db_session) == 1
+    assert os.path.exists(paths[0]) and os.path.exists(paths[1])
+    assert not os.path.exists(paths[2])
+
+
+async def test_body_limit_applies_while_streaming(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 1000)
+    app = FastAPI()
+    app.add_middleware(uploads.BodyLimitMiddleware)
+    read = []
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        async for block in request.stream():
+            read.append(len(block))
+        return {"bytes": sum(read)}
+
+    async def body(blocks):
+        for _ in range(blocks):
+            yield b"x" * 400
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+        # No Content-Length: the limit is enforced as the blocks arrive
+        response = await c.post("/echo", content=body(2))
+        assert response.json() == {"bytes": 800}
+
+        read.clear()
+        response = await c.post("/echo", content=body(10))
+        assert response.status_code == 413
+        assert sum(read) <= 1000